@@ -0,0 +1,142 @@
+"""
+Audio derived from videos the bot already sent ("🎵 Convert to MP3").
+
+- Sent videos are moved into a size-bounded LRU under ``downloads/recent``
+  instead of being deleted, so a conversion right after sending needs no
+  network at all.
+- ``extract_audio`` copies the audio stream as-is when Telegram can play
+  it (AAC → .m4a, MP3 → .mp3) and only transcodes other codecs.
+- The resulting audio ``file_id`` is cached, so converting the same video
+  again is a single ``sendAudio`` by id.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import shutil
+from collections import OrderedDict
+
+import tracing
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+RECENT_DIR = os.path.join("downloads", "recent")
+RECENT_VIDEO_MB = int(os.getenv("RECENT_VIDEO_MB", "512"))
+# Bot API file_ids don't expire; this only bounds memory
+AUDIO_ID_TTL = 7 * 24 * 3600
+
+# Audio codecs that go into a playable container without re-encoding
+_COPY_CONTAINERS = {"aac": "m4a", "mp3": "mp3"}
+
+_recent: OrderedDict[str, tuple[str, int]] = OrderedDict()
+_recent_bytes = 0
+_recent_ready = False
+_audio_ids = TTLCache(ttl=AUDIO_ID_TTL, maxsize=2048)
+
+
+def _evict(budget: int):
+    global _recent_bytes
+    while _recent and _recent_bytes > budget:
+        _key, (path, size) = _recent.popitem(last=False)
+        _recent_bytes -= size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _keep(key: str, path: str):
+    global _recent_bytes, _recent_ready
+    if not _recent_ready:
+        # Files from a previous run have no index entry; start empty
+        shutil.rmtree(RECENT_DIR, ignore_errors=True)
+        os.makedirs(RECENT_DIR, exist_ok=True)
+        _recent_ready = True
+
+    size = os.path.getsize(path)
+    if size > RECENT_VIDEO_MB * 1024 * 1024:
+        return
+    if key in _recent:
+        old_path, old_size = _recent.pop(key)
+        _recent_bytes -= old_size
+        if old_path != path and os.path.exists(old_path):
+            os.remove(old_path)
+    _evict(RECENT_VIDEO_MB * 1024 * 1024 - size)
+
+    dest = os.path.join(RECENT_DIR, f"{key}{os.path.splitext(path)[1]}")
+    os.replace(path, dest)
+    _recent[key] = (dest, size)
+    _recent_bytes += size
+
+
+async def remember_video(key: str, path: str):
+    """Move a just-sent video into the recent LRU (the caller's path goes away)."""
+    try:
+        await asyncio.to_thread(_keep, key, path)
+    except OSError as e:
+        logger.warning(f"Could not keep {path} for audio conversion: {e}")
+
+
+def recent_video(key: str) -> str | None:
+    """Local copy of the video sent under ``key``, if still cached."""
+    entry = _recent.get(key)
+    if not entry:
+        return None
+    if not os.path.exists(entry[0]):
+        _recent.pop(key, None)
+        return None
+    _recent.move_to_end(key)
+    return entry[0]
+
+
+def cached_audio(key: str) -> tuple[str, str] | None:
+    """``(file_id, title)`` of audio already sent for ``key``."""
+    return _audio_ids.get(key)
+
+
+def remember_audio(key: str, file_id: str, title: str):
+    _audio_ids.set(key, (file_id, title))
+
+
+@tracing.traced("ffprobe.audio_codec")
+async def audio_codec(path: str) -> str | None:
+    """Codec name of the first audio stream, or None if there is none."""
+    proc = await asyncio.create_subprocess_exec(
+        'ffprobe', '-v', 'error', '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name', '-of', 'csv=p=0', path,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    out, _ = await proc.communicate()
+    return out.decode().strip() or None
+
+
+@tracing.traced("extract_audio")
+async def extract_audio(video_path: str, out_dir: str, title: str) -> str | None:
+    """
+    Write the audio track of ``video_path`` to ``out_dir``; stream copy when
+    the codec fits a Telegram audio container, MP3 transcode otherwise.
+    Returns the audio path or None if the video has no audio.
+    """
+    codec = await audio_codec(video_path)
+    if not codec:
+        return None
+    title = re.sub(r'[\\/\0]', '_', title).strip() or "audio"
+
+    ext = _COPY_CONTAINERS.get(codec)
+    if ext:
+        out = os.path.join(out_dir, f"{title}.{ext}")
+        args = ['-vn', '-c:a', 'copy']
+    else:
+        out = os.path.join(out_dir, f"{title}.mp3")
+        args = ['-vn', '-c:a', 'libmp3lame', '-b:a', '192k']
+
+    proc = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-y', '-i', video_path, *args, out,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    _, stderr = await proc.communicate()
+    if proc.returncode != 0 or not os.path.exists(out):
+        logger.error(f"Audio extraction failed ({codec}): {stderr.decode()[-200:]}")
+        return None
+    logger.info(f"Audio extracted ({'copy' if ext else 'transcode'} {codec}): {out}")
+    return out
@@ -0,0 +1,176 @@
+"""
+Multi-URL message handling: one aggregated status message for a batch of
+concurrent jobs, and in-order delivery of their results.
+
+Each job gets a ``BatchItemStatus`` that quacks like the per-download
+status ``Message`` (``edit_text``/``delete``), so the existing download
+pipelines can report progress into their own line of the shared message.
+Jobs run concurrently, but ``result_slot()`` makes every job wait for the
+previous one to finish sending before it sends its own results.
+
+With separate workers (``job_queue``) an item runs in another process: the
+worker binds a ``RemoteItemStatus`` instead, which forwards its text to the
+front-end and takes its send turn from the queue.
+"""
+
+import asyncio
+import logging
+import secrets
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between edits of the shared status message (flood control)
+RENDER_INTERVAL = 1.5
+
+_current_item: ContextVar["BatchItemStatus | None"] = ContextVar("batch_item", default=None)
+
+
+class BatchItemStatus:
+    """One line of a ``BatchStatus``; stands in for a status ``Message``."""
+
+    def __init__(self, batch: "BatchStatus", index: int, label: str):
+        self.batch = batch
+        self.index = index
+        self.label = label
+        self.text = "🕓 En cola"
+        self.finished = False
+        self.sent = asyncio.Event()
+
+    async def edit_text(self, text: str, **kwargs):
+        self.text = text.replace("\n", " ")
+        self.batch.schedule_render()
+        return self
+
+    async def delete(self, **kwargs):
+        # Pipelines delete their status message once results are out; the
+        # shared message outlives the job, so just mark the line as sent.
+        self.text = "✅ Enviado"
+        self.batch.schedule_render()
+        return True
+
+    async def wait_turn(self):
+        """Wait until every earlier item has finished sending."""
+        if self.index > 0:
+            await self.batch.items[self.index - 1].sent.wait()
+
+    def finish(self):
+        self.finished = True
+        self.sent.set()
+        self.batch.schedule_render()
+
+
+class BatchStatus:
+    """Aggregated, throttled status message for a multi-URL batch."""
+
+    def __init__(self, message, labels: list[str]):
+        self.id = secrets.token_hex(8)
+        self.message = message
+        self.items = [BatchItemStatus(self, i, label) for i, label in enumerate(labels)]
+        self._last_render = 0.0
+        self._render_task: asyncio.Task | None = None
+        self._rendered = ""
+
+    def render(self) -> str:
+        done = sum(1 for item in self.items if item.finished)
+        lines = [f"📦 {done}/{len(self.items)} links"]
+        for item in self.items:
+            lines.append(f"{item.index + 1}. {item.label} — {item.text}")
+        return "\n".join(lines)
+
+    def schedule_render(self):
+        if self._render_task is None or self._render_task.done():
+            self._render_task = asyncio.create_task(self._render_later())
+
+    async def _render_later(self):
+        wait = self._last_render + RENDER_INTERVAL - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await self.flush()
+
+    async def flush(self):
+        text = self.render()
+        if text == self._rendered:
+            return
+        self._last_render = time.monotonic()
+        self._rendered = text
+        try:
+            await self.message.edit_text(text)
+        except Exception:
+            # Message deleted or edit raced — ignore
+            pass
+
+    async def run(self, job_factory):
+        """
+        Run ``job_factory(item)`` for every item concurrently and wait for
+        all of them. Each job runs with its item bound for ``result_slot``.
+        """
+
+        async def _run_one(item: BatchItemStatus):
+            _current_item.set(item)
+            try:
+                await job_factory(item)
+            except Exception as e:
+                logger.error(f"Batch job {item.index + 1} failed: {e}", exc_info=True)
+                item.text = f"❌ Error: {str(e)[:60]}"
+            finally:
+                item.finish()
+
+        await asyncio.gather(*(_run_one(item) for item in self.items))
+        if self._render_task and not self._render_task.done():
+            self._render_task.cancel()
+        await self.flush()
+
+
+class RemoteItemStatus:
+    """Worker-side stand-in for a ``BatchItemStatus`` owned by the front-end.
+
+    ``report(text)`` carries a line update back; ``wait_turn()`` returns once
+    the previous item of the batch has finished.
+    """
+
+    def __init__(self, report, wait_turn):
+        self._report = report
+        self._wait_turn = wait_turn
+
+    async def edit_text(self, text: str, **kwargs):
+        self._report(text.replace("\n", " "))
+        return self
+
+    async def delete(self, **kwargs):
+        self._report("✅ Enviado")
+        return True
+
+    async def wait_turn(self):
+        await self._wait_turn()
+
+
+def is_batch_item(status) -> bool:
+    """True if ``status`` is a batch line rather than a real Message."""
+    return isinstance(status, (BatchItemStatus, RemoteItemStatus))
+
+
+@contextmanager
+def bind(item):
+    """Bind ``item`` as the current job's batch line for ``result_slot``."""
+    token = _current_item.set(item)
+    try:
+        yield item
+    finally:
+        _current_item.reset(token)
+
+
+@asynccontextmanager
+async def result_slot():
+    """
+    Hold the send turn for the current job.
+
+    Outside a batch this is a no-op; inside one it waits until all earlier
+    links have delivered their results, so results arrive in message order.
+    """
+    item = _current_item.get()
+    if item is not None:
+        await item.wait_turn()
+    yield
@@ -0,0 +1,190 @@
+"""
+Encode benchmark for the ``compress_video`` attempt ladder.
+
+    python -m bench.compress_bench [--durations 15,60,180] [--heights 720,1080]
+                                   [--target-mb 48] [--encoders libx264,vaapi-full,vaapi-robust]
+                                   [--json results.json]
+
+Generates noisy synthetic clips (``bench.fixtures``) and runs every
+attempt of the ladder (``main._compress_ladder``) with every encode
+variant (``main._encode_commands``): libx264 always, the two VAAPI
+pipelines when ``vainfo`` finds the GPU. Every attempt is encoded, not
+only until the first fit, so the whole ladder can be retuned from one run.
+
+Per encode: wall time, output size, the size the attempt budgets for
+(``(vbr + audio) * duration``; VAAPI encodes at a fixed QP, so there it
+shows how far the QP table is from the budget) and whether it fits under
+``--target-mb``. The summary gives, per encoder, the first-attempt success
+rate, how many attempts ``compress_video`` would need and their total time.
+
+libx264 budgets only depend on bitrate, so a small ``--target-mb`` on a
+short clip stands in for a long clip at 48 MB (e.g. 60 s at 8 MB ~ 6 min).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench import fixtures  # noqa: E402
+
+ENCODERS = ("libx264", "vaapi-full", "vaapi-robust")
+
+
+def _import_main():
+    """Import the bot module for its encode ladder without touching the repo."""
+    os.environ.setdefault("BOT_TOKEN", "123456:bench")
+    os.environ["METRICS_PORT"] = "0"
+    workdir = tempfile.mkdtemp(prefix="compress_bench_")
+    os.makedirs(os.path.join(workdir, "logs"), exist_ok=True)
+    os.chdir(workdir)
+    import main
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+    return main, workdir
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _encode(args: list[str]) -> tuple[bool, float]:
+    start = time.perf_counter()
+    proc = subprocess.run(args, capture_output=True)
+    return proc.returncode == 0, time.perf_counter() - start
+
+
+def run_clip(main, clip: str, seconds: int, height: int, target_mb: int,
+             encoders: list[str], vaapi: bool, codec: str | None, workdir: str) -> list[dict]:
+    """Encode every (encoder, attempt) for one clip."""
+    rows = []
+    for encoder in encoders:
+        use_vaapi = encoder != "libx264"
+        if use_vaapi and not vaapi:
+            continue
+        ladder = main._compress_ladder(seconds, target_mb, use_vaapi)
+        for n, attempt in enumerate(ladder, 1):
+            out = os.path.join(workdir, f"bench_{encoder}_{n}.mp4")
+            variants = dict(main._encode_commands(clip, out, attempt, use_vaapi, codec))
+            if encoder not in variants:
+                # vaapi-full needs an H.264 source
+                break
+            ok, wall = _encode(variants[encoder])
+            size = os.path.getsize(out) if ok and os.path.exists(out) else 0
+            if os.path.exists(out):
+                os.remove(out)
+            budget = (attempt["vbr"] + main.AUDIO_BITRATE) * seconds / 8
+            rows.append({
+                "clip": f"{height}p/{seconds}s",
+                "encoder": encoder,
+                "attempt": n,
+                "res": attempt["res"].removeprefix("scale="),
+                "vbr_kbps": attempt["vbr"] // 1000,
+                "qp": attempt["qp"] if use_vaapi else None,
+                "ok": ok,
+                "wall_s": round(wall, 2),
+                "realtime_x": round(seconds / wall, 2) if wall else None,
+                "size_mb": round(size / 1048576, 2),
+                "budget_mb": round(budget / 1048576, 2),
+                "error_pct": round((size - budget) / budget * 100, 1) if ok else None,
+                "fits": ok and size <= target_mb * 1048576,
+            })
+    return rows
+
+
+def summarize(rows: list[dict]) -> dict:
+    """Per encoder: first-attempt success, attempts and time until the first fit."""
+    summary = {}
+    for encoder in ENCODERS:
+        mine = [r for r in rows if r["encoder"] == encoder]
+        if not mine:
+            continue
+        clips = sorted({r["clip"] for r in mine}, key=lambda c: [int(x.rstrip("ps")) for x in c.split("/")])
+        first_ok, needed, spent = 0, [], []
+        for clip in clips:
+            ladder = sorted((r for r in mine if r["clip"] == clip), key=lambda r: r["attempt"])
+            first_ok += ladder[0]["fits"]
+            fit = next((r for r in ladder if r["fits"]), None)
+            # compress_video stops at the first fit, or ships the last attempt
+            stop = fit["attempt"] if fit else len(ladder)
+            needed.append(stop)
+            spent.append(sum(r["wall_s"] for r in ladder[:stop]))
+        errors: dict[int, list[float]] = {}
+        for r in mine:
+            if r["error_pct"] is not None:
+                errors.setdefault(r["attempt"], []).append(r["error_pct"])
+        summary[encoder] = {
+            "clips": len(clips),
+            "first_attempt_success": round(first_ok / len(clips), 3),
+            "mean_attempts": round(statistics.fmean(needed), 2),
+            "mean_compress_s": round(statistics.fmean(spent), 2),
+            "mean_error_pct_by_attempt": {n: round(statistics.fmean(v), 1) for n, v in sorted(errors.items())},
+        }
+    return summary
+
+
+def print_table(rows: list[dict]):
+    header = (f"{'clip':<12} {'encoder':<13} {'try':>3} {'res':>8} {'kbps':>6} {'qp':>3} "
+              f"{'wall s':>7} {'x rt':>6} {'MB':>7} {'budget':>7} {'err %':>7}  fits")
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        err = f"{r['error_pct']:+.1f}" if r["error_pct"] is not None else "fail"
+        print(f"{r['clip']:<12} {r['encoder']:<13} {r['attempt']:>3} {r['res']:>8} {r['vbr_kbps']:>6} "
+              f"{r['qp'] if r['qp'] is not None else '-':>3} {r['wall_s']:>7} {r['realtime_x'] or '-':>6} "
+              f"{r['size_mb']:>7} {r['budget_mb']:>7} {err:>7}  {'yes' if r['fits'] else 'NO'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--durations", type=_int_list, default=[15, 60, 180], help="clip lengths in seconds")
+    parser.add_argument("--heights", type=_int_list, default=[720, 1080], help="clip heights (16:9)")
+    parser.add_argument("--target-mb", type=int, default=48, help="size the ladder aims for")
+    parser.add_argument("--encoders", default=",".join(ENCODERS),
+                        help="comma-separated subset of " + ", ".join(ENCODERS))
+    parser.add_argument("--source-bitrate", default="8M", help="bitrate of the generated source clips")
+    parser.add_argument("--json", help="also write rows and summary to this file")
+    args = parser.parse_args()
+
+    encoders = [e for e in args.encoders.split(",") if e in ENCODERS]
+    # The bot module is imported from a scratch directory
+    json_path = os.path.abspath(args.json) if args.json else None
+    try:
+        fixtures.require_ffmpeg()
+        clips = [(s, h, fixtures.video(s, h, noise=True, bitrate=args.source_bitrate))
+                 for h in args.heights for s in args.durations]
+    except fixtures.FixtureError as e:
+        sys.exit(f"bench: {e}")
+
+    main_mod, workdir = _import_main()
+    vaapi = any(e != "libx264" for e in encoders) and asyncio.run(main_mod._vaapi_available())
+    print(f"VAAPI: {'available' if vaapi else 'not available (libx264 only)'}; target {args.target_mb} MB\n")
+
+    rows = []
+    for seconds, height, clip in clips:
+        codec = asyncio.run(main_mod._video_codec(clip)) if vaapi else None
+        rows.extend(run_clip(main_mod, clip, seconds, height, args.target_mb, encoders, vaapi, codec, workdir))
+    print_table(rows)
+
+    summary = summarize(rows)
+    print()
+    for encoder, s in summary.items():
+        errors = "  ".join(f"#{n} {e:+.1f}%" for n, e in s["mean_error_pct_by_attempt"].items())
+        print(f"{encoder:<13} first attempt fits {s['first_attempt_success']:.0%} of {s['clips']} clips, "
+              f"{s['mean_attempts']} attempts / {s['mean_compress_s']} s on average; size vs budget: {errors}")
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump({"target_mb": args.target_mb, "rows": rows, "summary": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
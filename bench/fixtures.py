@@ -0,0 +1,76 @@
+"""
+Generated media fixtures for the offline benchmarks.
+
+Videos and images are synthesized with ffmpeg (``testsrc2`` + a sine
+tone, optionally with temporal noise so encoders can't cheat) and cached
+under ``bench/.cache``; nothing is downloaded.
+"""
+
+import os
+import shutil
+import subprocess
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+
+class FixtureError(RuntimeError):
+    """ffmpeg is missing or failed to generate a fixture."""
+
+
+def require_ffmpeg():
+    for tool in ("ffmpeg", "ffprobe"):
+        if not shutil.which(tool):
+            raise FixtureError(f"{tool} not found in PATH (needed to generate bench fixtures)")
+
+
+def _ffmpeg(args: list[str], out: str) -> str:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = f"{out}.part{os.path.splitext(out)[1]}"
+    proc = subprocess.run(["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", *args, tmp],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise FixtureError(f"ffmpeg failed for {os.path.basename(out)}: {proc.stderr[-300:]}")
+    os.replace(tmp, out)
+    return out
+
+
+def video(seconds: int, height: int = 720, fps: int = 30, noise: bool = False,
+          bitrate: str | None = None) -> str:
+    """H.264/AAC MP4 of ``seconds`` at ``height``p (16:9); cached by parameters.
+
+    ``noise`` adds per-frame grain, which makes the clip compress like
+    camera footage instead of a flat test pattern. ``bitrate`` forces the
+    video bitrate (e.g. ``"8M"``) to get a large source file.
+    """
+    width = height * 16 // 9 // 2 * 2
+    name = f"clip_{height}p_{seconds}s_{fps}fps{'_noise' if noise else ''}{f'_{bitrate}' if bitrate else ''}.mp4"
+    out = os.path.join(CACHE_DIR, name)
+    if os.path.exists(out):
+        return out
+    vf = ["-vf", "noise=alls=25:allf=t+u"] if noise else []
+    rate = ["-b:v", bitrate, "-maxrate", bitrate, "-bufsize", bitrate] if bitrate else ["-crf", "23"]
+    return _ffmpeg([
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}",
+        "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100",
+        "-t", str(seconds), *vf,
+        "-c:v", "libx264", "-preset", "veryfast", *rate, "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", "128k", "-shortest", "-movflags", "+faststart",
+    ], out)
+
+
+def image(width: int = 1080, height: int = 1350) -> str:
+    """A JPEG test card, cached by size."""
+    out = os.path.join(CACHE_DIR, f"image_{width}x{height}.jpg")
+    if os.path.exists(out):
+        return out
+    return _ffmpeg(["-f", "lavfi", "-i", f"testsrc2=size={width}x{height}", "-frames:v", "1", "-q:v", "3"], out)
+
+
+def facebook_post_html(image_urls: list[str], text: str) -> str:
+    """Rendered-page HTML shaped like a Facebook photo post (no og:image,
+    ``scontent`` carousel images and a post text block)."""
+    imgs = "\n".join(f'<img src="{u}" alt="">' for u in image_urls)
+    return f"""<!DOCTYPE html><html><head><title>Facebook</title></head><body>
+<div role="article"><div data-ad-preview="message"><div dir="auto">{text}</div></div>
+{imgs}
+</div></body></html>"""
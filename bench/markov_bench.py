@@ -0,0 +1,329 @@
+"""
+Markov service benchmark: retrain, load, generation and learning.
+
+    python -m bench.markov_bench [--sizes 10k,100k,1M] [--generations 500]
+                                 [--concurrency 1,8,64] [--json results.json]
+
+For each corpus size a synthetic chat corpus is generated (Zipf-distributed
+vocabulary, plus the spam repeats, links and commands ``_clean_message`` and
+the dedup sketch have to drop) and cached under ``bench/.cache``. Then, each
+phase in a fresh process so peak memory is its own:
+
+- ``retrain``: ``retrain_model`` wall time, peak RSS, model size.
+- ``generate``: ``load_markov_model`` time and RSS, then
+  ``generate_markov_sentence`` latency (p50/p95/p99) without seed, with
+  seeds from the corpus and with unknown seeds, counting the model calls
+  each one took (retries) and how often it fell back to "xd".
+- ``learn`` (once): ``learn_message`` throughput with N concurrent callers,
+  checking that no appended line was lost or interleaved.
+
+10M lines is supported (``--sizes 10M``) but takes minutes and several GB.
+Results go to stdout and, with ``--json``, to a file to diff over time.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fixtures import CACHE_DIR  # noqa: E402
+
+VOCABULARY = 40_000
+SYLLABLES = ["ma", "re", "to", "la", "che", "bo", "ni", "sa", "pe", "lu", "ca", "di",
+             "vo", "ra", "que", "mi", "so", "te", "ga", "no", "fu", "li", "ve", "za"]
+SPAM_LINES = ["jajajaja", "buenas buenas", "alguien juega hoy", "xd xd xd", "manden memes"]
+
+
+def parse_size(value: str) -> int:
+    value = value.strip().lower()
+    scale = {"k": 1_000, "m": 1_000_000}.get(value[-1:], 1)
+    return int(float(value.rstrip("km")) * scale)
+
+
+def _memory() -> dict:
+    """Current and peak RSS of this process in MB."""
+    mem = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    mem[line[:5]] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if "VmHWM" not in mem:
+        import resource
+        mem["VmHWM"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"rss_mb": round(mem.get("VmRSS", mem["VmHWM"]), 1), "peak_mb": round(mem["VmHWM"], 1)}
+
+
+def _percentiles(values: list[float]) -> dict:
+    ordered = sorted(values)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+    return {"p50_ms": round(pct(50) * 1000, 3), "p95_ms": round(pct(95) * 1000, 3),
+            "p99_ms": round(pct(99) * 1000, 3)}
+
+
+# ── corpus ─────────────────────────────────────────────────────────────
+
+def _vocabulary(rng: random.Random) -> list[str]:
+    words = set()
+    while len(words) < VOCABULARY:
+        words.add("".join(rng.choices(SYLLABLES, k=rng.choice((1, 2, 2, 3, 3, 4)))))
+    return sorted(words)
+
+
+def corpus(lines: int) -> str:
+    """Path of a cached synthetic corpus with ``lines`` lines."""
+    path = os.path.join(CACHE_DIR, f"markov_corpus_{lines}.txt")
+    if os.path.exists(path):
+        return path
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    rng = random.Random(lines)
+    words = _vocabulary(rng)
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    cum = list(itertools.accumulate(weights))
+    tmp = f"{path}.part"
+    with open(tmp, "w", encoding="utf-8") as f:
+        batch = []
+        for n in range(lines):
+            roll = rng.random()
+            if roll < 0.05:
+                batch.append(rng.choice(SPAM_LINES))
+            elif roll < 0.07:
+                batch.append(f"miren esto https://example.com/v/{n}")
+            elif roll < 0.08:
+                batch.append("/markov")
+            else:
+                batch.append(" ".join(rng.choices(words, cum_weights=cum, k=rng.randint(3, 18))))
+            if len(batch) >= 10_000:
+                f.write("\n".join(batch) + "\n")
+                batch.clear()
+        if batch:
+            f.write("\n".join(batch) + "\n")
+    os.replace(tmp, path)
+    return path
+
+
+# ── phases (each runs in its own process) ──────────────────────────────
+
+def phase_retrain(corpus_path: str, model_path: str) -> dict:
+    import markov_service
+    before = _memory()
+    start = time.perf_counter()
+    ok = asyncio.run(markov_service.retrain_model(
+        output_path=model_path, base_corpus_path=corpus_path,
+        learned_path=os.path.join(os.path.dirname(model_path), "none.txt")))
+    wall = time.perf_counter() - start
+    after = _memory()
+    return {
+        "ok": ok,
+        "retrain_s": round(wall, 3),
+        "retrain_peak_mb": after["peak_mb"],
+        "retrain_peak_delta_mb": round(after["peak_mb"] - before["rss_mb"], 1),
+        "model_mb": round(os.path.getsize(model_path) / 1048576, 2) if ok else 0,
+    }
+
+
+class _CallCounter:
+    """Wraps a model method to count the top-level calls generation made.
+
+    ``make_sentence_with_start`` calls ``make_sentence`` itself; calls made
+    while ``inside`` is running are not retries and are not counted.
+    """
+
+    def __init__(self, fn, inside: "_CallCounter | None" = None):
+        self.fn = fn
+        self.inside = inside
+        self.calls = 0
+        self.running = False
+
+    def __call__(self, *args, **kwargs):
+        if not (self.inside and self.inside.running):
+            self.calls += 1
+        self.running = True
+        try:
+            return self.fn(*args, **kwargs)
+        finally:
+            self.running = False
+
+
+def phase_generate(corpus_path: str, model_path: str, generations: int) -> dict:
+    import markov_service
+    before = _memory()
+    start = time.perf_counter()
+    ok = markov_service.load_markov_model(model_path)
+    load_s = time.perf_counter() - start
+    loaded = _memory()
+    if not ok:
+        return {"ok": False}
+
+    model = markov_service._markov_model
+    seeded_calls = _CallCounter(model.make_sentence_with_start)
+    random_calls = _CallCounter(model.make_sentence, inside=seeded_calls)
+    model.make_sentence = random_calls
+    model.make_sentence_with_start = seeded_calls
+
+    rng = random.Random(0)
+    with open(corpus_path, encoding="utf-8") as f:
+        head = [line.split() for _, line in zip(range(5000), f)]
+    known = [w[0] for w in head if len(w) > 3 and not w[0].startswith(("/", "miren"))]
+
+    modes = {
+        "random": lambda: None,
+        "seed_known": lambda: rng.choice(known),
+        "seed_unknown": lambda: f"zzq{rng.randrange(10 ** 6)}",
+    }
+    results = {}
+    for mode, seed_for in modes.items():
+        latencies, fallbacks = [], 0
+        random_calls.calls = seeded_calls.calls = 0
+        for _ in range(generations):
+            seed = seed_for()
+            start = time.perf_counter()
+            sentence = markov_service.generate_markov_sentence(seed)
+            latencies.append(time.perf_counter() - start)
+            fallbacks += sentence in ("xd", "...")
+        results[mode] = {
+            **_percentiles(latencies),
+            "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+            "model_calls_per_sentence": round((random_calls.calls + seeded_calls.calls) / generations, 2),
+            "seeded_calls_per_sentence": round(seeded_calls.calls / generations, 2),
+            "fallback_rate": round(fallbacks / generations, 4),
+        }
+    return {
+        "ok": True,
+        "load_s": round(load_s, 3),
+        "load_rss_delta_mb": round(loaded["rss_mb"] - before["rss_mb"], 1),
+        "loaded_rss_mb": loaded["rss_mb"],
+        "generate": results,
+    }
+
+
+def phase_learn(concurrency: list[int], messages: int) -> dict:
+    import markov_service
+    rng = random.Random(1)
+    texts = [" ".join(rng.choices(SYLLABLES, k=rng.randint(3, 15))) for _ in range(1000)]
+
+    async def run(callers: int, path: str) -> float:
+        per_caller = messages // callers
+
+        async def caller(c: int):
+            for i in range(per_caller):
+                await markov_service.learn_message(f"{texts[(c + i) % len(texts)]} {c}-{i}", path)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(caller(c) for c in range(callers)))
+        return time.perf_counter() - start
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for callers in concurrency:
+            path = os.path.join(tmp, f"learned_{callers}.txt")
+            wall = asyncio.run(run(callers, path))
+            expected = messages // callers * callers
+            with open(path, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+            intact = sum(1 for line in lines if line.rsplit(" ", 1)[-1].count("-") == 1)
+            results[str(callers)] = {
+                "messages": expected,
+                "wall_s": round(wall, 3),
+                "msgs_per_s": round(expected / wall, 1),
+                "lost": expected - len(lines),
+                "corrupt": len(lines) - intact,
+            }
+    return results
+
+
+def _child(args) -> dict:
+    logging.basicConfig(level=logging.WARNING)
+    if args.worker == "retrain":
+        return phase_retrain(args.corpus, args.model)
+    if args.worker == "generate":
+        return phase_generate(args.corpus, args.model, args.generations)
+    return phase_learn(args.concurrency, args.learn_messages)
+
+
+def _spawn(*argv: str) -> dict:
+    proc = subprocess.run([sys.executable, "-m", "bench.markov_bench", *argv],
+                          cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"ok": False, "error": proc.stderr.strip().splitlines()[-1:] or ["exit code %d" % proc.returncode]}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _print_size(lines: int, r: dict):
+    print(f"\n{lines:,} lines (corpus {r['corpus_mb']} MB)")
+    rt = r["retrain"]
+    if not rt.get("ok"):
+        print(f"  retrain failed: {rt.get('error')}")
+        return
+    print(f"  retrain   {rt['retrain_s']:>9.2f} s   peak {rt['retrain_peak_mb']:>8.1f} MB   model {rt['model_mb']} MB")
+    gen = r["generate"]
+    if not gen.get("ok"):
+        print(f"  load/generate failed: {gen.get('error')}")
+        return
+    print(f"  load      {gen['load_s']:>9.2f} s   rss +{gen['load_rss_delta_mb']} MB")
+    for mode, g in gen["generate"].items():
+        print(f"  {mode:<12} p50 {g['p50_ms']:>8.2f} ms  p95 {g['p95_ms']:>8.2f}  p99 {g['p99_ms']:>8.2f}  "
+              f"calls/sentence {g['model_calls_per_sentence']:<5} fallback {g['fallback_rate']:.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10k,100k,1M", help="corpus sizes in lines (k/M suffixes)")
+    parser.add_argument("--generations", type=int, default=500, help="sentences per generation mode")
+    parser.add_argument("--concurrency", type=lambda v: [int(x) for x in v.split(",")], default=[1, 8, 64],
+                        help="concurrent learn_message callers")
+    parser.add_argument("--learn-messages", type=int, default=5000, help="messages learned per concurrency level")
+    parser.add_argument("--json", help="also write the results to this file")
+    # Internal: run a single phase and print its JSON
+    parser.add_argument("--worker", choices=["retrain", "generate", "learn"], help=argparse.SUPPRESS)
+    parser.add_argument("--corpus", help=argparse.SUPPRESS)
+    parser.add_argument("--model", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(_child(args)))
+        return
+
+    results = {"sizes": {}, "learn": None}
+    with tempfile.TemporaryDirectory(prefix="markov_bench_") as tmp:
+        for lines in (parse_size(s) for s in args.sizes.split(",")):
+            print(f"▶ {lines:,} lines: building corpus...", flush=True)
+            path = corpus(lines)
+            model = os.path.join(tmp, f"model_{lines}.json")
+            entry = {"corpus_mb": round(os.path.getsize(path) / 1048576, 1)}
+            entry["retrain"] = _spawn("--worker", "retrain", "--corpus", path, "--model", model)
+            entry["generate"] = (_spawn("--worker", "generate", "--corpus", path, "--model", model,
+                                        "--generations", str(args.generations))
+                                 if entry["retrain"].get("ok") else {"ok": False, "error": "no model"})
+            results["sizes"][str(lines)] = entry
+            _print_size(lines, entry)
+
+    results["learn"] = _spawn("--worker", "learn", "--concurrency", ",".join(map(str, args.concurrency)),
+                              "--learn-messages", str(args.learn_messages))
+    print("\nlearn_message")
+    for callers, r in results["learn"].items():
+        if isinstance(r, dict):
+            print(f"  {callers:>4} callers  {r['msgs_per_s']:>9} msg/s  lost {r['lost']}  corrupt {r['corrupt']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+End-to-end pipeline benchmark, fully offline.
+
+    python -m bench.pipeline_bench [--scenario mixed] [--users 4] [--messages 5]
+                                   [--upload-mbps 0] [--baseline bench/baseline.json]
+                                   [--save-baseline] [--tolerance 0.15]
+
+Starts local stand-ins (``bench.stubs``) for the Bot API, cobalt, tikwm,
+the media CDN and Lightpanda, generates ffmpeg fixtures, then drives
+``handle_url`` through the real dispatcher with N users sending links
+concurrently (each user waits for its previous link). Outbound traffic to
+real platforms goes through a proxy that refuses it, so yt-dlp and the plain-HTTP
+scrapers fail fast and the fallbacks under test take over.
+
+Scenarios:
+  direct    generic link to an MP4 on the local CDN (yt-dlp download + upload)
+  tiktok    TikTok link, yt-dlp fails -> tikwm stub -> download + upload
+  cobalt    X link, yt-dlp fails -> cobalt stub (tunnel) -> download + upload
+  facebook  Facebook photo post -> Lightpanda stub -> 3 images -> media group
+  mixed     all of the above, round-robin
+
+Reports throughput, p50/p95/p99 latency, peak RSS and event-loop lag per
+scenario and compares them with the saved baseline (exit code 1 when a
+metric regressed by more than ``--tolerance``).
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench import fixtures  # noqa: E402
+from bench.stubs import CDPStub, FakeBotAPI, MediaStub, RefusingProxy, ServiceThread  # noqa: E402
+
+SCENARIOS = ("direct", "tiktok", "cobalt", "facebook")
+BOT_TOKEN = "123456:bench"
+IMAGES_PER_POST = 3
+# Update/message ids, unique across scenarios so no link repeats
+_updates = itertools.count(1)
+
+# metric -> True when higher is better
+COMPARED = {
+    "throughput": True,
+    "p50_s": False,
+    "p95_s": False,
+    "p99_s": False,
+    "rss_peak_mb": False,
+    "loop_lag_p99_ms": False,
+}
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile (0 for no values)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _Sampler:
+    """Loop lag (ms) and RSS (MB), sampled every ``interval`` seconds."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.lags: list[float] = []
+        self.rss: list[float] = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append((loop.time() - start - self.interval) * 1000)
+            self.rss.append(_rss_mb())
+
+    def __enter__(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+
+def _link(scenario: str, media_url: str, n: int) -> str:
+    if scenario == "direct":
+        return f"{media_url}/files/clip-{n}.mp4"
+    if scenario == "tiktok":
+        return f"https://www.tiktok.com/@bench/video/{7_300_000_000_000_000_000 + n}"
+    if scenario == "cobalt":
+        return f"https://x.com/bench/status/{1_800_000_000_000_000_000 + n}"
+    return f"https://www.facebook.com/share/p/bench{n}/"
+
+
+def _environment(bot_api: str, media_url: str, cdp_url: str, proxy_url: str, workdir: str):
+    """Point the bot at the stubs; must run before ``main`` is imported."""
+    os.environ.update({
+        "BOT_TOKEN": BOT_TOKEN,
+        "LOCAL_API_SERVER": bot_api,
+        "COBALT_URL": media_url,
+        "TIKWM_URL": media_url,
+        "LIGHTPANDA_URL": cdp_url,
+        "LIGHTPANDA_DOM_EXTRACT": "false",
+        "MARKOV_ENABLED": "false",
+        "MARKOV_LEARN_ENABLED": "false",
+        "METRICS_PORT": "0",
+        "LOOP_BLOCK_MS": "0",
+        # Real platforms are unreachable; local stubs are not proxied
+        "HTTP_PROXY": proxy_url, "HTTPS_PROXY": proxy_url,
+        "http_proxy": proxy_url, "https_proxy": proxy_url,
+        "NO_PROXY": "127.0.0.1,localhost", "no_proxy": "127.0.0.1,localhost",
+    })
+    os.makedirs(os.path.join(workdir, "logs"), exist_ok=True)
+    os.chdir(workdir)
+
+
+async def _run_scenario(main, bot_api: FakeBotAPI, media_url: str, scenario: str,
+                        users: int, messages: int) -> dict:
+    from aiogram import types
+
+    latencies, failures = [], 0
+
+    async def user(u: int):
+        nonlocal failures
+        chat_id = 10_000 + u
+        for m in range(messages):
+            name = SCENARIOS[(u + m) % len(SCENARIOS)] if scenario == "mixed" else scenario
+            n = next(_updates)
+            update = types.Update.model_validate({
+                "update_id": n,
+                "message": {
+                    "message_id": n,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "from": {"id": chat_id, "is_bot": False, "first_name": f"user{u}"},
+                    "text": _link(name, media_url, n),
+                },
+            }, context={"bot": main.bot})
+            before = bot_api.results_for(chat_id)
+            start = time.perf_counter()
+            await main.dp.feed_update(main.bot, update)
+            latencies.append(time.perf_counter() - start)
+            if bot_api.results_for(chat_id) == before:
+                failures += 1
+
+    calls_before = len(bot_api.calls)
+    with _Sampler() as sampler:
+        start = time.perf_counter()
+        await asyncio.gather(*(user(u) for u in range(users)))
+        wall = time.perf_counter() - start
+
+    calls = bot_api.calls[calls_before:]
+    total = users * messages
+    return {
+        "messages": total,
+        "failed": failures,
+        "wall_s": round(wall, 2),
+        "throughput": round(total / wall, 3),
+        "p50_s": round(percentile(latencies, 50), 3),
+        "p95_s": round(percentile(latencies, 95), 3),
+        "p99_s": round(percentile(latencies, 99), 3),
+        "mean_s": round(statistics.fmean(latencies), 3) if latencies else 0,
+        "rss_peak_mb": round(max(sampler.rss, default=_rss_mb()), 1),
+        "loop_lag_p99_ms": round(percentile(sampler.lags, 99), 1),
+        "loop_lag_max_ms": round(max(sampler.lags, default=0), 1),
+        "bot_api_calls": len(calls),
+        "uploaded_mb": round(sum(size for _m, _c, size in calls) / 1048576, 1),
+    }
+
+
+def _compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """Print the deltas against ``baseline``; True if anything regressed."""
+    regressed = False
+    for scenario, current in results.items():
+        base = baseline.get(scenario)
+        if not base:
+            print(f"{scenario}: no baseline")
+            continue
+        print(f"{scenario} vs baseline:")
+        for metric, higher_is_better in COMPARED.items():
+            old, new = base.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            flag = "  REGRESSION" if worse > tolerance else ""
+            regressed |= bool(flag)
+            print(f"  {metric:<16} {old:>10} -> {new:<10} {change:+7.1%}{flag}")
+    return regressed
+
+
+async def run(args) -> dict:
+    fixtures.require_ffmpeg()
+    clip = fixtures.video(seconds=args.clip_seconds, height=720)
+    image = fixtures.image()
+
+    services = ServiceThread()
+    bot_api = FakeBotAPI(upload_mbps=args.upload_mbps)
+    media = MediaStub({"clip.mp4": clip, "img.jpg": image})
+    media_url = await services.call(media.start())
+
+    def facebook_html(page_url: str) -> str:
+        post = page_url.rstrip("/").rsplit("/", 1)[-1]
+        urls = [f"{media_url}/files/scontent/v/t39.30808-6/img-{i}.jpg?post={post}" for i in range(IMAGES_PER_POST)]
+        return fixtures.facebook_post_html(urls, "Bench post text with enough characters to be a caption")
+
+    cdp = CDPStub(facebook_html)
+    proxy = RefusingProxy()
+    stubs = [bot_api, media, cdp, proxy]
+    workdir = tempfile.mkdtemp(prefix="pipeline_bench_")
+    try:
+        bot_url = await services.call(bot_api.start())
+        cdp_url = await services.call(cdp.start())
+        proxy_url = await services.call(proxy.start())
+        _environment(bot_url, media_url, cdp_url, proxy_url, workdir)
+
+        import main  # noqa: E402  (reads the environment set above)
+        import logging
+        # yt-dlp failing over to the stubs logs a warning per link
+        logging.getLogger().setLevel(logging.INFO if args.verbose else logging.ERROR)
+        await main.workspace.startup()
+
+        scenarios = list(SCENARIOS) + ["mixed"] if args.scenario == "all" else [args.scenario]
+        results = {}
+        for scenario in scenarios:
+            print(f"▶ {scenario}: {args.users} users x {args.messages} links", flush=True)
+            results[scenario] = await _run_scenario(main, bot_api, media_url, scenario,
+                                                    args.users, args.messages)
+            r = results[scenario]
+            print(f"  {r['throughput']} links/s  p50 {r['p50_s']}s  p95 {r['p95_s']}s  p99 {r['p99_s']}s  "
+                  f"rss {r['rss_peak_mb']} MB  lag p99 {r['loop_lag_p99_ms']} ms  failed {r['failed']}")
+
+        await main.image_fetcher.close()
+        await main.igdl_pool.pool.close()
+        main.extractor_pool.shutdown()
+        await main.bot.session.close()
+        print("Bot API calls:", dict(bot_api.methods()))
+        print("Stub hits:", dict(media.hits), f"cdp pages: {cdp.pages}, proxied (refused): {proxy.refused}")
+        return results
+    finally:
+        for stub in stubs:
+            await services.call(stub.stop())
+        services.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", default="mixed", choices=[*SCENARIOS, "mixed", "all"])
+    parser.add_argument("--users", type=int, default=4, help="concurrent users (one chat each)")
+    parser.add_argument("--messages", type=int, default=5, help="links sent by each user, one after another")
+    parser.add_argument("--clip-seconds", type=int, default=15, help="duration of the fixture video")
+    parser.add_argument("--upload-mbps", type=float, default=0, help="simulated upload bandwidth (0 = unlimited)")
+    parser.add_argument("--baseline", default=os.path.join(ROOT, "bench", "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's INFO logs")
+    args = parser.parse_args()
+    # run() moves into a scratch directory before importing the bot
+    args.baseline = os.path.abspath(args.baseline)
+    args.json = os.path.abspath(args.json) if args.json else None
+
+    try:
+        results = asyncio.run(run(args))
+    except fixtures.FixtureError as e:
+        sys.exit(f"bench: {e}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressed = _compare(results, baseline, args.tolerance) if baseline else False
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({**baseline, **results}, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Local stand-ins for the services the bot talks to, for offline benchmarks.
+
+- ``FakeBotAPI``: a Bot API server (``/bot<token>/<method>``) that records
+  every call, answers with well-formed results (sent videos have a
+  duration, media groups one message per item...) and can throttle
+  uploads to a given bandwidth.
+- ``MediaStub``: ``/files/...`` serves fixtures (HEAD and ranges included),
+  ``/api/`` answers like tikwm and ``POST /`` like cobalt, both pointing
+  back at ``/files``.
+- ``RefusingProxy``: the HTTP(S) proxy for everything else; every request
+  is answered ``403`` after a short delay, so real platforms fail fast
+  but not instantly (curl_cffi 0.11 deadlocks on failures that happen
+  before it has registered its cleanup callback).
+- ``CDPStub``: the slice of the Chrome DevTools Protocol that
+  ``fetch_html_via_lightpanda`` uses, returning fixture HTML.
+
+Each ``start()`` binds an ephemeral localhost port and returns the base URL.
+Run them on a ``ServiceThread`` so they keep answering while the bot's own
+event loop is blocked (yt-dlp downloads run on it synchronously), just as
+the real services would.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+import websockets
+from aiohttp import web
+
+
+class ServiceThread:
+    """An event loop in a daemon thread for the stubs."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="bench-stubs", daemon=True)
+        self._thread.start()
+
+    async def call(self, coro):
+        """Run ``coro`` on the stub loop and await its result from the caller's loop."""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+async def _start_app(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+class FakeBotAPI:
+    # Methods that deliver a result to the user
+    RESULT_METHODS = ("sendVideo", "sendDocument", "sendPhoto", "sendMediaGroup", "sendAudio")
+
+    def __init__(self, upload_mbps: float = 0):
+        self.upload_mbps = upload_mbps
+        self.calls: list[tuple[str, int | None, int]] = []   # (method, chat_id, uploaded bytes)
+        self._ids = itertools.count(1000)
+        self.runner = None
+        self.base_url = ""
+
+    async def start(self) -> str:
+        app = web.Application(client_max_size=2 * 1024 ** 3)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self.runner, self.base_url = await _start_app(app)
+        return self.base_url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    def methods(self) -> Counter:
+        return Counter(method for method, _chat, _size in self.calls)
+
+    def results_for(self, chat_id: int) -> int:
+        return sum(1 for method, chat, _size in self.calls if chat == chat_id and method in self.RESULT_METHODS)
+
+    def uploaded_bytes(self) -> int:
+        return sum(size for _method, _chat, size in self.calls)
+
+    def _message(self, chat_id, **extra) -> dict:
+        return {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id or 0), "type": "private"},
+            **extra,
+        }
+
+    async def _handle(self, request: web.Request):
+        method = request.match_info["method"]
+        fields, uploaded = {}, 0
+        if request.content_type.startswith("multipart/"):
+            reader = await request.multipart()
+            async for part in reader:
+                if part.filename:
+                    while chunk := await part.read_chunk(1 << 20):
+                        uploaded += len(chunk)
+                else:
+                    fields[part.name] = await part.text()
+        else:
+            fields = dict(await request.post())
+
+        if uploaded and self.upload_mbps:
+            await asyncio.sleep(uploaded * 8 / (self.upload_mbps * 1_000_000))
+
+        chat_id = fields.get("chat_id")
+        self.calls.append((method, int(chat_id) if chat_id and chat_id.lstrip("-").isdigit() else None, uploaded))
+        file = {"file_id": f"F{next(self._ids)}", "file_unique_id": f"U{next(self._ids)}"}
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method == "sendVideo":
+            result = self._message(chat_id, video={**file, "width": 1280, "height": 720,
+                                                   "duration": 10, "file_size": uploaded or 1})
+        elif method == "sendDocument":
+            result = self._message(chat_id, document={**file, "file_size": uploaded or 1})
+        elif method == "sendAudio":
+            result = self._message(chat_id, audio={**file, "duration": 10, "file_size": uploaded or 1})
+        elif method == "sendPhoto":
+            result = self._message(chat_id, photo=[{**file, "width": 1080, "height": 1350}])
+        elif method == "sendMediaGroup":
+            media = json.loads(fields.get("media", "[]"))
+            result = [self._message(chat_id, photo=[{**file, "width": 1080, "height": 1350}]) for _ in media]
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(chat_id, text=fields.get("text", ""))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+class MediaStub:
+    """Fixture file server plus tikwm- and cobalt-shaped APIs."""
+
+    def __init__(self, files: dict[str, str]):
+        # Public name (e.g. "clip.mp4", "img.jpg") -> local fixture path.
+        # Requests may add "-<n>" before the extension to get unique URLs.
+        self.files = files
+        self.hits = Counter()
+        self.runner = None
+        self.base_url = ""
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_route("*", "/files/{tail:.+}", self._file)
+        app.router.add_get("/api/", self._tikwm)
+        app.router.add_post("/", self._cobalt)
+        self.runner, self.base_url = await _start_app(app)
+        return self.base_url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    def _resolve(self, name: str) -> str | None:
+        m = re.match(r"^(?P<base>.+?)(?:-\d+)?(?P<ext>\.\w+)$", os.path.basename(name))
+        return self.files.get(f"{m['base']}{m['ext']}") if m else None
+
+    async def _file(self, request: web.Request):
+        path = self._resolve(request.match_info["tail"])
+        if not path:
+            raise web.HTTPNotFound()
+        self.hits["files"] += 1
+        return web.FileResponse(path)
+
+    async def _tikwm(self, request: web.Request):
+        self.hits["tikwm"] += 1
+        video_id = re.sub(r"\D", "", request.query.get("url", ""))[-6:] or "0"
+        path = self.files["clip.mp4"]
+        return web.json_response({"code": 0, "msg": "success", "data": {
+            "play": f"{self.base_url}/files/clip-{video_id}.mp4",
+            "size": os.path.getsize(path),
+        }})
+
+    async def _cobalt(self, request: web.Request):
+        self.hits["cobalt"] += 1
+        body = await request.json()
+        post_id = re.sub(r"\D", "", body.get("url", ""))[-6:] or "0"
+        return web.json_response({
+            "status": "tunnel",
+            "url": f"{self.base_url}/files/clip-{post_id}.mp4",
+            "filename": f"cobalt_{post_id}.mp4",
+        })
+
+
+class RefusingProxy:
+    """Proxy that refuses every request (CONNECT included) after ``delay``."""
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.refused = 0
+        self.server = None
+        self.url = ""
+
+    async def start(self) -> str:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            await asyncio.sleep(self.delay)
+            self.refused += 1
+            writer.write(b"HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class CDPStub:
+    """Just enough CDP for ``fetch_html_via_lightpanda``: targets, sessions,
+    navigation events and ``Runtime.evaluate`` returning ``html_for(url)``."""
+
+    def __init__(self, html_for):
+        self.html_for = html_for
+        self.pages = 0
+        self.server = None
+        self.url = ""
+
+    async def start(self) -> str:
+        self.server = await websockets.serve(self._handle, "127.0.0.1", 0, max_size=10_000_000)
+        port = self.server.sockets[0].getsockname()[1]
+        self.url = f"ws://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _handle(self, ws, *_path):
+        page_url = "about:blank"
+        async for raw in ws:
+            msg = json.loads(raw)
+            mid, method = msg.get("id"), msg.get("method")
+            if method == "Target.createTarget":
+                await ws.send(json.dumps({"method": "Target.targetCreated",
+                                          "params": {"targetInfo": {"targetId": "T1", "type": "page"}}}))
+                await ws.send(json.dumps({"id": mid, "result": {"targetId": "T1"}}))
+            elif method == "Target.attachToTarget":
+                await ws.send(json.dumps({"method": "Target.attachedToTarget",
+                                          "params": {"sessionId": "S1", "targetInfo": {"targetId": "T1"}}}))
+                await ws.send(json.dumps({"id": mid, "result": {"sessionId": "S1"}}))
+            elif method == "Page.navigate":
+                page_url = msg["params"]["url"]
+                self.pages += 1
+                await ws.send(json.dumps({"id": mid, "result": {"frameId": "F1"}}))
+                await ws.send(json.dumps({"method": "Page.frameNavigated", "params": {"frame": {"url": page_url}}}))
+                await ws.send(json.dumps({"method": "Page.loadEventFired", "params": {}}))
+            elif method == "Runtime.evaluate":
+                await ws.send(json.dumps({"id": mid, "result": {
+                    "result": {"type": "string", "value": self.html_for(page_url)}}}))
+            else:
+                await ws.send(json.dumps({"id": mid, "result": {}}))
@@ -0,0 +1,120 @@
+"""
+Benchmark ``url_classifier.classify`` against the old chain of ``is_*``
+substring checks, over the URLs in ``test_urls.txt``.
+
+    python -m bench.url_classifier_bench [--rounds 20000] [--file test_urls.txt]
+
+Prints per-URL cost for both paths and every URL where they disagree
+(the old checks misfire on hosts like ``t.co``/``x.com``).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import url_classifier  # noqa: E402
+
+# Extra URLs covering short links and the hosts the substring checks misread
+EXTRA_URLS = [
+    "https://youtu.be/dQw4w9WgXcQ?si=abc",
+    "https://vm.tiktok.com/ZMabc123/",
+    "https://fb.watch/abcDEF/",
+    "https://www.facebook.com/share/r/1AbCd/",
+    "https://www.facebook.com/share/p/1AbCd/",
+    "https://www.instagram.com/p/C1aBcDeFgHi/",
+    "https://www.instagram.com/stories/someone/3300000000000000000/",
+    "https://redd.it/abc123",
+    "https://x.com/someone/status/1445078208190291973",
+    "https://www.netflix.com/title/80100172",
+    "https://reddit.co/foo",
+    "https://www.dropbox.com/s/abc/video.mp4",
+]
+
+
+def _legacy_route(url: str) -> str:
+    """The pre-classifier routing chain from handle_url, reduced to a label."""
+    if 'youtube.com' in url or 'youtu.be' in url:
+        return "youtube/video"
+    fb = 'facebook.com' in url
+    fb_video = 'fb.watch' in url or (fb and any(p in url for p in [
+        '/reel/', '/watch', '/videos/', '/video.php', 'story_fbid=', '/share/r/', '/share/v/']))
+    if fb_video:
+        return "facebook/video"
+    if 'tiktok.com' in url or 'vm.tiktok' in url:
+        return "tiktok/video"
+    if 'reddit.com' in url or 'redd.it' in url:
+        return "reddit/post"
+    if 'twitter.com' in url or 'x.com' in url or 't.co' in url:
+        return "twitter/video"
+    if 'instagram.com' in url and '/reel/' in url:
+        return "instagram/video"
+    if 'instagram.com' in url and ('/stories/' in url or '/story/' in url):
+        return "instagram/story"
+    if 'instagram.com' in url:
+        return "instagram/post"
+    if fb:
+        return "facebook/post"
+    return "other/video"
+
+
+def _new_route(url: str) -> str:
+    route = url_classifier.classify(url)
+    return f"{route.platform}/{route.kind}"
+
+
+def _new_route_uncached(url: str) -> str:
+    route = url_classifier.classify.__wrapped__(url)
+    return f"{route.platform}/{route.kind}"
+
+
+def load_urls(path: str) -> list[str]:
+    urls = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            urls.extend(url_classifier.extract_urls(line))
+    return urls
+
+
+def _time(fn, urls: list[str], rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for url in urls:
+            fn(url)
+    return time.perf_counter() - start
+
+
+def main():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--file", default=os.path.join(root, "test_urls.txt"))
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args()
+
+    urls = load_urls(args.file) + EXTRA_URLS
+    n = len(urls) * args.rounds
+
+    legacy = _time(_legacy_route, urls, args.rounds)
+    cold = _time(_new_route_uncached, urls, args.rounds)
+    warm = _time(_new_route, urls, args.rounds)
+
+    print(f"{len(urls)} URLs x {args.rounds} rounds")
+    print(f"{'legacy is_* chain':<24} {legacy / n * 1e9:8.0f} ns/url")
+    print(f"{'classify() uncached':<24} {cold / n * 1e9:8.0f} ns/url")
+    print(f"{'classify() cached':<24} {warm / n * 1e9:8.0f} ns/url")
+
+    print("\nRoutes that changed:")
+    changed = 0
+    for url in urls:
+        old, cur = _legacy_route(url), _new_route(url)
+        if old != cur:
+            changed += 1
+            print(f"  {url}\n    {old} -> {cur}")
+    if not changed:
+        print("  (none)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Delivery strategies: hand Telegram a public media URL instead of bytes.
+
+The Bot API can fetch a URL itself (photos up to 5 MB, other files up to
+20 MB). For backends that give us a public CDN link (tikwm ``play``
+URLs, cobalt ``redirect`` responses, fbcdn images) that skips the
+download to our server and the upload back. The hand-off is only tried
+when the size is known to fit, the sent message is checked (a video has
+to arrive as a playable video, every photo as a photo), and any failure
+returns None/False so the caller falls back to a local download.
+"""
+
+import asyncio
+import ipaddress
+import logging
+import os
+from typing import NamedTuple
+from urllib.parse import urlsplit
+
+import aiohttp
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError
+from aiogram.types import InputMediaPhoto
+
+import batch_jobs
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DIRECT_URL_DELIVERY = os.getenv("DIRECT_URL_DELIVERY", "true").lower() == "true"
+
+# Bot API limits for files sent by URL
+URL_PHOTO_LIMIT = 5 * 1024 * 1024
+URL_FILE_LIMIT = 20 * 1024 * 1024
+HEAD_TIMEOUT = 8
+
+# Image CDNs whose URLs Telegram can fetch (no cookies or referer needed)
+PHOTO_URL_HOSTS = ("fbcdn.net",)
+
+
+class RemoteMedia(NamedTuple):
+    """A media file reachable by URL, as resolved by a backend."""
+    url: str
+    size: int | None = None
+    source: str = ""
+    # False when the URL only works from our network (e.g. cobalt tunnels)
+    public: bool = True
+
+
+def _is_public_host(url: str) -> bool:
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    if parts.scheme not in ("http", "https") or "." not in host or host == "localhost":
+        return False
+    try:
+        return ipaddress.ip_address(host).is_global
+    except ValueError:
+        return True
+
+
+async def content_length(url: str) -> int | None:
+    """Size announced by a HEAD request, or None."""
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.head(
+                url, allow_redirects=True,
+                headers={"User-Agent": "Mozilla/5.0"},
+                timeout=aiohttp.ClientTimeout(total=HEAD_TIMEOUT)
+            ) as resp:
+                if resp.status != 200:
+                    return None
+                return resp.content_length
+    except Exception as e:
+        logger.info(f"HEAD {url[:80]} failed: {e}")
+        return None
+
+
+async def _fits(url: str, size: int | None, limit: int) -> bool:
+    if size is None:
+        size = await content_length(url)
+    return size is not None and 0 < size <= limit
+
+
+async def send_video_url(message, media: RemoteMedia, caption: str | None = None, reply_markup=None):
+    """
+    Let Telegram fetch ``media`` and send it as a video. Returns the sent
+    message, or None when not eligible or anything went wrong.
+    """
+    if not DIRECT_URL_DELIVERY or not media.public or not _is_public_host(media.url):
+        return None
+    if not await _fits(media.url, media.size, URL_FILE_LIMIT):
+        return None
+
+    try:
+        async with batch_jobs.result_slot():
+            sent = await message.answer_video(
+                media.url, caption=caption, supports_streaming=True, reply_markup=reply_markup)
+    except (TelegramAPIError, TelegramNetworkError) as e:
+        logger.info(f"URL hand-off ({media.source}) refused: {e}")
+        metrics.URL_HANDOFFS.inc(source=media.source, outcome="refused")
+        return None
+
+    # Telegram falls back to a document/animation when it can't parse the
+    # video; that is not what a local upload would give the user.
+    if not sent.video or not sent.video.duration:
+        logger.info(f"URL hand-off ({media.source}) arrived as non-video, retrying locally")
+        metrics.URL_HANDOFFS.inc(source=media.source, outcome="bad_result")
+        try:
+            await sent.delete()
+        except TelegramAPIError:
+            pass
+        return None
+
+    metrics.URL_HANDOFFS.inc(source=media.source, outcome="sent")
+    logger.info(f"URL hand-off ({media.source}) sent video without local download")
+    return sent
+
+
+async def send_photos(message, photos: list, caption: str | None = None, reply_markup=None) -> list:
+    """
+    Send photos (file inputs or URLs) the way the bot always has: one photo
+    with caption and buttons, or media groups of 10 (caption on the first)
+    followed by a message carrying the buttons. Returns the sent photos;
+    once they are out, a failure to send the buttons is only logged.
+    """
+    sent = []
+    async with batch_jobs.result_slot():
+        if len(photos) == 1:
+            sent.append(await message.answer_photo(
+                photos[0],
+                caption=caption[:1024] if caption else None,
+                reply_markup=reply_markup
+            ))
+            return sent
+
+        media_group = []
+        for idx, photo in enumerate(photos[:10]):  # Telegram max 10 media per group
+            if idx == 0 and caption:
+                media_group.append(InputMediaPhoto(media=photo, caption=caption[:1024]))
+            else:
+                media_group.append(InputMediaPhoto(media=photo))
+        sent.extend(await message.answer_media_group(media_group))
+
+        # If more than 10 images, send the rest
+        for photo in photos[10:]:
+            sent.append(await message.answer_photo(photo))
+
+        # Send delete button as separate message for media groups
+        try:
+            await message.answer("✅ Images downloaded", reply_markup=reply_markup)
+        except (TelegramAPIError, TelegramNetworkError) as e:
+            logger.warning(f"Photos sent, but not the button message: {e}")
+    return sent
+
+
+async def send_photo_urls(message, urls: list[str], caption: str | None = None, reply_markup=None) -> bool:
+    """
+    Send image CDN ``urls`` without downloading them. Returns False (and
+    leaves nothing sent) unless every URL is an eligible CDN link that fits
+    and arrives as a photo.
+    """
+    if not DIRECT_URL_DELIVERY or not urls or len(urls) > 10:
+        return False
+    if not all(_is_public_host(u) and (urlsplit(u).hostname or "").endswith(PHOTO_URL_HOSTS) for u in urls):
+        return False
+    sizes = await asyncio.gather(*(content_length(u) for u in urls))
+    if not all(size and size <= URL_PHOTO_LIMIT for size in sizes):
+        return False
+
+    try:
+        sent = await send_photos(message, urls, caption, reply_markup)
+    except (TelegramAPIError, TelegramNetworkError) as e:
+        logger.info(f"URL hand-off of {len(urls)} photo(s) refused: {e}")
+        metrics.URL_HANDOFFS.inc(source="fbcdn", outcome="refused")
+        return False
+    if len(sent) != len(urls) or not all(m.photo for m in sent):
+        # A media group is all-or-nothing on Telegram's side; this is
+        # defensive. Remove what arrived so the local fallback doesn't
+        # send the album twice.
+        logger.warning("URL hand-off sent fewer photos than requested, retrying locally")
+        metrics.URL_HANDOFFS.inc(source="fbcdn", outcome="bad_result")
+        for m in sent:
+            try:
+                await m.delete()
+            except TelegramAPIError:
+                pass
+        return False
+    metrics.URL_HANDOFFS.inc(source="fbcdn", outcome="sent")
+    logger.info(f"URL hand-off sent {len(urls)} photo(s) without local download")
+    return True
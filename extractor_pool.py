@@ -0,0 +1,159 @@
+"""
+Pooled in-process extractors: instaloader and gallery-dl.
+
+- Instaloader instances are kept warm in a small pool so their requests
+  session (connections, cookies, csrftoken) survives between posts. Each
+  call borrows one; files go to the per-call target directory.
+- gallery-dl jobs no longer touch the global ``gallery_dl.config``. Every
+  job gets its own config overrides (``base-directory``/``directory``) on
+  its extractor, and child jobs inherit them, so concurrent jobs never
+  write into each other's temp dirs.
+
+Both run on dedicated thread pools, so they stay off the event loop and
+cannot starve ``asyncio.to_thread`` users.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from gallery_dl import extractor as gdl_extractor, job as gdl_job
+
+logger = logging.getLogger(__name__)
+
+INSTALOADER_POOL_SIZE = int(os.getenv("INSTALOADER_POOL_SIZE", "2"))
+GALLERY_DL_WORKERS = int(os.getenv("GALLERY_DL_WORKERS", "3"))
+
+_ig_executor = ThreadPoolExecutor(max_workers=INSTALOADER_POOL_SIZE, thread_name_prefix="instaloader")
+_gdl_executor = ThreadPoolExecutor(max_workers=GALLERY_DL_WORKERS, thread_name_prefix="gallery-dl")
+
+_extractors_lock = threading.Lock()
+_extractors_loaded = False
+
+_ig_slots = asyncio.Semaphore(INSTALOADER_POOL_SIZE)
+_idle_loaders: list = []
+
+
+def _new_loader():
+    import instaloader
+
+    # dirname_pattern stays "{target}": each download_post call picks the dir
+    return instaloader.Instaloader(
+        download_videos=False,
+        download_video_thumbnails=False,
+        compress_json=False,
+        save_metadata=True,
+        max_connection_attempts=3,
+    )
+
+
+def _download_post(loader, shortcode: str, target_dir: str) -> str:
+    import instaloader
+
+    post = instaloader.Post.from_shortcode(loader.context, shortcode)
+    loader.download_post(post, target_dir)
+    return post.caption or ""
+
+
+async def instagram_post(shortcode: str, target_dir: str) -> str:
+    """
+    Download the images of Instagram post ``shortcode`` into ``target_dir``
+    with a pooled instaloader and return its caption. Raises on failure.
+    """
+    async with _ig_slots:
+        loader = _idle_loaders.pop() if _idle_loaders else await asyncio.get_running_loop().run_in_executor(
+            _ig_executor, _new_loader)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                _ig_executor, _download_post, loader, shortcode, target_dir)
+        finally:
+            _idle_loaders.append(loader)
+
+
+def _isolate(extr, overrides: dict):
+    """Make ``extr`` answer ``overrides`` before falling back to the global config."""
+    base = extr.config
+
+    def config(key, default=None):
+        if key in overrides:
+            return overrides[key]
+        return base(key, default)
+
+    extr.config = config
+    return extr
+
+
+class _IsolatedDownloadJob(gdl_job.DownloadJob):
+    """DownloadJob whose extractor (and child extractors) use private overrides."""
+
+    def __init__(self, url, parent=None, overrides=None):
+        super().__init__(url, parent)
+        self.overrides = parent.overrides if overrides is None else overrides
+        # Only now: Job.__init__ swaps extr.config for the shared lookup on
+        # children of another category, which would drop the overrides
+        _isolate(self.extractor, self.overrides)
+
+
+class _InfoJob(gdl_job.DataJob):
+    """Collects the metadata of every file without downloading anything."""
+
+    def __init__(self, url, parent=None):
+        super().__init__(url, parent)
+        self.results = []
+
+    def handle_url(self, url, kwdict):
+        self.results.append(kwdict)
+
+
+def _load_extractors():
+    """
+    Import every gallery-dl extractor module once. ``extractor.find`` walks
+    a lazy module generator that raises if two threads advance it at the
+    same time; after one full pass it only reads a plain list.
+    """
+    global _extractors_loaded
+    if _extractors_loaded:
+        return
+    with _extractors_lock:
+        if not _extractors_loaded:
+            gdl_extractor.extractors()
+            _extractors_loaded = True
+
+
+def _run_download(url: str, target_dir: str) -> int:
+    _load_extractors()
+    job = _IsolatedDownloadJob(url, overrides={
+        "base-directory": target_dir,
+        "directory": ["."],
+    })
+    return job.run()
+
+
+def _run_info(url: str) -> list[dict]:
+    _load_extractors()
+    job = _InfoJob(url)
+    job.run()
+    return job.results
+
+
+async def gallery_dl_download(url: str, target_dir: str) -> int:
+    """Run a gallery-dl download of ``url`` into ``target_dir``; returns the job status."""
+    return await asyncio.get_running_loop().run_in_executor(_gdl_executor, _run_download, url, target_dir)
+
+
+async def gallery_dl_info(url: str) -> list[dict]:
+    """Return gallery-dl's per-file metadata for ``url`` without downloading."""
+    return await asyncio.get_running_loop().run_in_executor(_gdl_executor, _run_info, url)
+
+
+def shutdown():
+    """Close pooled instaloader sessions and stop the worker threads."""
+    while _idle_loaders:
+        try:
+            _idle_loaders.pop().close()
+        except Exception as e:
+            logger.warning(f"instaloader close failed: {e}")
+    _ig_executor.shutdown(wait=False, cancel_futures=True)
+    _gdl_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,271 @@
+"""
+Fast HTML extraction for the Facebook and Reddit scrapers.
+
+- ``sniff_meta`` pulls ``<meta>`` tags out of the ``<head>`` with a regex
+  scan that stops at ``</head>``, so pages whose ``og:image`` is all we
+  need are never parsed into a tree.
+- ``collect_candidates`` parses the page once with lxml and gathers, in a
+  single walk, the texts for every post-text selector and the ``img`` URLs
+  the old BeautifulSoup code needed up to eight ``select()`` passes for.
+- ``FACEBOOK_DOM_JS`` does the same collection inside Lightpanda via
+  ``Runtime.evaluate``, returning only the needed nodes instead of the
+  whole outerHTML.
+
+All functions are synchronous and CPU-bound; call them via
+``asyncio.to_thread``.
+"""
+
+import html as html_lib
+import json
+import re
+
+import lxml.html
+from lxml import etree
+
+# Facebook post-text selectors, in priority order (same as the old
+# BeautifulSoup selector passes)
+POST_TEXT_SELECTORS = [
+    'div[data-ad-preview="message"]',
+    'div[data-ad-comet-preview="message"]',
+    'div[dir="auto"]',
+    'div[role="article"] p',  # Article post text
+    'article p',
+    'div[aria-label="Story"] p',  # Story text
+]
+SPAN_TEXT_SELECTORS = [
+    'span[dir="auto"]',
+    'span[data-ad-preview="message"]',
+]
+
+# Texts shorter than this are never picked as the description
+MIN_TEXT_LEN = 50
+
+_HEAD_END = re.compile(r'</head\s*>', re.IGNORECASE)
+_META_TAG = re.compile(r'<meta\b([^>]*)>', re.IGNORECASE)
+_META_ATTR = re.compile(r'''([a-zA-Z_:.-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''')
+# get_text(strip=True) equivalent: every text node except script/style
+_TEXT_NODES = etree.XPath('.//text()[not(parent::script or parent::style)]')
+
+
+def sniff_meta(html: str, full: bool = False) -> dict[str, str]:
+    """
+    Return ``{property-or-name: content}`` for the ``<meta>`` tags in the
+    ``<head>`` (first occurrence wins). Scanning stops at ``</head>``
+    unless ``full`` is set or the document has no head end tag.
+    """
+    end = None if full else _HEAD_END.search(html)
+    region = html[:end.start()] if end else html
+    metas: dict[str, str] = {}
+    for m in _META_TAG.finditer(region):
+        attrs = {}
+        for a in _META_ATTR.finditer(m.group(1)):
+            value = a.group(2) if a.group(2) is not None else (a.group(3) if a.group(3) is not None else a.group(4))
+            attrs[a.group(1).lower()] = value
+        key = attrs.get('property') or attrs.get('name')
+        content = attrs.get('content')
+        if key and content and key not in metas:
+            metas[key] = html_lib.unescape(content)
+    return metas
+
+
+def _text(el) -> str:
+    return ''.join(t.strip() for t in _TEXT_NODES(el))
+
+
+def _has_ancestor(el, tag: str, attr: str | None = None, value: str | None = None) -> bool:
+    for anc in el.iterancestors(tag):
+        if attr is None or anc.get(attr) == value:
+            return True
+    return False
+
+
+def _matching_selectors(el) -> tuple[list[int], list[int]]:
+    """Indexes into POST_TEXT_SELECTORS / SPAN_TEXT_SELECTORS matched by ``el``."""
+    tag = el.tag
+    post, span = [], []
+    if tag == 'div':
+        if el.get('data-ad-preview') == 'message':
+            post.append(0)
+        if el.get('data-ad-comet-preview') == 'message':
+            post.append(1)
+        if el.get('dir') == 'auto':
+            post.append(2)
+    elif tag == 'p':
+        if _has_ancestor(el, 'div', 'role', 'article'):
+            post.append(3)
+        if _has_ancestor(el, 'article'):
+            post.append(4)
+        if _has_ancestor(el, 'div', 'aria-label', 'Story'):
+            post.append(5)
+    elif tag == 'span':
+        if el.get('dir') == 'auto':
+            span.append(0)
+        if el.get('data-ad-preview') == 'message':
+            span.append(1)
+    return post, span
+
+
+def collect_candidates(html: str) -> dict:
+    """
+    Parse ``html`` once and collect, in document order:
+    ``post_texts``/``span_texts`` (one list per selector, only texts longer
+    than ``MIN_TEXT_LEN``) and ``imgs`` (``(src, alt)`` pairs).
+    """
+    post_texts = [[] for _ in POST_TEXT_SELECTORS]
+    span_texts = [[] for _ in SPAN_TEXT_SELECTORS]
+    imgs = []
+    if not html or not html.strip():
+        return {"post_texts": post_texts, "span_texts": span_texts, "imgs": imgs}
+
+    try:
+        root = lxml.html.fromstring(html)
+    except ValueError:
+        # str with an XML encoding declaration
+        root = lxml.html.fromstring(html.encode('utf-8'))
+    for el in root.iter('div', 'p', 'span', 'img'):
+        if el.tag == 'img':
+            src = el.get('src')
+            if src:
+                imgs.append((src, el.get('alt', '')))
+            continue
+        post, span = _matching_selectors(el)
+        if not post and not span:
+            continue
+        text = _text(el)
+        if len(text) <= MIN_TEXT_LEN:
+            continue
+        for i in post:
+            post_texts[i].append(text)
+        for i in span:
+            span_texts[i].append(text)
+    return {"post_texts": post_texts, "span_texts": span_texts, "imgs": imgs}
+
+
+def pick_description(post_texts: list[list[str]], span_texts: list[list[str]],
+                     og_description: str | None) -> str | None:
+    """Apply the post-text heuristics to collected candidates (selector order)."""
+    description = None
+
+    for texts in post_texts:
+        for text in texts:
+            if not description or len(text) > len(description):
+                description = text
+                break
+        if description and len(description) > 100:
+            break
+
+    # Also try spans
+    if not description or len(description) < MIN_TEXT_LEN:
+        for texts in span_texts:
+            for text in texts:
+                if not description or len(text) > len(description):
+                    description = text
+                    break
+            if description and len(description) > 100:
+                break
+
+    # Fallback to og:description if no better text found
+    if (not description or len(description) < MIN_TEXT_LEN) and og_description:
+        if not description or len(og_description) > len(description):
+            description = og_description
+
+    return description
+
+
+def _facebook_images(og_image: str | None, imgs) -> list[str]:
+    # Prefer og:image (canonical main image)
+    if og_image:
+        return [og_image]
+    # Fallback: all scontent img tags
+    seen = set()
+    urls = []
+    for src, _alt in imgs:
+        if src in seen:
+            continue
+        if '/v/t' in src and 'scontent' in src:
+            seen.add(src)
+            urls.append(src)
+    return urls
+
+
+def extract_facebook(html: str) -> tuple[str | None, list[str]]:
+    """Return ``(description, image_urls)`` for a rendered Facebook post."""
+    metas = sniff_meta(html)
+    found = collect_candidates(html)
+    description = pick_description(found["post_texts"], found["span_texts"], metas.get('og:description'))
+    return description, _facebook_images(metas.get('og:image'), found["imgs"])
+
+
+def extract_facebook_from_dom(dom: dict) -> tuple[str | None, list[str]]:
+    """Same as ``extract_facebook`` for the JSON returned by ``FACEBOOK_DOM_JS``."""
+    metas = dom.get("meta") or {}
+    post_texts = [[t for t in texts if len(t) > MIN_TEXT_LEN] for texts in dom.get("post", [])]
+    span_texts = [[t for t in texts if len(t) > MIN_TEXT_LEN] for texts in dom.get("span", [])]
+    description = pick_description(post_texts, span_texts, metas.get('og:description'))
+    imgs = [(src, '') for src in dom.get("imgs", [])]
+    return description, _facebook_images(metas.get('og:image'), imgs)
+
+
+def extract_reddit(html: str) -> tuple[str | None, list[str]]:
+    """Return ``(description, image_urls)`` for a rendered Reddit post.
+
+    When the head carries ``og:image``/``twitter:image`` the body is never
+    parsed.
+    """
+    metas = sniff_meta(html)
+    description = metas.get('og:description') or metas.get('description')
+
+    for key in ('og:image', 'twitter:image'):
+        if metas.get(key):
+            return description, [metas[key]]
+
+    found = collect_candidates(html)
+    seen = set()
+    urls = []
+    for src, alt in found["imgs"]:
+        if src in seen:
+            continue
+        if any(x in src for x in ['preview.redd.it', 'i.redd.it', 'external-preview.redd.it']):
+            seen.add(src)
+            if alt and not description:
+                description = alt
+            urls.append(src)
+    return description, urls
+
+
+# Runs inside Lightpanda: collects only the nodes extract_facebook needs and
+# returns them as JSON (a few KB instead of the full outerHTML).
+FACEBOOK_DOM_JS = """
+(() => {
+    const text = (el) => {
+        const parts = [];
+        const walk = (n) => {
+            for (const c of n.childNodes) {
+                if (c.nodeType === 3) { parts.push(c.nodeValue.trim()); }
+                else if (c.nodeType === 1 && c.tagName !== 'SCRIPT' && c.tagName !== 'STYLE') { walk(c); }
+            }
+        };
+        walk(el);
+        return parts.join('');
+    };
+    const collect = (sels) => sels.map(s =>
+        Array.from(document.querySelectorAll(s)).map(text).filter(t => t.length > %(min_len)d));
+    const meta = {};
+    for (const m of document.querySelectorAll('meta')) {
+        const k = m.getAttribute('property') || m.getAttribute('name');
+        const v = m.getAttribute('content');
+        if (k && v && !(k in meta)) meta[k] = v;
+    }
+    const imgs = Array.from(document.querySelectorAll('img')).map(i => i.getAttribute('src')).filter(Boolean);
+    return JSON.stringify({
+        meta: meta,
+        post: collect(%(post)s),
+        span: collect(%(span)s),
+        imgs: imgs,
+    });
+})()
+""" % {
+    "min_len": MIN_TEXT_LEN,
+    "post": json.dumps(POST_TEXT_SELECTORS),
+    "span": json.dumps(SPAN_TEXT_SELECTORS),
+}
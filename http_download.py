@@ -0,0 +1,218 @@
+"""
+Resumable HTTP downloads for direct media URLs (cobalt, tikwm, ultra-igdl).
+
+``fetch(url, path)`` streams the response to disk and, when the connection
+drops or stalls, continues with a ``Range: bytes=<have>-`` request instead
+of starting over (from scratch only if the server ignores ranges). Files
+of at least ``DOWNLOAD_PARALLEL_MIN_MB`` from servers that advertise
+``Accept-Ranges: bytes`` are fetched as ``DOWNLOAD_SEGMENTS`` concurrent
+ranges, each resuming on its own; one range failing for good aborts the
+others, and a server that answers ranges with the whole file (200) is
+downloaded as a single stream instead. The final size is checked against
+``Content-Length``, and a stalled socket (no data for ``READ_TIMEOUT``)
+counts as a drop rather than the whole download having a total timeout.
+
+``progress_cb(pct)`` is awaited as bytes arrive (every ``PROGRESS_STEP``
+percent at most once per ``PROGRESS_INTERVAL``), like yt-dlp's progress.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+import aiohttp
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_SEGMENTS = int(os.getenv("DOWNLOAD_SEGMENTS", "4"))
+DOWNLOAD_PARALLEL_MIN_MB = int(os.getenv("DOWNLOAD_PARALLEL_MIN_MB", "32"))
+# Resumes per download (per segment when parallel) before giving up
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "5"))
+CONNECT_TIMEOUT = 15
+READ_TIMEOUT = 30
+CHUNK_SIZE = 1024 * 1024
+PROGRESS_STEP = 5
+PROGRESS_INTERVAL = 1.0
+
+RESUMES = metrics.Counter("bot_download_resumes_total", "Direct downloads resumed with a range request, by mode",
+                          ("mode",))
+
+_RETRYABLE = (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+
+class DownloadError(Exception):
+    """The download failed for good (HTTP error, retries exhausted, bad size)."""
+
+
+class _RangesIgnored(Exception):
+    """A range request got the whole file (200) despite ``Accept-Ranges``."""
+
+
+class _Progress:
+    def __init__(self, total: int | None, callback):
+        self.total = total
+        self.callback = callback
+        self.done = 0
+        self._last_pct = -PROGRESS_STEP
+        self._last_time = 0.0
+
+    async def add(self, n: int):
+        self.done += n
+        if not self.callback or not self.total:
+            return
+        pct = min(100, self.done * 100 // self.total)
+        now = time.monotonic()
+        if pct - self._last_pct >= PROGRESS_STEP and (now - self._last_time >= PROGRESS_INTERVAL or pct == 100):
+            self._last_pct, self._last_time = pct, now
+            try:
+                await self.callback(pct)
+            except Exception:
+                pass
+
+
+async def _stream(resp: aiohttp.ClientResponse, f, progress: _Progress, limit: int | None = None) -> int:
+    """Write the body to ``f`` at its current offset; returns bytes written."""
+    written = 0
+    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+        if limit is not None and written + len(chunk) > limit:
+            chunk = chunk[:limit - written]
+        await asyncio.to_thread(f.write, chunk)
+        written += len(chunk)
+        await progress.add(len(chunk))
+        if limit is not None and written >= limit:
+            break
+    return written
+
+
+async def _backoff(attempt: int):
+    await asyncio.sleep(min(2 ** attempt, 15))
+
+
+async def _single(session, url: str, path: str, resp: aiohttp.ClientResponse, total: int | None,
+                  progress: _Progress) -> int:
+    """Stream ``resp`` into ``path``, resuming from where it stopped."""
+    have = 0
+    attempt = 0
+    with open(path, "wb") as f:
+        while True:
+            try:
+                if resp is None:
+                    resp = await session.get(url, headers={"Range": f"bytes={have}-"})
+                    if resp.status == 200:
+                        # Range ignored: start over
+                        progress.done -= have
+                        have = 0
+                        f.seek(0)
+                        f.truncate()
+                    elif resp.status != 206 or not resp.headers.get("Content-Range", "").startswith(f"bytes {have}-"):
+                        raise DownloadError(f"HTTP {resp.status} on resume")
+                await _stream(resp, f, progress)
+                have = f.tell()
+                if total is None or have >= total:
+                    return have
+                raise aiohttp.ClientPayloadError(f"connection closed at {have} of {total} bytes")
+            except _RETRYABLE as e:
+                # Whatever arrived before the drop is kept
+                have = f.tell()
+                attempt += 1
+                if attempt > DOWNLOAD_RETRIES:
+                    raise DownloadError(f"gave up after {DOWNLOAD_RETRIES} resumes: {e}") from e
+                RESUMES.inc(mode="single")
+                logger.warning(f"Download of {url[:80]} dropped at {have} bytes ({e}), resuming")
+                await _backoff(attempt - 1)
+            finally:
+                if resp is not None:
+                    resp.release()
+                    resp = None
+
+
+async def _segment(session, url: str, path: str, start: int, end: int, progress: _Progress):
+    """Fetch bytes ``start..end`` (inclusive) into their place in ``path``."""
+    pos = start
+    attempt = 0
+    with open(path, "r+b") as f:
+        while pos <= end:
+            f.seek(pos)
+            try:
+                async with session.get(url, headers={"Range": f"bytes={pos}-{end}"}) as resp:
+                    if resp.status == 200:
+                        raise _RangesIgnored(f"range {pos}-{end} answered with 200")
+                    if resp.status != 206 or not resp.headers.get("Content-Range", "").startswith(f"bytes {pos}-"):
+                        raise DownloadError(f"HTTP {resp.status} for range {pos}-{end}")
+                    await _stream(resp, f, progress, limit=end - pos + 1)
+                pos = f.tell()
+                if pos <= end:
+                    raise aiohttp.ClientPayloadError(f"range ended at {pos}, expected {end + 1}")
+            except _RETRYABLE as e:
+                pos = f.tell()
+                attempt += 1
+                if attempt > DOWNLOAD_RETRIES:
+                    raise DownloadError(f"segment {start}-{end} gave up after {DOWNLOAD_RETRIES} resumes: {e}") from e
+                RESUMES.inc(mode="segment")
+                logger.warning(f"Segment {start}-{end} of {url[:80]} dropped at {pos} ({e}), resuming")
+                await _backoff(attempt - 1)
+
+
+async def _parallel(session, url: str, path: str, total: int, progress: _Progress):
+    """Fetch ``total`` bytes as ``DOWNLOAD_SEGMENTS`` concurrent ranges."""
+    with open(path, "wb") as f:
+        f.truncate(total)
+    step = -(-total // DOWNLOAD_SEGMENTS)
+    try:
+        # The first range to fail cancels the rest
+        async with asyncio.TaskGroup() as tg:
+            for start in range(0, total, step):
+                tg.create_task(_segment(session, url, path, start, min(start + step, total) - 1, progress))
+    except BaseExceptionGroup as eg:
+        ignored = eg.subgroup(_RangesIgnored)
+        raise (ignored.exceptions[0] if ignored else eg.exceptions[0]) from None
+
+
+async def fetch(url: str, path: str, headers: dict | None = None, progress_cb=None) -> int:
+    """Download ``url`` to ``path``; returns the size. Raises ``DownloadError``
+    (or the aiohttp error of the first request) and leaves no partial file."""
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    # Sizes must match Content-Length, so no transparent decompression
+    headers = {**(headers or {}), "Accept-Encoding": "identity"}
+    connector = aiohttp.TCPConnector(limit=max(1, DOWNLOAD_SEGMENTS))
+    try:
+        async with aiohttp.ClientSession(headers=headers, timeout=timeout, connector=connector) as session:
+            resp = await session.get(url)
+            if resp.status != 200:
+                resp.release()
+                raise DownloadError(f"HTTP {resp.status}")
+            total = resp.content_length
+            progress = _Progress(total, progress_cb)
+            ranged = resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+
+            if ranged and total and DOWNLOAD_SEGMENTS > 1 and total >= DOWNLOAD_PARALLEL_MIN_MB * 1024 * 1024:
+                resp.release()
+                try:
+                    await _parallel(session, url, path, total, progress)
+                    logger.info(f"Downloaded {total} bytes in {DOWNLOAD_SEGMENTS} ranges: {os.path.basename(path)}")
+                    resp = None
+                except _RangesIgnored as e:
+                    logger.warning(f"{url[:80]} advertises ranges but ignores them ({e}), using one stream")
+                    progress.done = 0
+                    resp = await session.get(url)
+                    if resp.status != 200:
+                        resp.release()
+                        raise DownloadError(f"HTTP {resp.status}")
+            if resp is not None:
+                await _single(session, url, path, resp, total, progress)
+
+        size = os.path.getsize(path)
+        if total is not None and size != total:
+            raise DownloadError(f"size mismatch: got {size} of {total} bytes")
+        if size == 0:
+            raise DownloadError("empty response")
+        return size
+    except BaseException:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,143 @@
+"""
+Cheap HTTP-first metadata fetchers, tried before launching Lightpanda.
+
+Most public image posts carry ``og:image``/``og:description`` in the
+server-rendered ``<head>``, so a single GET with a browser TLS fingerprint
+(curl_cffi impersonation) usually answers what a 5–25 s browser session
+would. Only the head is read: the body stream is dropped as soon as
+``</head>`` arrives. Reddit is asked through its ``.json`` endpoint first.
+
+Every function returns ``None`` (or empty results) on any failure so the
+caller can escalate to the next tier.
+"""
+
+import html as html_lib
+import json
+import logging
+import re
+
+from curl_cffi.requests import AsyncSession
+
+import html_extract
+
+logger = logging.getLogger(__name__)
+
+IMPERSONATE = "chrome"
+HTTP_TIMEOUT = 10
+# Stop reading after this many bytes even if </head> never shows up
+MAX_HEAD_BYTES = 1_500_000
+
+_HEAD_END = re.compile(rb'</head\s*>', re.IGNORECASE)
+
+
+async def fetch_head(url: str) -> str | None:
+    """GET ``url`` with a browser fingerprint and return the HTML up to ``</head>``."""
+    try:
+        async with AsyncSession(impersonate=IMPERSONATE, timeout=HTTP_TIMEOUT) as session:
+            async with session.stream("GET", url, allow_redirects=True) as resp:
+                if resp.status_code != 200:
+                    logger.info(f"HTTP head fetch {url}: HTTP {resp.status_code}")
+                    return None
+                buf = bytearray()
+                async for chunk in resp.aiter_content():
+                    buf += chunk
+                    m = _HEAD_END.search(buf, max(0, len(buf) - len(chunk) - 16))
+                    if m:
+                        del buf[m.end():]
+                        break
+                    if len(buf) >= MAX_HEAD_BYTES:
+                        break
+        return buf.decode("utf-8", errors="replace")
+    except Exception as e:
+        logger.info(f"HTTP head fetch failed for {url}: {e}")
+        return None
+
+
+async def fetch_json(url: str):
+    """GET ``url`` with a browser fingerprint and decode JSON, or None."""
+    try:
+        async with AsyncSession(impersonate=IMPERSONATE, timeout=HTTP_TIMEOUT) as session:
+            resp = await session.get(url, allow_redirects=True)
+        if resp.status_code != 200:
+            logger.info(f"HTTP JSON fetch {url}: HTTP {resp.status_code}")
+            return None
+        return json.loads(resp.content)
+    except Exception as e:
+        logger.info(f"HTTP JSON fetch failed for {url}: {e}")
+        return None
+
+
+def _is_facebook_content_image(img_url: str) -> bool:
+    # Login walls and error pages carry the generic Facebook logo instead
+    return 'fbcdn.net' in img_url and '/rsrc.php' not in img_url
+
+
+async def facebook_post(url: str) -> tuple[str | None, list[str]]:
+    """``(description, image_urls)`` from the post's server-rendered head."""
+    head = await fetch_head(url)
+    if not head:
+        return None, []
+    metas = html_extract.sniff_meta(head, full=True)
+    og_image = metas.get('og:image')
+    if not og_image or not _is_facebook_content_image(og_image):
+        return None, []
+    logger.info(f"Facebook og:image via HTTP: {og_image[:80]}...")
+    return metas.get('og:description'), [og_image]
+
+
+async def reddit_post_head(url: str) -> tuple[str | None, list[str]]:
+    """``(description, image_urls)`` from a Reddit post's server-rendered head."""
+    head = await fetch_head(url)
+    if not head:
+        return None, []
+    metas = html_extract.sniff_meta(head, full=True)
+    description = metas.get('og:description') or metas.get('description')
+    for key in ('og:image', 'twitter:image'):
+        img = metas.get(key)
+        # share.redd.it cards are generated previews, not the post's media
+        if img and 'share.redd.it' not in img and 'redditstatic.com' not in img:
+            return description, [img]
+    return description, []
+
+
+def _reddit_json_url(url: str) -> str:
+    return url.split('?', 1)[0].split('#', 1)[0].rstrip('/') + '.json'
+
+
+async def reddit_post_json(url: str) -> tuple[str | None, list[str], bool] | None:
+    """
+    Resolve a Reddit post through its ``.json`` endpoint.
+
+    Returns ``(title, image_urls, is_video)`` or None if the endpoint is
+    unavailable (rate limit, blocked IP, unexpected shape).
+    """
+    data = await fetch_json(_reddit_json_url(url))
+    try:
+        post = data[0]["data"]["children"][0]["data"]
+    except (TypeError, KeyError, IndexError):
+        return None
+
+    title = post.get("title")
+    if post.get("is_video") or post.get("post_hint") in ("hosted:video", "rich:video"):
+        return title, [], True
+
+    urls = []
+    if post.get("is_gallery"):
+        meta = post.get("media_metadata") or {}
+        for item in (post.get("gallery_data") or {}).get("items", []):
+            media = meta.get(item.get("media_id"), {})
+            if media.get("status") != "valid":
+                continue
+            src = (media.get("s") or {}).get("u")
+            if src:
+                urls.append(html_lib.unescape(src))
+    elif post.get("post_hint") == "image" and post.get("url_overridden_by_dest"):
+        urls.append(post["url_overridden_by_dest"])
+    else:
+        images = (post.get("preview") or {}).get("images") or []
+        if images and post.get("post_hint") == "link":
+            src = (images[0].get("source") or {}).get("url")
+            if src:
+                urls.append(html_lib.unescape(src))
+
+    return title, urls, False
@@ -1,20 +1,56 @@
 const { ultraigdl } = require('ultra-igdl');
+const readline = require('readline');
 
-const url = process.argv[2];
-if (!url) {
-  console.error('Usage: node igdl_helper.js <instagram_url>');
-  process.exit(1);
+async function download(url) {
+  const dl = new ultraigdl();
+  return dl.download(url);
 }
 
-(async () => {
-  try {
-    const dl = new ultraigdl();
-    const result = await dl.download(url);
-    // Output as JSON to stdout
-    process.stdout.write(JSON.stringify(result));
-  } catch (err) {
-    // Output error as JSON to stdout so Python can parse it
-    process.stdout.write(JSON.stringify({ error: err.message }));
+// Worker mode: newline-delimited JSON over stdin/stdout.
+//   in:  {"id": 1, "url": "https://www.instagram.com/reel/..."}
+//   out: {"id": 1, "result": {...}}  or  {"id": 1, "error": "message"}
+// Requests are handled concurrently; responses carry the request id.
+function runWorker() {
+  const rl = readline.createInterface({ input: process.stdin, terminal: false });
+  const write = (obj) => process.stdout.write(JSON.stringify(obj) + '\n');
+
+  rl.on('line', async (line) => {
+    if (!line.trim()) return;
+    let req;
+    try {
+      req = JSON.parse(line);
+    } catch (err) {
+      console.error(`igdl worker: bad request line: ${err.message}`);
+      return;
+    }
+    try {
+      const result = await download(req.url);
+      write({ id: req.id, result });
+    } catch (err) {
+      write({ id: req.id, error: err.message });
+    }
+  });
+  rl.on('close', () => process.exit(0));
+}
+
+if (process.argv[2] === '--worker') {
+  runWorker();
+} else {
+  const url = process.argv[2];
+  if (!url) {
+    console.error('Usage: node igdl_helper.js <instagram_url> | --worker');
     process.exit(1);
   }
-})();
+
+  (async () => {
+    try {
+      const result = await download(url);
+      // Output as JSON to stdout
+      process.stdout.write(JSON.stringify(result));
+    } catch (err) {
+      // Output error as JSON to stdout so Python can parse it
+      process.stdout.write(JSON.stringify({ error: err.message }));
+      process.exit(1);
+    }
+  })();
+}
@@ -0,0 +1,174 @@
+"""
+Pool of long-lived ``node igdl_helper.js --worker`` processes.
+
+Each worker speaks newline-delimited JSON over stdin/stdout and serves
+many requests concurrently, so Instagram lookups no longer pay Node
+startup and module loading per link. Requests carry ids, time out
+individually, and a crashed worker is respawned on the next request.
+Parsed results are cached briefly so the video and image paths for the
+same link share one lookup.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+IGDL_POOL_SIZE = int(os.getenv("IGDL_POOL_SIZE", "2"))
+IGDL_TIMEOUT = int(os.getenv("IGDL_TIMEOUT_SECONDS", "30"))
+# A reel that falls back to images asks for the same link twice
+IGDL_RESULT_TTL = 120
+
+HELPER_SCRIPT = "igdl_helper.js"
+# Carousel results with long captions easily exceed the 64 KiB default
+_LINE_LIMIT = 16 * 1024 * 1024
+
+
+class _Worker:
+    """One Node process plus the futures of its in-flight requests."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.proc: asyncio.subprocess.Process | None = None
+        self.pending: dict[int, asyncio.Future] = {}
+        # Process each in-flight request was written to
+        self._sent_to: dict[int, asyncio.subprocess.Process] = {}
+        self._ids = itertools.count(1)
+        self._start_lock = asyncio.Lock()
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    async def ensure_started(self):
+        async with self._start_lock:
+            if self.alive:
+                return
+            self.proc = await asyncio.create_subprocess_exec(
+                'node', HELPER_SCRIPT, '--worker',
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                limit=_LINE_LIMIT,
+            )
+            self._tasks = [
+                asyncio.create_task(self._read_stdout(self.proc)),
+                asyncio.create_task(self._read_stderr(self.proc)),
+            ]
+            logger.info(f"igdl worker {self.index} started (pid {self.proc.pid})")
+
+    async def _read_stdout(self, proc):
+        try:
+            while True:
+                line = await proc.stdout.readline()
+                if not line:
+                    break
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    logger.warning(f"igdl worker {self.index}: bad output line {line[:120]!r}")
+                    continue
+                fut = self.pending.pop(msg.get("id"), None)
+                if fut and not fut.done():
+                    fut.set_result(msg)
+        except Exception as e:
+            logger.error(f"igdl worker {self.index} reader error: {e}")
+        finally:
+            await proc.wait()
+            # Only this process's requests: after a respawn, pending also
+            # holds requests for the new one
+            lost = [i for i, p in self._sent_to.items() if p is proc]
+            if lost:
+                logger.warning(f"igdl worker {self.index} exited ({proc.returncode}) "
+                               f"with {len(lost)} request(s) in flight")
+            for req_id in lost:
+                self._sent_to.pop(req_id, None)
+                fut = self.pending.pop(req_id, None)
+                if fut and not fut.done():
+                    fut.set_exception(ConnectionError("igdl worker exited"))
+
+    async def _read_stderr(self, proc):
+        while True:
+            line = await proc.stderr.readline()
+            if not line:
+                break
+            logger.warning(f"igdl worker {self.index}: {line.decode(errors='replace').rstrip()[:200]}")
+
+    async def request(self, url: str, timeout: float) -> dict:
+        req_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        # Registered before starting so the pool sees this worker as busy
+        self.pending[req_id] = fut
+        try:
+            await self.ensure_started()
+            proc = self.proc
+            self._sent_to[req_id] = proc
+            proc.stdin.write((json.dumps({"id": req_id, "url": url}) + "\n").encode())
+            await proc.stdin.drain()
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            self.pending.pop(req_id, None)
+            self._sent_to.pop(req_id, None)
+
+    async def close(self):
+        if self.alive:
+            self.proc.stdin.close()
+            try:
+                await asyncio.wait_for(self.proc.wait(), 5)
+            except asyncio.TimeoutError:
+                self.proc.kill()
+        for task in self._tasks:
+            task.cancel()
+
+
+class IgdlPool:
+    """Round-robins requests over ``size`` workers, least busy first."""
+
+    def __init__(self, size: int = IGDL_POOL_SIZE, timeout: float = IGDL_TIMEOUT):
+        self.workers = [_Worker(i) for i in range(max(1, size))]
+        self.timeout = timeout
+        self._results = TTLCache(ttl=IGDL_RESULT_TTL, maxsize=256)
+
+    def _pick(self) -> _Worker:
+        return min(self.workers, key=lambda w: (len(w.pending), not w.alive))
+
+    async def _lookup(self, url: str) -> dict | None:
+        worker = self._pick()
+        try:
+            msg = await worker.request(url, self.timeout)
+        except asyncio.TimeoutError:
+            logger.error("ultra-igdl timeout")
+            return None
+        except (ConnectionError, OSError) as e:
+            logger.error(f"ultra-igdl worker failed: {e}")
+            return None
+        if "error" in msg:
+            logger.error(f"ultra-igdl error: {msg['error']}")
+            return None
+        result = msg.get("result") or {}
+        code = result.get("code", 0)
+        if code != 200:
+            # Often transient (rate limit, login wall): not cached
+            logger.error(f"ultra-igdl API error (code {code}): {result.get('message', 'unknown')}")
+            return None
+        return result
+
+    async def fetch(self, url: str) -> dict | None:
+        """
+        Return ultra-igdl's parsed result for ``url``, or None on extractor
+        errors, non-200 codes, timeouts and worker crashes. Successful
+        results are cached for ``IGDL_RESULT_TTL`` seconds.
+        """
+        return await self._results.get_or_load(url, lambda: self._lookup(url))
+
+    async def close(self):
+        await asyncio.gather(*(w.close() for w in self.workers), return_exceptions=True)
+
+
+pool = IgdlPool()
@@ -0,0 +1,532 @@
+"""
+Durable job queue between the Telegram front-end and download workers.
+
+With ``BOT_ROLE=frontend`` the polling process only routes messages and
+button presses: every download becomes a row in a SQLite database
+(``JOB_QUEUE_PATH``, on a volume shared with the workers) and the handler
+waits for it. ``BOT_ROLE=worker`` processes claim rows (``serve``), run the
+same pipelines and talk to Telegram themselves with the bot token, so
+status messages and results look exactly as in single-process mode.
+
+- A claimed job holds a lease that its worker renews while it runs; when
+  a worker dies the lease runs out and the job goes back to the queue
+  (at most ``JOB_MAX_ATTEMPTS`` runs in total). A job still queued after
+  ``JOB_MAX_QUEUED_SECONDS`` while no job runs anywhere fails, so links
+  don't wait forever when no worker is alive.
+- Progress of batch items travels back through the row and the front-end
+  writes it into its aggregated status message; ``wait_turn`` keeps batch
+  results in message order across workers.
+- ``SharedDict`` holds the small maps inline buttons need, so a button
+  handled by the front-end finds what a worker stored.
+- ``take_budget`` is a token bucket all workers charge (the per-user
+  expensive-step budget of ``rate_limit``).
+
+SQLite in WAL mode needs no extra service; all queries are short and run
+off the event loop (``_call``).
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import signal
+import socket
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+import metrics
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", os.path.join("queue", "jobs.sqlite3"))
+# A running job whose worker stops renewing for this long is re-queued
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+# A job still queued after this long, with no job running anywhere, fails
+# (no workers alive); 0 = wait forever
+MAX_QUEUED_SECONDS = int(os.getenv("JOB_MAX_QUEUED_SECONDS", "300"))
+# ``Job.error`` of a job that failed that way
+NOT_CLAIMED = "not claimed by any worker"
+POLL_INTERVAL = 0.5
+# Finished jobs are kept this long (for debugging), then purged
+KEEP_SECONDS = 24 * 3600
+# A batch item stops waiting for the previous one after this long
+TURN_TIMEOUT = 600
+# SharedDict entries each process keeps in memory (least recently used go)
+LOCAL_ENTRIES = 65536
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+QUEUE_JOBS = metrics.Gauge("bot_job_queue_jobs", "Jobs in the worker queue, by state", ("state",))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    progress TEXT,
+    error TEXT,
+    batch TEXT,
+    batch_index INTEGER,
+    created REAL NOT NULL,
+    started REAL,
+    lease_until REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch, batch_index);
+CREATE TABLE IF NOT EXISTS shared (
+    ns TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (ns, key)
+);
+CREATE TABLE IF NOT EXISTS budgets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    stamp REAL NOT NULL
+);
+"""
+
+TERMINAL = ("done", "failed")
+
+_conn: sqlite3.Connection | None = None
+_lock = threading.Lock()
+
+
+class Job(NamedTuple):
+    id: int
+    kind: str
+    payload: dict
+    state: str
+    attempts: int
+    progress: str | None
+    error: str | None
+    batch: str | None
+    batch_index: int | None
+
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(QUEUE_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(QUEUE_PATH, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _conn = conn
+    return _conn
+
+
+def _run(fn, *args):
+    """Run ``fn(conn, *args)`` holding the connection lock (blocking)."""
+    with _lock:
+        return fn(_db(), *args)
+
+
+async def _call(fn, *args):
+    return await asyncio.to_thread(_run, fn, *args)
+
+
+def _job(row: sqlite3.Row) -> Job:
+    return Job(row["id"], row["kind"], json.loads(row["payload"]), row["state"], row["attempts"],
+               row["progress"], row["error"], row["batch"], row["batch_index"])
+
+
+# ── front-end side ──────────────────────────────────────────────────────
+
+def _submit(conn, kind, payload, batch, batch_index) -> int:
+    cur = conn.execute(
+        "INSERT INTO jobs (kind, payload, batch, batch_index, created) VALUES (?, ?, ?, ?, ?)",
+        (kind, json.dumps(payload, ensure_ascii=False), batch, batch_index, time.time()))
+    return cur.lastrowid
+
+
+async def submit(kind: str, payload: dict, batch: str | None = None, batch_index: int | None = None) -> int:
+    """Queue a job; returns its id."""
+    job_id = await _call(_submit, kind, payload, batch, batch_index)
+    logger.info(f"Queued job {job_id} ({kind})")
+    return job_id
+
+
+class _Waiter(NamedTuple):
+    future: asyncio.Future
+    on_progress: object
+    last_progress: list
+
+
+_waiters: dict[int, _Waiter] = {}
+_poller: asyncio.Task | None = None
+
+
+def _states(conn, ids):
+    marks = ",".join("?" * len(ids))
+    if MAX_QUEUED_SECONDS > 0:
+        now = time.time()
+        expired = conn.execute(
+            f"UPDATE jobs SET state = 'failed', error = ?, finished = ? "
+            f"WHERE id IN ({marks}) AND state = 'queued' AND created < ? "
+            # Busy workers hold live leases; a long backlog is not a dead fleet
+            f"AND NOT EXISTS (SELECT 1 FROM jobs WHERE state = 'running' AND lease_until >= ?)",
+            (NOT_CLAIMED, now, *ids, now - MAX_QUEUED_SECONDS, now)).rowcount
+        if expired:
+            logger.warning(f"{expired} job(s) not claimed by any worker in {MAX_QUEUED_SECONDS}s")
+    return conn.execute(f"SELECT * FROM jobs WHERE id IN ({marks})", ids).fetchall()
+
+
+async def _poll_waiters():
+    """One query per interval for every job the front-end is waiting on."""
+    global _poller
+    try:
+        while _waiters:
+            await asyncio.sleep(POLL_INTERVAL)
+            try:
+                rows = await _call(_states, list(_waiters))
+            except sqlite3.Error as e:
+                logger.warning(f"Job queue poll failed: {e}")
+                continue
+            for row in rows:
+                waiter = _waiters.get(row["id"])
+                if waiter is None:
+                    continue
+                if waiter.on_progress and row["progress"] and row["progress"] != waiter.last_progress[0]:
+                    waiter.last_progress[0] = row["progress"]
+                    try:
+                        await waiter.on_progress(row["progress"])
+                    except Exception:
+                        pass
+                if row["state"] in TERMINAL:
+                    _waiters.pop(row["id"], None)
+                    if not waiter.future.done():
+                        waiter.future.set_result(_job(row))
+    finally:
+        _poller = None
+
+
+async def wait(job_id: int, on_progress=None) -> Job:
+    """Wait until the job is done or failed (``error`` is ``NOT_CLAIMED``
+    when no worker took it within ``MAX_QUEUED_SECONDS``).
+
+    ``on_progress(text)`` is awaited whenever the worker reports new progress.
+    """
+    global _poller
+    future = asyncio.get_running_loop().create_future()
+    _waiters[job_id] = _Waiter(future, on_progress, [None])
+    if _poller is None:
+        _poller = asyncio.create_task(_poll_waiters())
+    try:
+        return await future
+    finally:
+        _waiters.pop(job_id, None)
+
+
+def _counts(conn) -> dict[str, int]:
+    return dict(conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+
+async def collect_metrics():
+    """``metrics.on_scrape`` collector: queue depth by state."""
+    counts = await _call(_counts)
+    for state in ("queued", "running", *TERMINAL):
+        QUEUE_JOBS.set(counts.get(state, 0), state=state)
+
+
+def _purge(conn) -> int:
+    now = time.time()
+    removed = conn.execute("DELETE FROM jobs WHERE state IN ('done', 'failed') AND finished < ?",
+                           (now - KEEP_SECONDS,)).rowcount
+    conn.execute("DELETE FROM shared WHERE expires < ?", (now,))
+    # Untouched for this long, a budget is full again (or close enough)
+    conn.execute("DELETE FROM budgets WHERE stamp < ?", (now - KEEP_SECONDS,))
+    return removed
+
+
+async def maintenance():
+    """Background task (front-end): purge old jobs and expired shared entries."""
+    while True:
+        try:
+            removed = await _call(_purge)
+            if removed:
+                logger.info(f"Job queue: purged {removed} finished job(s)")
+        except sqlite3.Error as e:
+            logger.error(f"Job queue maintenance error: {e}")
+        await asyncio.sleep(3600)
+
+
+# ── worker side ─────────────────────────────────────────────────────────
+
+def _claim(conn, worker) -> Job | None:
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Jobs of dead workers: back to the queue, or failed after MAX_ATTEMPTS runs
+        conn.execute("UPDATE jobs SET state = 'failed', error = 'worker lost', finished = ? "
+                     "WHERE state = 'running' AND lease_until < ? AND attempts >= ?", (now, now, MAX_ATTEMPTS))
+        requeued = conn.execute("UPDATE jobs SET state = 'queued', worker = NULL "
+                                "WHERE state = 'running' AND lease_until < ?", (now,)).rowcount
+        if requeued:
+            logger.warning(f"Re-queued {requeued} job(s) of lost workers")
+        row = conn.execute("SELECT id FROM jobs WHERE state = 'queued' ORDER BY id LIMIT 1").fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute("UPDATE jobs SET state = 'running', worker = ?, attempts = attempts + 1, "
+                     "started = ?, lease_until = ? WHERE id = ?", (worker, now, now + LEASE_SECONDS, row["id"]))
+        job = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+        conn.execute("COMMIT")
+        return _job(job)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _renew(conn, job_id, worker):
+    conn.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                 (time.time() + LEASE_SECONDS, job_id, worker))
+
+
+def _finish(conn, job_id, worker, error, progress):
+    conn.execute("UPDATE jobs SET state = ?, error = ?, finished = ?, progress = COALESCE(?, progress) "
+                 "WHERE id = ? AND worker = ?",
+                 ("failed" if error else "done", error, time.time(), progress, job_id, worker))
+
+
+# Latest unsent progress per job; written at most once per POLL_INTERVAL
+_progress: dict[int, str] = {}
+_progress_task: asyncio.Task | None = None
+
+
+def _write_progress(conn, items):
+    conn.executemany("UPDATE jobs SET progress = ? WHERE id = ?", [(text, job_id) for job_id, text in items])
+
+
+async def _flush_progress():
+    global _progress_task
+    try:
+        while _progress:
+            await asyncio.sleep(POLL_INTERVAL)
+            items = list(_progress.items())
+            _progress.clear()
+            try:
+                await _call(_write_progress, items)
+            except sqlite3.Error as e:
+                logger.warning(f"Job progress write failed: {e}")
+    finally:
+        _progress_task = None
+
+
+def report(job_id: int, text: str):
+    """Record progress text for the front-end (coalesced, non-blocking)."""
+    global _progress_task
+    _progress[job_id] = text
+    if _progress_task is None:
+        _progress_task = asyncio.create_task(_flush_progress())
+
+
+def _previous_done(conn, batch, index) -> bool:
+    row = conn.execute("SELECT state FROM jobs WHERE batch = ? AND batch_index = ?", (batch, index - 1)).fetchone()
+    return row is None or row["state"] in TERMINAL
+
+
+async def wait_turn(job: Job):
+    """Wait until the previous item of the job's batch has finished."""
+    if job.batch is None or not job.batch_index:
+        return
+    deadline = time.monotonic() + TURN_TIMEOUT
+    while time.monotonic() < deadline:
+        if await _call(_previous_done, job.batch, job.batch_index):
+            return
+        await asyncio.sleep(POLL_INTERVAL)
+    logger.warning(f"Job {job.id}: previous batch item still running, sending out of order")
+
+
+async def _run_job(job: Job, handler):
+    async def _keep_lease():
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            try:
+                await _call(_renew, job.id, WORKER_ID)
+            except sqlite3.Error as e:
+                logger.warning(f"Job {job.id}: lease renewal failed: {e}")
+
+    renewer = asyncio.create_task(_keep_lease())
+    error = None
+    start = time.monotonic()
+    try:
+        await handler(job)
+    except Exception as e:
+        logger.error(f"Job {job.id} ({job.kind}) failed: {e}", exc_info=True)
+        error = f"{type(e).__name__}: {e}"[:500]
+    finally:
+        renewer.cancel()
+        try:
+            await _call(_finish, job.id, WORKER_ID, error, _progress.pop(job.id, None))
+        except sqlite3.Error as e:
+            logger.error(f"Job {job.id}: could not record result: {e}")
+    logger.info(f"Job {job.id} ({job.kind}) {'failed' if error else 'done'} in {time.monotonic() - start:.1f}s")
+
+
+async def serve(handler, concurrency: int):
+    """Worker main loop: claim jobs and run ``handler(job)``, ``concurrency``
+    at a time. SIGTERM/SIGINT stop claiming and let running jobs finish."""
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    slots = asyncio.Semaphore(max(1, concurrency))
+    running: set[asyncio.Task] = set()
+    logger.info(f"Worker {WORKER_ID} serving {QUEUE_PATH} ({concurrency} concurrent jobs)")
+    while not stop.is_set():
+        await slots.acquire()
+        job = None
+        while job is None and not stop.is_set():
+            try:
+                job = await _call(_claim, WORKER_ID)
+            except sqlite3.Error as e:
+                logger.warning(f"Job claim failed: {e}")
+            if job is None:
+                try:
+                    await asyncio.wait_for(stop.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        if job is None:
+            slots.release()
+            break
+        logger.info(f"Job {job.id} ({job.kind}) claimed, attempt {job.attempts}")
+        task = asyncio.create_task(_run_job(job, handler))
+        running.add(task)
+        task.add_done_callback(running.discard)
+        task.add_done_callback(lambda _t: slots.release())
+
+    if running:
+        logger.info(f"Stopping: waiting for {len(running)} running job(s)")
+        await asyncio.gather(*running, return_exceptions=True)
+
+
+# ── shared maps ─────────────────────────────────────────────────────────
+
+# Pending SharedDict writes, applied in order by one background task
+_shared_writes: list[tuple[str, tuple]] = []
+_shared_writer: asyncio.Task | None = None
+
+
+def _apply_shared_writes(conn, items):
+    conn.execute("BEGIN")
+    try:
+        for sql, params in items:
+            conn.execute(sql, params)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+async def _flush_shared_writes():
+    global _shared_writer
+    try:
+        while _shared_writes:
+            items = list(_shared_writes)
+            _shared_writes.clear()
+            try:
+                await _call(_apply_shared_writes, items)
+            except sqlite3.Error as e:
+                logger.warning(f"Shared map write failed: {e}")
+    finally:
+        _shared_writer = None
+
+
+def _shared_get(conn, namespace, key):
+    return conn.execute("SELECT value FROM shared WHERE ns = ? AND key = ? AND expires >= ?",
+                        (namespace, key, time.time())).fetchone()
+
+
+def _take_budget(conn, key, rate, capacity, cost, max_wait) -> float:
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT tokens, stamp FROM budgets WHERE key = ?", (key,)).fetchone()
+        tokens = capacity if row is None else min(capacity, row["tokens"] + max(0.0, now - row["stamp"]) * rate)
+        if tokens >= cost:
+            wait = 0.0
+        else:
+            wait = (cost - tokens) / rate if rate > 0 else math.inf
+        if wait <= max_wait:
+            conn.execute("INSERT OR REPLACE INTO budgets (key, tokens, stamp) VALUES (?, ?, ?)",
+                         (key, tokens - cost, now))
+        conn.execute("COMMIT")
+        return wait
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+async def take_budget(key: str, rate: float, capacity: float, cost: float, max_wait: float) -> float:
+    """Token bucket kept in the queue database, shared by every process
+    (same rules as ``rate_limit.TokenBucket``). Charges ``cost`` and returns
+    the seconds to wait for it; nothing is charged when that is over
+    ``max_wait``."""
+    return await _call(_take_budget, key, rate, capacity, cost, max_wait)
+
+
+class SharedDict:
+    """Map stored in the queue database, visible to every process.
+
+    Values must be JSON-serializable; entries expire after ``ttl`` seconds.
+    Writes go to a local copy at once and reach the database from a
+    background task; ``get``/``pop`` are coroutines that read the local
+    copy first, so no query ever runs on the event loop. With
+    ``shared=False`` (single process) only the local copy is used.
+    """
+
+    def __init__(self, namespace: str, ttl: int = 2 * 24 * 3600, shared: bool = True):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.shared = shared
+        self._local = TTLCache(ttl=ttl, maxsize=LOCAL_ENTRIES)
+
+    def _write(self, sql: str, params: tuple):
+        global _shared_writer
+        _shared_writes.append((sql, params))
+        if _shared_writer is None:
+            _shared_writer = asyncio.create_task(_flush_shared_writes())
+
+    def __setitem__(self, key, value):
+        self._local.set(key, value)
+        if self.shared:
+            self._write("INSERT OR REPLACE INTO shared (ns, key, value, expires) VALUES (?, ?, ?, ?)",
+                        (self.namespace, str(key), json.dumps(value), time.time() + self.ttl))
+
+    async def get(self, key, default=None):
+        value = self._local.get(key, _MISSING)
+        if value is not _MISSING or not self.shared:
+            return default if value is _MISSING else value
+        # Entries popped here may still be on their way out of the database
+        if _shared_writer is not None:
+            await asyncio.shield(_shared_writer)
+        row = await _call(_shared_get, self.namespace, str(key))
+        return json.loads(row["value"]) if row else default
+
+    async def pop(self, key, default=None):
+        value = await self.get(key, _MISSING)
+        self._local.pop(key)
+        if value is _MISSING:
+            return default
+        if self.shared:
+            self._write("DELETE FROM shared WHERE ns = ? AND key = ?", (self.namespace, str(key)))
+        return value
+
+
+_MISSING = object()
@@ -4,33 +4,62 @@ import logging
 import os
 import re
 import time
+from contextlib import asynccontextmanager
 from pathlib import Path
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
-from aiogram.types import BufferedInputFile, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, FSInputFile
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
 import yt_dlp
 import aiofiles
-from gallery_dl import config as gdl_config, job as gdl_job
 import tempfile
 import shutil
 import facebook_scraper
 
-from bs4 import BeautifulSoup
-
 import websockets
 import aiohttp
 
+import audio_derive
+import batch_jobs
+import delivery
+import extractor_pool
+import html_extract
+import http_download
+import http_meta
+import igdl_pool
+import image_fetcher
+import job_queue
 import markov_service
+import metrics
+import profiling
+import rate_limit
+import send_queue
+import url_canonical
+import size_plan
+import tracing
+import url_classifier
+import webhook
+import workspace
+import ydl_info
+from url_classifier import classify
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 COBALT_URL = os.getenv("COBALT_URL", "http://cobalt-api:9000")
 LIGHTPANDA_URL = os.getenv("LIGHTPANDA_URL", "ws://lightpanda:9222")
+TIKWM_URL = os.getenv("TIKWM_URL", "https://www.tikwm.com").rstrip("/")
+# Extract post text/images inside Lightpanda (Runtime.evaluate) instead of
+# shipping the whole outerHTML back and parsing it here.
+LIGHTPANDA_DOM_EXTRACT = os.getenv("LIGHTPANDA_DOM_EXTRACT", "false").lower() in ("true", "1", "yes", "on")
 # Optional Telegram Local Bot API Server: lifts the 50MB upload limit to 2GB.
 # When set, Bot uses the local server (see docker-compose bot-api-server).
 LOCAL_API_SERVER = os.getenv("LOCAL_API_SERVER", "")
+# getFile only serves files up to 20 MB on the cloud Bot API
+BOT_API_DOWNLOAD_LIMIT = 20 * 1024 * 1024
+# Largest upload Telegram accepts (the local Bot API server lifts 50 MB to 2 GB)
+UPLOAD_LIMIT = (2000 if LOCAL_API_SERVER else 50) * 1024 * 1024
 
 # Markov configuration
 MARKOV_ENABLED = os.getenv("MARKOV_ENABLED", "false").lower() in ("true", "1", "yes", "on")
@@ -41,6 +70,15 @@ MARKOV_MODEL_PATH = os.getenv("MARKOV_MODEL_PATH", "./model.json")
 MARKOV_LEARN_ENABLED = os.getenv("MARKOV_LEARN_ENABLED", "true").lower() in ("true", "1", "yes", "on")
 MARKOV_RETRAIN_INTERVAL_HOURS = int(os.getenv("MARKOV_RETRAIN_INTERVAL_HOURS", "24"))
 
+# Telegram user ids allowed to run admin commands (/trace, /profile), comma-separated
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x.lstrip("-").isdigit()}
+
+# Process role: "all" polls and downloads (single process), "frontend" polls
+# and queues download jobs, "worker" runs queued jobs (see job_queue)
+BOT_ROLE = os.getenv("BOT_ROLE", "all").strip().lower()
+if BOT_ROLE not in ("all", "frontend", "worker"):
+    raise SystemExit(f"Unknown BOT_ROLE: {BOT_ROLE!r} (expected all, frontend or worker)")
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
@@ -56,20 +94,51 @@ Path("logs").mkdir(exist_ok=True)
 
 if LOCAL_API_SERVER:
     # Local Bot API Server (aiogram/telegram-bot-api): no 50MB upload cap
-    bot = Bot(token=BOT_TOKEN, server=TelegramAPIServer.from_base(LOCAL_API_SERVER, is_local=True))
+    # aiogram 3 takes the server on the session; Bot(server=...) is silently ignored
+    bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(LOCAL_API_SERVER, is_local=True)))
     logger.info(f"Using Local Bot API Server at {LOCAL_API_SERVER}")
 else:
     bot = Bot(token=BOT_TOKEN)
+bot.session.middleware(metrics.TelegramRequestMetrics())
+bot.session.middleware(tracing.TelegramRequestTracing())
+# Innermost: flood waits are sat out here, inside the metrics/tracing timing
+bot.session.middleware(send_queue.SendQueue())
 dp = Dispatcher()
 
-pending_downloads = {}
+# Concurrency limits for download jobs
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "4"))
+MAX_URLS_PER_MESSAGE = int(os.getenv("MAX_URLS_PER_MESSAGE", "5"))
+job_semaphore = asyncio.Semaphore(max(1, MAX_CONCURRENT_JOBS))
+
+# Per-user/chat/platform token buckets for links and buttons (see rate_limit)
+_rate_limiter = rate_limit.RateLimitMiddleware(exempt=ADMIN_IDS, max_links=MAX_URLS_PER_MESSAGE)
+dp.message.middleware(_rate_limiter)
+dp.callback_query.middleware(_rate_limiter)
+if BOT_ROLE == "worker":
+    # One expensive-step budget per user across all workers
+    rate_limit.share_budget(job_queue.take_budget)
+
+PLATFORM_EMOJI = {
+    url_classifier.YOUTUBE: "▶️",
+    url_classifier.FACEBOOK: "📹",
+    url_classifier.TIKTOK: "🎵",
+    url_classifier.REDDIT: "🤖",
+    url_classifier.TWITTER: "🐦",
+    url_classifier.INSTAGRAM: "📸",
+}
+
+# Buttons sent by a worker are handled by the front-end: share their state
+pending_downloads = job_queue.SharedDict("pending_downloads", shared=BOT_ROLE != "all")
 # Store original message info for delete button
-original_messages = {}
+original_messages = job_queue.SharedDict("original_messages", shared=BOT_ROLE != "all")
 # Store status messages for scheduled cleanup
 status_messages = {}
 
 async def delete_message_after_delay(message: types.Message, delay: int = 5):
     """Delete a message after specified delay in seconds"""
+    if batch_jobs.is_batch_item(message):
+        # Lines of a batch status message are not separate messages
+        return
     await asyncio.sleep(delay)
     try:
         await bot.delete_message(chat_id=message.chat.id, message_id=message.message_id)
@@ -92,12 +161,13 @@ async def _delete_scheduled(key: str, delay_seconds: int):
         except:
             pass
 
-def get_ydl_opts(url='', format_type='video', progress_cb=None):
-    is_youtube = 'youtube.com' in url or 'youtu.be' in url
-    is_reddit = 'reddit.com' in url or 'redd.it' in url
+def get_ydl_opts(url='', format_type='video', progress_cb=None, route=None):
+    platform = (route or classify(url)).platform
+    is_youtube = platform == url_classifier.YOUTUBE
+    is_reddit = platform == url_classifier.REDDIT
 
     base_opts = {
-        'outtmpl': 'downloads/%(id)s.%(ext)s',
+        'outtmpl': os.path.join(workspace.current_dir(), '%(id)s.%(ext)s'),
         'quiet': True,
         'no_warnings': True,
         'socket_timeout': 30,
@@ -109,15 +179,20 @@ def get_ydl_opts(url='', format_type='video', progress_cb=None):
     }
 
     if progress_cb:
+        # Downloads run in a worker thread: hand progress back to the loop
+        loop = asyncio.get_running_loop()
+
+        def _report(pct):
+            loop.call_soon_threadsafe(lambda: asyncio.create_task(progress_cb(pct)))
+
         def _hook(d):
             if d.get('status') == 'downloading':
                 total = d.get('total_bytes') or d.get('total_bytes_estimate')
                 downloaded = d.get('downloaded_bytes') or 0
                 if total:
-                    pct = int(downloaded / total * 100)
-                    asyncio.create_task(progress_cb(pct))
+                    _report(int(downloaded / total * 100))
             elif d.get('status') == 'finished':
-                asyncio.create_task(progress_cb(100))
+                _report(100)
         base_opts['progress_hooks'] = [_hook]
 
     # Add cookies if available (for YouTube bot detection bypass)
@@ -158,7 +233,7 @@ def get_ydl_opts(url='', format_type='video', progress_cb=None):
             'format': 'bestvideo+bestaudio/best',
             'merge_output_format': 'mp4',
         })
-    elif 'tiktok.com' in url:
+    elif platform == url_classifier.TIKTOK:
         # TikTok web extractor breaks often ("unable to extract universal data").
         # Force the mobile API extractor which is more stable. (verified 2026-08-13)
         base_opts['format'] = 'h264[ext=mp4]/best[ext=mp4]/best'
@@ -188,55 +263,9 @@ async def cleanup_directory(dirpath: str):
     except Exception as e:
         logger.error(f"Directory cleanup error: {e}")
 
-def is_youtube(url: str) -> bool:
-    return 'youtube.com' in url or 'youtu.be' in url
-
-def is_facebook(url: str) -> bool:
-    """Check if URL is from Facebook"""
-    return 'facebook.com' in url
-
-def is_facebook_video(url: str) -> bool:
-    """Check if URL is a Facebook video (reel, watch, video post)"""
-    if 'fb.watch' in url:
-        return True
-    if not is_facebook(url):
-        return False
-    video_patterns = ['/reel/', '/watch', '/videos/', '/video.php', 'story_fbid=', '/share/r/', '/share/v/']
-    return any(pattern in url for pattern in video_patterns)
-
-def is_twitter(url: str) -> bool:
-    """Check if URL is from Twitter/X"""
-    return 'twitter.com' in url or 'x.com' in url or 't.co' in url
-
-def is_reddit(url: str) -> bool:
-    """Check if URL is from Reddit"""
-    return 'reddit.com' in url or 'redd.it' in url
-
-def is_tiktok(url: str) -> bool:
-    """Check if URL is from TikTok"""
-    return 'tiktok.com' in url or 'vm.tiktok' in url
-
-def is_image_platform(url: str) -> bool:
-    """Check if URL is from a platform that has images (posts, not videos)"""
-    # Facebook posts (not reels) and Instagram posts
-    if 'instagram.com' in url and '/reel/' not in url and '/stories/' not in url and '/story/' not in url:
-        return True
-    if 'facebook.com' in url and not is_facebook_video(url):
-        return True
-    if is_reddit(url):
-        return True
-    return False
-
-def is_instagram_reel(url: str) -> bool:
-    """Check if URL is an Instagram reel (video)"""
-    return 'instagram.com' in url and '/reel/' in url
-
-def is_instagram_story(url: str) -> bool:
-    """Check if URL is an Instagram story"""
-    return 'instagram.com' in url and ('/stories/' in url or '/story/' in url)
-
-async def download_via_tikwm(url: str, output_dir: str = "downloads") -> str | None:
-    """Download a TikTok video via tikwm.com API.
+@metrics.track("tikwm")
+async def resolve_tikwm(url: str) -> delivery.RemoteMedia | None:
+    """Resolve a TikTok video to its CDN URL via tikwm.com API.
 
     tikwm.com resolves TikTok videos server-side and returns the CDN URL with
     a real muxed audio track — this bypasses TikTok's JS challenge/rate limits
@@ -244,7 +273,7 @@ async def download_via_tikwm(url: str, output_dir: str = "downloads") -> str | N
     """
     try:
         logger.info(f"Trying tikwm for: {url}")
-        api = f"https://www.tikwm.com/api/?url={url}"
+        api = f"{TIKWM_URL}/api/?url={url}"
         async with aiohttp.ClientSession() as session:
             async with session.get(api, headers={"User-Agent": "Mozilla/5.0"}) as resp:
                 if resp.status != 200:
@@ -260,29 +289,39 @@ async def download_via_tikwm(url: str, output_dir: str = "downloads") -> str | N
         if not video_url:
             logger.error("tikwm: no play URL in response")
             return None
+        return delivery.RemoteMedia(video_url, data["data"].get("size") or None, "tikwm")
+    except Exception as e:
+        logger.error(f"tikwm resolve error: {e}")
+        return None
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(video_url, headers={"User-Agent": "Mozilla/5.0"}) as resp:
-                if resp.status != 200:
-                    logger.error(f"tikwm video HTTP {resp.status}")
-                    return None
-                content = await resp.read()
 
-        filename = os.path.join(output_dir, f"tikwm_{int(time.time())}.mp4")
-        async with aiofiles.open(filename, 'wb') as f:
-            await f.write(content)
+@metrics.track("tikwm_download")
+async def download_via_tikwm(url: str, output_dir: str | None = None,
+                             media: delivery.RemoteMedia | None = None, progress_cb=None) -> str | None:
+    """Download a TikTok video via tikwm.com API (``media``: already resolved)."""
+    try:
+        media = media or await resolve_tikwm(url)
+        if not media:
+            return None
 
-        if os.path.getsize(filename) > 0:
-            logger.info(f"tikwm downloaded {os.path.getsize(filename)} bytes")
-            return filename
-        return None
+        filename = os.path.join(output_dir or workspace.current_dir(), f"tikwm_{int(time.time())}.mp4")
+        size = await http_download.fetch(media.url, filename, headers={"User-Agent": "Mozilla/5.0"},
+                                         progress_cb=progress_cb)
+        logger.info(f"tikwm downloaded {size} bytes")
+        return filename
     except Exception as e:
         logger.error(f"tikwm download error: {e}")
         return None
 
 
-async def download_via_cobalt(url: str, output_dir: str = "downloads") -> str | None:
-    """Download a video using cobalt-api (internal Docker service)."""
+@metrics.track("cobalt")
+async def resolve_cobalt(url: str) -> tuple[delivery.RemoteMedia, str] | None:
+    """Ask cobalt-api (internal Docker service) for a media URL.
+
+    Returns ``(media, filename_hint)``. Only ``redirect`` responses point at
+    the origin CDN; ``tunnel``/``stream`` URLs go through cobalt itself and
+    are not public.
+    """
     try:
         logger.info(f"Trying cobalt for: {url}")
 
@@ -327,27 +366,42 @@ async def download_via_cobalt(url: str, output_dir: str = "downloads") -> str |
             logger.error("Cobalt returned no download URL")
             return None
 
-        output_path = os.path.join(output_dir, filename_hint)
+        media = delivery.RemoteMedia(download_url, None, "cobalt", public=status == "redirect")
+        return media, filename_hint
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                download_url,
-                timeout=aiohttp.ClientTimeout(total=120)
-            ) as resp:
-                if resp.status != 200:
-                    logger.error(f"Error downloading from cobalt URL: {resp.status}")
-                    return None
+    except aiohttp.ClientConnectorError:
+        logger.error("Could not connect to cobalt-api. Is the service running?")
+        return None
+    except asyncio.TimeoutError:
+        logger.error("Timeout connecting to cobalt-api")
+        return None
+    except Exception as e:
+        logger.error(f"Error in cobalt: {e}", exc_info=True)
+        return None
 
-                async with aiofiles.open(output_path, 'wb') as f:
-                    async for chunk in resp.content.iter_chunked(1024 * 1024):
-                        await f.write(chunk)
 
-        if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-            logger.info(f"Cobalt downloaded: {output_path} ({os.path.getsize(output_path)} bytes)")
-            return output_path
+@metrics.track("cobalt_download")
+async def download_via_cobalt(url: str, output_dir: str | None = None,
+                              resolved: tuple[delivery.RemoteMedia, str] | None = None,
+                              progress_cb=None) -> str | None:
+    """Download a video using cobalt-api (``resolved``: from ``resolve_cobalt``)."""
+    try:
+        resolved = resolved or await resolve_cobalt(url)
+        if not resolved:
+            return None
+        media, filename_hint = resolved
 
-        return None
+        # The hint comes from the remote side: keep only the base name
+        output_path = os.path.join(output_dir or workspace.current_dir(),
+                                   os.path.basename(filename_hint) or "cobalt_video.mp4")
+
+        size = await http_download.fetch(media.url, output_path, progress_cb=progress_cb)
+        logger.info(f"Cobalt downloaded: {output_path} ({size} bytes)")
+        return output_path
 
+    except http_download.DownloadError as e:
+        logger.error(f"Error downloading from cobalt URL: {e}")
+        return None
     except aiohttp.ClientConnectorError:
         logger.error("Could not connect to cobalt-api. Is the service running?")
         return None
@@ -358,27 +412,13 @@ async def download_via_cobalt(url: str, output_dir: str = "downloads") -> str |
         logger.error(f"Error in cobalt: {e}", exc_info=True)
         return None
 
-async def download_instagram_via_ultraigdl(url: str, output_dir: str = "downloads") -> tuple[str | None, str | None]:
+@metrics.track("ultraigdl")
+async def download_instagram_via_ultraigdl(url: str, output_dir: str | None = None,
+                                           progress_cb=None) -> tuple[str | None, str | None]:
     """Download Instagram video via ultra-igdl (Node.js package). Returns (filepath, caption)."""
     try:
-        proc = await asyncio.create_subprocess_exec(
-            'node', 'igdl_helper.js', url,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=30)
-        if proc.returncode != 0:
-            logger.error(f"ultra-igdl failed (exit {proc.returncode}): {stderr.decode()[:200]}")
-            return None, None
-
-        result = json.loads(stdout.decode())
-        if "error" in result:
-            logger.error(f"ultra-igdl error: {result['error']}")
-            return None, None
-
-        code = result.get("code", 0)
-        if code != 200:
-            logger.error(f"ultra-igdl API error (code {code}): {result.get('message', 'unknown')}")
+        result = await igdl_pool.pool.fetch(url)
+        if not result:
             return None, None
 
         caption = result.get("caption", "") or ""
@@ -400,26 +440,16 @@ async def download_instagram_via_ultraigdl(url: str, output_dir: str = "download
         parsed = urlparse(media_url)
         path = parsed.path
         ext = path.split('.')[-1].split('?')[0] if '.' in path else 'mp4'
-        output_path = os.path.join(output_dir, f"ig_ultra.{ext}")
+        output_path = os.path.join(output_dir or workspace.current_dir(), f"ig_ultra.{ext}")
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                media_url,
-                timeout=aiohttp.ClientTimeout(total=120),
-                headers={"User-Agent": "Mozilla/5.0"}
-            ) as resp:
-                if resp.status != 200:
-                    logger.error(f"ultra-igdl download failed: HTTP {resp.status}")
-                    return None, None
-                async with aiofiles.open(output_path, 'wb') as f:
-                    async for chunk in resp.content.iter_chunked(1024 * 1024):
-                        await f.write(chunk)
-
-        if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-            logger.info(f"ultra-igdl saved: {output_path} ({os.path.getsize(output_path)} bytes)")
-            return output_path, caption
-        return None, None
+        size = await http_download.fetch(media_url, output_path, headers={"User-Agent": "Mozilla/5.0"},
+                                         progress_cb=progress_cb)
+        logger.info(f"ultra-igdl saved: {output_path} ({size} bytes)")
+        return output_path, caption
 
+    except http_download.DownloadError as e:
+        logger.error(f"ultra-igdl download failed: {e}")
+        return None, None
     except asyncio.TimeoutError:
         logger.error("ultra-igdl timeout")
         return None, None
@@ -450,6 +480,7 @@ async def update_status(status_msg: types.Message, emoji: str, text: str, pct: i
         pass
 
 
+@tracing.traced("ffprobe.duration")
 async def _ffprobe_duration(input_file: str) -> float | None:
     """Returns the duration in seconds, or None on failure."""
     try:
@@ -463,6 +494,7 @@ async def _ffprobe_duration(input_file: str) -> float | None:
         return None
 
 
+@tracing.traced("vainfo")
 async def _vaapi_available() -> bool:
     """Checks whether h264_vaapi can actually be used (vainfo + device)."""
     try:
@@ -484,6 +516,7 @@ def _pick_resolution(video_bitrate: int) -> str:
     return "scale=540:-2"
 
 
+@tracing.traced("ffprobe.video_codec")
 async def _video_codec(filepath: str) -> str | None:
     """Return the video codec name (e.g. 'h264', 'hevc') via ffprobe."""
     try:
@@ -504,6 +537,85 @@ async def _run_ffmpeg(args: list[str]) -> bool:
     return proc.returncode == 0
 
 
+def _compress_ladder(duration: float | None, target_mb: int, vaapi: bool) -> list[dict]:
+    """Encode attempts for ``compress_video``, gentlest first.
+
+    Each attempt has the video bitrate budget (``vbr``, what libx264 encodes
+    at), the VAAPI quality (``qp``) and the scale filter (``res``).
+    """
+    # video bitrate = (target_bytes * 8) / seconds - audio
+    video_bps = 1_200_000
+    if duration:
+        video_bps = int(target_mb * 1024 * 1024 * 8 / duration) - AUDIO_BITRATE
+        video_bps = max(250_000, video_bps)
+
+    # Intel iHD driver only supports CQP rate control, so VAAPI attempts
+    # step the quality (QP) instead of the bitrate; libx264 uses bitrate.
+    # Start close to the target so the FIRST attempt usually succeeds
+    # (otherwise the progress bar visibly resets on every retry).
+    if vaapi:
+        dur = duration or 240
+        if dur > 240:
+            qp_start, res_start = 40, "scale=540:-2"   # ~1.2 Mbps -> fits 48MB
+        elif dur > 120:
+            qp_start, res_start = 37, "scale=540:-2"   # ~2 Mbps
+        else:
+            qp_start, res_start = 34, "scale=720:-2"   # ~3.5 Mbps
+        return [
+            {"vbr": video_bps, "qp": qp_start, "res": res_start},
+            {"vbr": int(video_bps * 0.7), "qp": qp_start + 3, "res": "scale=540:-2"},
+            {"vbr": int(video_bps * 0.45), "qp": qp_start + 6, "res": "scale=480:-2"},
+            {"vbr": 300_000, "qp": 44, "res": "scale=360:-2"},
+        ]
+    return [
+        {"vbr": video_bps, "qp": 32, "res": _pick_resolution(video_bps)},
+        {"vbr": int(video_bps * 0.7), "qp": 36, "res": "scale=540:-2"},
+        {"vbr": int(video_bps * 0.45), "qp": 40, "res": "scale=480:-2"},
+        {"vbr": 300_000, "qp": 44, "res": "scale=360:-2"},
+    ]
+
+
+def _encode_commands(input_file: str, output_file: str, attempt: dict,
+                     vaapi: bool, codec: str | None = None) -> list[tuple[str, list[str]]]:
+    """ffmpeg commands for one attempt as ``(variant, args)``, in the order
+    they are tried; later variants are fallbacks for a failed run."""
+    vf = attempt["res"]
+    if not vaapi:
+        return [("libx264", [
+            'ffmpeg', '-y', '-i', input_file, '-vf', vf + ",format=yuv420p",
+            '-c:v', 'libx264', '-preset', 'fast',
+            '-b:v', str(attempt["vbr"]),
+            '-maxrate', str(int(attempt["vbr"] * 1.3)),
+            '-bufsize', str(int(attempt["vbr"] * 2)),
+            '-c:a', 'aac', '-b:a', '96k',
+            '-movflags', '+faststart', output_file])]
+
+    # Full-GPU (hwaccel + scale_vaapi) is ~30x faster but the VAAPI VPP
+    # pipeline can reject some inputs ('VAProfile is not supported');
+    # CPU-decode+GPU-encode always works.
+    variants = []
+    if codec == 'h264':
+        variants.append(("vaapi-full", [
+            'ffmpeg', '-y',
+            '-hwaccel', 'vaapi', '-hwaccel_output_format', 'vaapi',
+            '-init_hw_device', f'vaapi=va:{VAAPI_DEVICE}',
+            '-filter_hw_device', 'va',
+            '-i', input_file, '-vf', vf.replace('scale=', 'scale_vaapi='),
+            '-c:v', 'h264_vaapi', '-global_quality', str(attempt["qp"]),
+            '-c:a', 'aac', '-b:a', '96k',
+            '-movflags', '+faststart', output_file]))
+    variants.append(("vaapi-robust", [
+        'ffmpeg', '-y',
+        '-init_hw_device', f'vaapi=va:{VAAPI_DEVICE}',
+        '-filter_hw_device', 'va',
+        '-i', input_file, '-vf', f"{vf},format=nv12,hwupload",
+        '-c:v', 'h264_vaapi', '-global_quality', str(attempt["qp"]),
+        '-c:a', 'aac', '-b:a', '96k',
+        '-movflags', '+faststart', output_file]))
+    return variants
+
+
+@tracing.traced("compress")
 async def compress_video(input_file: str, target_mb: int = 48, progress_cb=None) -> str | None:
     """Compress a video so it always fits under Telegram's 50 MB upload limit.
 
@@ -515,7 +627,11 @@ async def compress_video(input_file: str, target_mb: int = 48, progress_cb=None)
       3. If the result is still too big, retry with a lower bitrate and a
          smaller resolution until it fits (max 4 attempts).
       4. When `progress_cb` is given, stream the encode progress (%).
+
+    ``python -m bench.compress_bench`` measures this ladder on synthetic clips.
+    Charged to the user's expensive-operation budget (``rate_limit``).
     """
+    await rate_limit.expensive("compress")
     try:
         base_name = os.path.splitext(input_file)[0]
         duration = await _ffprobe_duration(input_file)
@@ -525,139 +641,82 @@ async def compress_video(input_file: str, target_mb: int = 48, progress_cb=None)
 
         vaapi = await _vaapi_available()
         logger.info(f"compress: duration={duration}s vaapi={vaapi}")
+        attempts = _compress_ladder(duration, target_mb, vaapi)
+        codec = await _video_codec(input_file) if vaapi else None
 
-        # video bitrate = (target_bytes * 8) / seconds - audio
-        video_bps = 1_200_000
-        if duration:
-            video_bps = int(target_mb * 1024 * 1024 * 8 / duration) - AUDIO_BITRATE
-            video_bps = max(250_000, video_bps)
-
-        # Intel iHD driver only supports CQP rate control, so VAAPI attempts
-        # step the quality (QP) instead of the bitrate; libx264 uses bitrate.
-        # Start close to the target so the FIRST attempt usually succeeds
-        # (otherwise the progress bar visibly resets on every retry).
-        if vaapi:
-            dur = duration or 240
-            if dur > 240:
-                qp_start, res_start = 40, "scale=540:-2"   # ~1.2 Mbps -> fits 48MB
-            elif dur > 120:
-                qp_start, res_start = 37, "scale=540:-2"   # ~2 Mbps
-            else:
-                qp_start, res_start = 34, "scale=720:-2"   # ~3.5 Mbps
-            attempts = [
-                {"vbr": video_bps, "qp": qp_start, "res": res_start},
-                {"vbr": int(video_bps * 0.7), "qp": qp_start + 3, "res": "scale=540:-2"},
-                {"vbr": int(video_bps * 0.45), "qp": qp_start + 6, "res": "scale=480:-2"},
-                {"vbr": 300_000, "qp": 44, "res": "scale=360:-2"},
-            ]
-        else:
-            attempts = [
-                {"vbr": video_bps, "qp": 32, "res": _pick_resolution(video_bps)},
-                {"vbr": int(video_bps * 0.7), "qp": 36, "res": "scale=540:-2"},
-                {"vbr": int(video_bps * 0.45), "qp": 40, "res": "scale=480:-2"},
-                {"vbr": 300_000, "qp": 44, "res": "scale=360:-2"},
-            ]
-
+        encoder = "vaapi" if vaapi else "libx264"
         for i, attempt in enumerate(attempts):
-            output_file = f"{base_name}_compressed.mp4"
-            vf = attempt["res"]
-            # Build command variants. Full-GPU (hwaccel + scale_vaapi) is ~30x
-            # faster but the VAAPI VPP pipeline can reject some inputs
-            # ('VAProfile is not supported'); CPU-decode+GPU-encode always works.
-            cmd_variants = []
-            if vaapi:
-                codec = await _video_codec(input_file)
-                if codec == 'h264':
-                    vf_fast = vf.replace('scale=', 'scale_vaapi=')
-                    cmd_variants.append([
-                        'ffmpeg', '-y',
-                        '-hwaccel', 'vaapi', '-hwaccel_output_format', 'vaapi',
-                        '-init_hw_device', 'vaapi=va:/dev/dri/renderD128',
-                        '-filter_hw_device', 'va',
-                        '-i', input_file, '-vf', vf_fast,
-                        '-c:v', 'h264_vaapi', '-global_quality', str(attempt["qp"]),
-                        '-c:a', 'aac', '-b:a', '96k',
-                        '-movflags', '+faststart', output_file])
-                vf_robust = f"{vf},format=nv12,hwupload"
-                cmd_variants.append([
-                    'ffmpeg', '-y',
-                    '-init_hw_device', 'vaapi=va:/dev/dri/renderD128',
-                    '-filter_hw_device', 'va',
-                    '-i', input_file, '-vf', vf_robust,
-                    '-c:v', 'h264_vaapi', '-global_quality', str(attempt["qp"]),
-                    '-c:a', 'aac', '-b:a', '96k',
-                    '-movflags', '+faststart', output_file])
-            else:
-                vf = vf + ",format=yuv420p"
-                cmd_variants.append([
-                    'ffmpeg', '-y', '-i', input_file, '-vf', vf,
-                    '-c:v', 'libx264', '-preset', 'fast',
-                    '-b:v', str(attempt["vbr"]),
-                    '-maxrate', str(int(attempt["vbr"] * 1.3)),
-                    '-bufsize', str(int(attempt["vbr"] * 2)),
-                    '-c:a', 'aac', '-b:a', '96k',
-                    '-movflags', '+faststart', output_file])
-
-            ok_run = False
-            for args in cmd_variants:
-                if os.path.exists(output_file):
-                    os.remove(output_file)
-                # Stream encode progress through ffmpeg -progress pipe:1
-                args = list(args) + ['-progress', 'pipe:1']
-                total_us = int(duration * 1_000_000) if duration else None
-                proc = await asyncio.create_subprocess_exec(
-                    *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-                while True:
-                    line = await proc.stdout.readline()
-                    if not line:
+            with tracing.span("compress.attempt", attempt=i + 1, encoder=encoder,
+                              qp=attempt["qp"], res=attempt["res"]) as attempt_span:
+                output_file = f"{base_name}_compressed.mp4"
+                cmd_variants = _encode_commands(input_file, output_file, attempt, vaapi, codec)
+
+                ok_run = False
+                for variant, (_name, args) in enumerate(cmd_variants, 1):
+                    if os.path.exists(output_file):
+                        os.remove(output_file)
+                    # Stream encode progress through ffmpeg -progress pipe:1
+                    args = list(args) + ['-progress', 'pipe:1']
+                    total_us = int(duration * 1_000_000) if duration else None
+                    with tracing.span("ffmpeg", variant=variant, of=len(cmd_variants)) as ffmpeg_span:
+                        encode_start = time.monotonic()
+                        proc = await asyncio.create_subprocess_exec(
+                            *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+                        while True:
+                            line = await proc.stdout.readline()
+                            if not line:
+                                break
+                            if total_us and progress_cb and line.startswith(b'out_time_us='):
+                                try:
+                                    us = int(line.split(b'=', 1)[1].strip())
+                                    await progress_cb(min(99, int(us / total_us * 100)), i + 1)
+                                except Exception:
+                                    pass
+                        await proc.wait()
+                        ffmpeg_span["returncode"] = proc.returncode
+                    metrics.ENCODE_SECONDS.observe(time.monotonic() - encode_start, encoder=encoder)
+                    if proc.returncode == 0:
+                        ok_run = True
                         break
-                    if total_us and progress_cb and line.startswith(b'out_time_us='):
-                        try:
-                            us = int(line.split(b'=', 1)[1].strip())
-                            await progress_cb(min(99, int(us / total_us * 100)), i + 1)
-                        except Exception:
-                            pass
-                await proc.wait()
-                if proc.returncode == 0:
-                    ok_run = True
-                    break
-            if ok_run and os.path.exists(output_file) and os.path.getsize(output_file) > 0:
-                size = os.path.getsize(output_file)
-                if size <= MAX_TELEGRAM_BYTES or i == len(attempts) - 1:
-                    logger.info(f"Compressed (attempt {i + 1}, vaapi={vaapi}): "
-                                f"{os.path.getsize(input_file)} -> {size} bytes")
-                    return output_file
-                os.remove(output_file)
-            else:
-                logger.warning(f"compress: attempt {i + 1} failed")
+                    metrics.COMPRESS_ATTEMPTS.inc(encoder=encoder, outcome="failed")
+                if ok_run and os.path.exists(output_file) and os.path.getsize(output_file) > 0:
+                    size = os.path.getsize(output_file)
+                    attempt_span["bytes"] = size
+                    if size <= MAX_TELEGRAM_BYTES or i == len(attempts) - 1:
+                        metrics.COMPRESS_ATTEMPTS.inc(encoder=encoder, outcome="ok")
+                        metrics.COMPRESSION_RATIO.observe(size / max(1, os.path.getsize(input_file)))
+                        logger.info(f"Compressed (attempt {i + 1}, vaapi={vaapi}): "
+                                    f"{os.path.getsize(input_file)} -> {size} bytes")
+                        return output_file
+                    metrics.COMPRESS_ATTEMPTS.inc(encoder=encoder, outcome="too_big")
+                    os.remove(output_file)
+                else:
+                    logger.warning(f"compress: attempt {i + 1} failed")
         return None
     except Exception as e:
         logger.error(f"Compression error: {e}")
         return None
 
+@metrics.track("gallery_dl_info")
 async def extract_images_info(url: str):
     """Extract image information using gallery-dl"""
     try:
-        # Create a custom DataJob to extract info without downloading
-        class InfoExtractor(gdl_job.DataJob):
-            def __init__(self, url):
-                super().__init__(url)
-                self.results = []
-
-            def handle_url(self, url, kwdict):
-                self.results.append(kwdict)
-
-        job = InfoExtractor(url)
-        await asyncio.to_thread(job.run)
-
-        return job.results if job.results else None
+        results = await extractor_pool.gallery_dl_info(url)
+        return results if results else None
     except Exception as e:
         logger.error(f"gallery-dl info extraction error: {e}")
         return None
 
-async def fetch_html_via_lightpanda(url: str) -> str | None:
-    """Get full page HTML from Lightpanda browser via CDP WebSocket"""
+@metrics.track("lightpanda")
+async def fetch_html_via_lightpanda(url: str, expression: str = "document.documentElement.outerHTML") -> str | None:
+    """Get full page HTML from Lightpanda browser via CDP WebSocket.
+
+    ``expression`` is evaluated in the page once it has loaded; pass a script
+    returning a string (e.g. ``html_extract.FACEBOOK_DOM_JS``) to pull only
+    the needed nodes instead of the whole outerHTML.
+    """
     try:
+        await rate_limit.expensive("lightpanda")
         async with websockets.connect(LIGHTPANDA_URL, max_size=10_000_000) as ws:
             await ws.send(json.dumps({"id": 1, "method": "Target.createTarget", "params": {"url": "about:blank"}}))
             r = json.loads(await ws.recv())
@@ -688,7 +747,7 @@ async def fetch_html_via_lightpanda(url: str) -> str | None:
             await ws.send(json.dumps({
                 "id": 10, "sessionId": session_id,
                 "method": "Runtime.evaluate",
-                "params": {"expression": "document.documentElement.outerHTML", "returnByValue": True}
+                "params": {"expression": expression, "returnByValue": True}
             }))
 
             while True:
@@ -707,152 +766,70 @@ async def fetch_html_via_lightpanda(url: str) -> str | None:
         logger.error(f"Lightpanda connection error: {e}")
         return None
 
-async def scrape_facebook_images(url: str, temp_dir: str):
-    """Scrape images from Facebook using Lightpanda browser (via CDP over WebSocket)"""
+@metrics.track("facebook_find")
+async def find_facebook_images(url: str) -> tuple[list[str], str | None]:
+    """Find the image URLs of a Facebook post: plain HTTP first, Lightpanda
+    browser (via CDP over WebSocket) only when the server-rendered head has
+    no post image. Returns ``(image_urls, description)``."""
     try:
-        html = await fetch_html_via_lightpanda(url)
-        if not html:
-            return [], None
-
-        soup = BeautifulSoup(html, 'lxml')
-
-        # Find images and description
-        images = []
-        description = None
-
-        # Try to get full description from the page content
-        # Look for the post text container
-        post_text_selectors = [
-            'div[data-ad-preview="message"]',
-            'div[data-ad-comet-preview="message"]',
-            'div[dir="auto"]',
-            'div[role="article"] p',  # Article post text
-            'article p',
-            'div[aria-label="Story"] p',  # Story text
-        ]
-
-        # Also try to get text from span elements
-        text_selectors = [
-            'span[dir="auto"]',
-            'span[data-ad-preview="message"]',
-        ]
-
-        for selector in post_text_selectors:
-            text_divs = soup.select(selector)
-            for div in text_divs:
-                text = div.get_text(strip=True)
-                if text and len(text) > 50:  # Likely the main post text
-                    if not description or len(text) > len(description):
-                        description = text
-                        break
-            if description and len(description) > 100:
-                break
-
-        # Also try spans
-        if not description or len(description) < 50:
-            for selector in text_selectors:
-                text_spans = soup.select(selector)
-                for span in text_spans:
-                    text = span.get_text(strip=True)
-                    if text and len(text) > 50:
-                        if not description or len(text) > len(description):
-                            description = text
-                            break
-                if description and len(description) > 100:
-                    break
-
-        # Fallback to og:description if no better text found
-        if not description or len(description) < 50:
-            og_description = soup.find('meta', property='og:description')
-            if og_description and og_description.get('content'):
-                fallback_desc = og_description['content']
-                if not description or len(fallback_desc) > len(description):
-                    description = fallback_desc
+        # Tier 1: plain HTTP GET of the <head> (og:image is usually server-rendered)
+        description, img_urls = await http_meta.facebook_post(url)
+        if not img_urls:
+            # Tier 2: full browser render
+            if LIGHTPANDA_DOM_EXTRACT:
+                # Pull only the needed nodes out of the rendered page
+                raw = await fetch_html_via_lightpanda(url, expression=html_extract.FACEBOOK_DOM_JS)
+                if not raw:
+                    return [], None
+                description, img_urls = html_extract.extract_facebook_from_dom(json.loads(raw))
+            else:
+                html = await fetch_html_via_lightpanda(url)
+                if not html:
+                    return [], None
+                # Parse off the event loop (heavy pages take hundreds of ms)
+                description, img_urls = await asyncio.to_thread(html_extract.extract_facebook, html)
 
         if description:
             logger.info(f"Found description ({len(description)} chars): {description[:100]}...")
 
-        # Extract image URLs — prefer og:image (canonical main image)
-        og_images = []
-        og_meta = soup.find('meta', property='og:image')
-        if og_meta and og_meta.get('content'):
-            main_img = og_meta['content']
-            logger.info(f"Found og:image: {main_img[:80]}...")
-            og_images.append({'content': main_img})
-        else:
-            # Fallback: find all scontent img tags
-            img_tags = soup.find_all('img')
-            logger.info(f"No og:image, found {len(img_tags)} img tags")
-
-            seen_urls = set()
-            for img in img_tags:
-                src = img.get('src', '')
-                if not src or src in seen_urls:
-                    continue
-
-                if '/v/t' in src and 'scontent' in src:
-                    seen_urls.add(src)
-                    og_images.append({'content': src})
-
-        logger.info(f"Total images to download: {len(og_images)}")
-
-        if not og_images:
+        logger.info(f"Total images found: {len(img_urls)}")
+        if not img_urls:
             logger.info("No images found")
-            return [], description
+        return img_urls, description
 
-        # Download images
-        for idx, og_img in enumerate(og_images[:10]):
-            img_url = og_img.get('content') if isinstance(og_img, dict) else og_img.get('content')
-            if not img_url:
-                continue
-            img_url = img_url.replace('&amp;', '&')
-            img_result = await _download_image_curl(img_url, temp_dir, f"facebook_image_{idx}")
-            if img_result:
-                images.append(img_result)
+    except Exception as e:
+        logger.error(f"Facebook scraping error: {e}", exc_info=True)
+        return [], None
 
+@metrics.track("facebook_images")
+async def scrape_facebook_images(url: str, temp_dir: str, img_urls: list[str] | None = None,
+                                 description: str | None = None):
+    """Scrape images from Facebook (``img_urls``: already found) into ``temp_dir``."""
+    if img_urls is None:
+        img_urls, description = await find_facebook_images(url)
+    if not img_urls:
+        return [], description
+    try:
+        # Download images (in parallel, carousel order kept)
+        images = await image_fetcher.fetch_images(img_urls, temp_dir, "facebook_image", limit=10)
         return images, description
-
     except Exception as e:
-        logger.error(f"Facebook scraping error: {e}", exc_info=True)
+        logger.error(f"Facebook image download error: {e}", exc_info=True)
         return [], None
 
+@metrics.track("ultraigdl_images")
 async def scrape_instagram_images_ultraigdl(url: str, temp_dir: str):
     """Scrape images from Instagram using ultra-igdl (Node.js)."""
     try:
-        import aiohttp
-        proc = await asyncio.create_subprocess_exec(
-            'node', 'igdl_helper.js', url,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=30)
-        if proc.returncode != 0:
-            return [], None
-
-        result = json.loads(stdout.decode())
-        if result.get("code") != 200:
+        # Same cached result the reel path got, if it ran first
+        result = await igdl_pool.pool.fetch(url)
+        if not result:
             return [], None
 
         caption = result.get("caption", "") or ""
-        images = []
-        async with aiohttp.ClientSession() as session:
-            for idx, item in enumerate(result.get("media", [])):
-                if item.get("type") != "image":
-                    continue
-                img_url = item.get("url")
-                if not img_url:
-                    continue
-                img_path = os.path.join(temp_dir, f"ig_ultra_image_{idx}.jpg")
-                try:
-                    async with session.get(img_url, timeout=aiohttp.ClientTimeout(total=30)) as resp:
-                        if resp.status == 200:
-                            async with aiofiles.open(img_path, 'wb') as f:
-                                async for chunk in resp.content.iter_chunked(1024 * 1024):
-                                    await f.write(chunk)
-                            if os.path.getsize(img_path) > 5000:
-                                images.append(img_path)
-                except Exception as e:
-                    logger.warning(f"ultra-igdl image {idx} download failed: {e}")
+        img_urls = [item["url"] for item in result.get("media", [])
+                    if item.get("type") == "image" and item.get("url")]
+        images = await image_fetcher.fetch_images(img_urls, temp_dir, "ig_ultra_image")
 
         logger.info(f"ultra-igdl: {len(images)} images, caption={len(caption)} chars")
         return images, caption
@@ -861,6 +838,7 @@ async def scrape_instagram_images_ultraigdl(url: str, temp_dir: str):
         logger.error(f"scrape_instagram_images_ultraigdl error: {e}", exc_info=True)
         return [], None
 
+@metrics.track("lightpanda_instagram_images")
 async def scrape_instagram_images_via_lightpanda(url: str, temp_dir: str):
     """Scrape images from Instagram using Lightpanda (CDP over WebSocket).
     Navigates to the Instagram post, extracts the real post image URL from the
@@ -950,21 +928,11 @@ async def scrape_instagram_images_via_lightpanda(url: str, temp_dir: str):
 
             logger.info(f"Lightpanda selected IG image: {img_url[:100]}...")
 
-            import aiohttp
-            img_path = os.path.join(temp_dir, "ig_lightpanda_image.jpg")
-            async with aiohttp.ClientSession(headers={"User-Agent": "Mozilla/5.0"}) as session:
-                async with session.get(img_url, timeout=aiohttp.ClientTimeout(total=60)) as resp:
-                    if resp.status != 200:
-                        logger.error(f"Lightpanda image download HTTP {resp.status}")
-                        return [], None
-                    async with aiofiles.open(img_path, 'wb') as f:
-                        async for chunk in resp.content.iter_chunked(1024 * 1024):
-                            await f.write(chunk)
-
-            if os.path.getsize(img_path) > 5000:
-                logger.info(f"Lightpanda downloaded Instagram image: {img_path}")
-                return [img_path], target_img.get('alt') or None
-            return [], None
+        img_path = await image_fetcher.fetch_image(img_url, temp_dir, "ig_lightpanda_image")
+        if img_path:
+            logger.info(f"Lightpanda downloaded Instagram image: {img_path}")
+            return [img_path], target_img.get('alt') or None
+        return [], None
 
     except asyncio.TimeoutError:
         logger.error("Lightpanda timeout for Instagram")
@@ -976,11 +944,10 @@ async def scrape_instagram_images_via_lightpanda(url: str, temp_dir: str):
         logger.error(f"Lightpanda Instagram scraper error: {e}", exc_info=True)
         return [], None
 
+@metrics.track("instaloader_images")
 async def scrape_instagram_images(url: str, temp_dir: str):
     """Scrape images from Instagram using instaloader"""
     try:
-        import instaloader
-
         shortcode_match = re.search(r'/(?:p|reel|tv)/([A-Za-z0-9_-]+)', url)
         if not shortcode_match:
             logger.error(f"Could not extract shortcode from Instagram URL: {url}")
@@ -988,21 +955,8 @@ async def scrape_instagram_images(url: str, temp_dir: str):
         shortcode = shortcode_match.group(1)
         logger.info(f"Instagram shortcode: {shortcode}")
 
-        loader = instaloader.Instaloader(
-            download_videos=False,
-            download_video_thumbnails=False,
-            compress_json=False,
-            save_metadata=True,
-            max_connection_attempts=3,
-            dirname_pattern=temp_dir,
-        )
-
-        post = await asyncio.to_thread(
-            instaloader.Post.from_shortcode, loader.context, shortcode
-        )
-        description = post.caption or ""
-
-        await asyncio.to_thread(loader.download_post, post, temp_dir)
+        await rate_limit.expensive("instaloader")
+        description = await extractor_pool.instagram_post(shortcode, temp_dir)
 
         # Find downloaded files
         images = []
@@ -1030,88 +984,42 @@ async def scrape_instagram_images(url: str, temp_dir: str):
         logger.error(f"Instaloader error: {e}", exc_info=True)
         return [], None
 
-async def _download_image_curl(img_url: str, temp_dir: str, filename_base: str) -> str | None:
-    """Download a single image via curl"""
-    import subprocess
-    try:
-        img_filename = os.path.join(temp_dir, f"{filename_base}.jpg")
-        curl_cmd = [
-            'curl', '-L', '-o', img_filename,
-            '-A', 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36',
-            img_url
-        ]
-        result = await asyncio.to_thread(
-            subprocess.run, curl_cmd, capture_output=True, timeout=30
-        )
-        if result.returncode == 0 and os.path.exists(img_filename) and os.path.getsize(img_filename) > 5000:
-            logger.info(f"Downloaded {filename_base}: {img_filename}")
-            return img_filename
-        if os.path.exists(img_filename):
-            os.remove(img_filename)
-        return None
-    except Exception as e:
-        logger.error(f"Failed to download {filename_base}: {e}")
-        return None
-
+@metrics.track("reddit_images")
 async def scrape_reddit_images(url: str, temp_dir: str):
-    """Scrape images from Reddit using Lightpanda browser"""
+    """Scrape images from Reddit: .json endpoint, then plain HTTP, then Lightpanda browser"""
     try:
-        html = await fetch_html_via_lightpanda(url)
-        if not html:
-            return [], None
-
-        soup = BeautifulSoup(html, 'lxml')
+        # Tier 1: Reddit's own .json endpoint (also tells videos apart)
+        post = await http_meta.reddit_post_json(url)
+        if post:
+            description, img_urls, is_video = post
+            if is_video:
+                logger.info("Reddit JSON: video post, skipping image scraping")
+                return [], description
+        else:
+            # Tier 2: plain HTTP GET of the <head>
+            description, img_urls = await http_meta.reddit_post_head(url)
 
-        images = []
-        description = None
-
-        for meta_attrs in [{'property': 'og:description'}, {'name': 'description'}]:
-            meta = soup.find('meta', attrs=meta_attrs)
-            if meta and meta.get('content'):
-                description = meta['content']
-                break
-
-        for meta_attrs in [{'property': 'og:image'}, {'name': 'twitter:image'}]:
-            meta = soup.find('meta', attrs=meta_attrs)
-            if meta and meta.get('content'):
-                main_img = meta['content']
-                logger.info(f"Found Reddit {meta_attrs}: {main_img[:80]}...")
-                img_result = await _download_image_curl(main_img, temp_dir, "reddit_image_0")
-                if img_result:
-                    images.append(img_result)
-                return images, description
-
-        img_tags = soup.find_all('img')
-        logger.info(f"No og:image, scanning {len(img_tags)} img tags for Reddit...")
-        seen = set()
-        for img in img_tags:
-            src = img.get('src', '')
-            if not src or src in seen:
-                continue
-            if any(x in src for x in ['preview.redd.it', 'i.redd.it', 'external-preview.redd.it']):
-                seen.add(src)
-                title = img.get('alt', '')
-                if title and not description:
-                    description = title
-                img_result = await _download_image_curl(src, temp_dir, f"reddit_image_{len(images)}")
-                if img_result:
-                    images.append(img_result)
+        if not img_urls and not post:
+            # Tier 3: full browser render
+            html = await fetch_html_via_lightpanda(url)
+            if not html:
+                return [], None
+            # og:image in <head> short-circuits the full parse
+            description, img_urls = await asyncio.to_thread(html_extract.extract_reddit, html)
+        logger.info(f"Reddit: {len(img_urls)} image URL(s) found")
 
+        images = await image_fetcher.fetch_images(img_urls, temp_dir, "reddit_image")
         return images, description
     except Exception as e:
         logger.error(f"Reddit scraping error: {e}", exc_info=True)
         return [], None
 
+@metrics.track("gallery_dl_images")
 async def download_images(url: str, temp_dir: str):
     """Download images using gallery-dl to a temporary directory"""
     try:
-        # Configure gallery-dl
-        gdl_config.set(("extractor",), "base-directory", temp_dir)
-        gdl_config.set(("extractor",), "directory", ["."])
-
-        # Create download job
-        job = gdl_job.DownloadJob(url)
-        await asyncio.to_thread(job.run)
+        # Isolated job: its own output dir, no global config changes
+        await extractor_pool.gallery_dl_download(url, temp_dir)
 
         # Get all downloaded files
         files = []
@@ -1153,6 +1061,63 @@ async def cmd_xd(message: types.Message):
     await message.answer(sentence)
     logger.info(f"/xd response sent to chat_id={message.chat.id}")
 
+def _is_admin(message: types.Message) -> bool:
+    return bool(message.from_user) and message.from_user.id in ADMIN_IDS
+
+@dp.message(Command("trace"))
+async def cmd_trace(message: types.Message):
+    """Admin: slowest stages of a job trace (without id: the latest jobs)."""
+    if not _is_admin(message):
+        return
+
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        lines = ["🔎 Últimos trabajos (/trace <id>):"]
+        for done in tracing.recent(10):
+            url = done["attrs"].get("url", "")
+            lines.append(f"{done['trace_id'][:8]}  {done['duration_ms'] / 1000:.1f}s  {done['name']}"
+                         f"{' ❌' if done['error'] else ''}  {url[:60]}")
+        await message.answer("\n".join(lines) if len(lines) > 1 else "🔎 Todavía no hay trabajos registrados.")
+        return
+
+    done = await tracing.find(args[1].strip())
+    if not done:
+        await message.answer("🔎 No encontré ese trace.")
+        return
+
+    lines = [f"🔎 {done['trace_id'][:8]} {done['name']} — {done['duration_ms'] / 1000:.1f}s"
+             f"{' ❌ ' + done['error'] if done['error'] else ''}"]
+    if done["attrs"].get("url"):
+        lines.append(done["attrs"]["url"])
+    lines.append("")
+    for sp in tracing.slowest(done, 12):
+        attrs = " ".join(f"{k}={v}" for k, v in sp["attrs"].items())
+        lines.append(f"{sp['duration_ms'] / 1000:7.2f}s  {sp['name']}{' ❌' if sp['error'] else ''}  {attrs}"[:200])
+    await message.answer("\n".join(lines)[:4000])
+
+@dp.message(Command("profile"))
+async def cmd_profile(message: types.Message):
+    """Admin: sample the running bot for N seconds and send the profile."""
+    if not _is_admin(message):
+        return
+    if profiling.is_running():
+        await message.answer("⏱ Ya hay un perfil en curso.")
+        return
+
+    args = message.text.split(maxsplit=1)
+    seconds = int(args[1]) if len(args) > 1 and args[1].strip().isdigit() else 30
+    seconds = min(seconds, profiling.PROFILE_MAX_SECONDS)
+    status = await message.answer(f"⏱ Perfilando {seconds} s...")
+    result = await profiling.profile(seconds)
+
+    lines = [f"⏱ {result.samples} muestras. Más tiempo propio:"]
+    for frame, count in result.top:
+        lines.append(f"{count * 100 / max(result.samples, 1):5.1f}%  {frame}"[:200])
+    await status.edit_text("\n".join(lines)[:4000])
+    await message.answer_document(FSInputFile(result.collapsed_path))
+    await message.answer_document(FSInputFile(result.speedscope_path),
+                                  caption="Abrir en https://www.speedscope.app")
+
 @dp.message()
 async def handle_url(message: types.Message):
     # Learn from messages for Markov model (non-blocking)
@@ -1167,15 +1132,194 @@ async def handle_url(message: types.Message):
 
     logger.info(f"handle_url received: {message.text[:60]}...")
     text = message.text.strip()
-    url_pattern = r'https?://[^\s]+'
-    urls = re.findall(url_pattern, text)
+    urls = url_classifier.extract_urls(text)
 
     if not urls:
         return
 
-    url = urls[0]
+    # Canonical form: short/share links resolved once, tracking params stripped.
+    # Links pointing at the same media (same key) are only processed once.
+    canon_start = time.time_ns()
+    canons = await asyncio.gather(*(url_canonical.canonicalize(u) for u in urls[:MAX_URLS_PER_MESSAGE * 2]))
+    canon_end = time.time_ns()
+    unique, seen_keys = [], set()
+    for canon in canons:
+        if canon.key not in seen_keys:
+            seen_keys.add(canon.key)
+            unique.append(canon)
+    unique = unique[:MAX_URLS_PER_MESSAGE]
+    for canon in unique:
+        metrics.LINKS.inc(platform=canon.route.platform)
+
+    if len(unique) == 1:
+        canon = unique[0]
+        logger.info(f"Canonical URL: {canon.url} (key={canon.key})")
+        async with _job_slot(canon.route.platform, url=canon.url, chat=message.chat.id):
+            tracing.record("canonicalize", canon_start, canon_end)
+            await _run_url_job(message, canon)
+        return
+
+    # Several links: one aggregated status message, concurrent jobs,
+    # results delivered in the original order
+    logger.info(f"Batch of {len(unique)} links: {[c.key for c in unique]}")
+    labels = [f"{PLATFORM_EMOJI.get(c.route.platform, '⏳')} {c.route.platform}" for c in unique]
+    batch_msg = await message.answer(f"📦 {len(unique)} links ⏳")
+    batch = batch_jobs.BatchStatus(batch_msg, labels)
+
+    async def _job(item):
+        canon = unique[item.index]
+        async with _job_slot(canon.route.platform, url=canon.url, chat=message.chat.id):
+            tracing.record("canonicalize", canon_start, canon_end)
+            await _run_url_job(message, canon, status_msg=item)
+
+    await batch.run(_job)
+    asyncio.create_task(delete_message_after_delay(batch_msg, 15))
 
-    if is_youtube(url):
+
+@asynccontextmanager
+async def _job_slot(platform: str, **trace_attrs):
+    """Hold one of the ``MAX_CONCURRENT_JOBS`` slots while the job runs.
+
+    The job is traced from here (queue wait included); queue depth, running
+    jobs and job time go to ``metrics``. The slot is given up while the job
+    waits for expensive-step budget (``rate_limit.bind_slot``). A front-end
+    takes no slot: the workers running the jobs apply the limit.
+    """
+    webhook.detach()
+    async with tracing.trace("link", platform=platform, **trace_attrs):
+        if BOT_ROLE == "frontend":
+            yield
+            return
+        metrics.JOBS_QUEUED.inc()
+        try:
+            with tracing.span("queue"):
+                await job_semaphore.acquire()
+        finally:
+            metrics.JOBS_QUEUED.dec()
+        metrics.JOBS_RUNNING.inc(platform=platform)
+        held = True
+
+        @asynccontextmanager
+        async def released():
+            # Waiting for expensive-step budget: let another job use the slot
+            nonlocal held
+            held = False
+            metrics.JOBS_RUNNING.dec(platform=platform)
+            job_semaphore.release()
+            try:
+                yield
+            finally:
+                metrics.JOBS_QUEUED.inc()
+                try:
+                    await job_semaphore.acquire()
+                finally:
+                    metrics.JOBS_QUEUED.dec()
+                held = True
+                metrics.JOBS_RUNNING.inc(platform=platform)
+
+        token = rate_limit.bind_slot(released)
+        try:
+            with metrics.JOB_SECONDS.time(platform=platform):
+                yield
+        finally:
+            rate_limit.unbind_slot(token)
+            if held:
+                metrics.JOBS_RUNNING.dec(platform=platform)
+                job_semaphore.release()
+
+
+async def _run_url_job(message: types.Message, canon: url_canonical.CanonicalURL, status_msg=None):
+    """Run the pipeline for one canonical link, here or on a worker."""
+    if BOT_ROLE == "frontend":
+        await _queue_job("url", message, status_msg, url=canon.url, route=canon.route._asdict())
+        return
+    await _run_in_workspace(canon.route.platform, message,
+                            lambda: process_url(message, canon.url, canon.route, status_msg=status_msg),
+                            status_msg=status_msg)
+
+
+async def _queue_job(kind: str, message: types.Message, status_msg=None, **args):
+    """Hand a job to the workers and wait until it is done (``BOT_ROLE=frontend``).
+
+    Workers answer the user themselves; for batch items their progress is
+    written into the item's line here. A failed batch item raises so the
+    batch shows it; a job no worker claimed in time is reported as such.
+    """
+    webhook.detach()
+    payload = {"message": message.model_dump(mode="json", exclude_none=True, by_alias=True),
+               "user": rate_limit.current_user(), **args}
+    batch_id = index = on_progress = None
+    if batch_jobs.is_batch_item(status_msg):
+        batch_id, index, on_progress = status_msg.batch.id, status_msg.index, status_msg.edit_text
+    with tracing.span("worker", kind=kind) as attrs:
+        job_id = await job_queue.submit(kind, payload, batch_id, index)
+        attrs["job"] = job_id
+        job = await job_queue.wait(job_id, on_progress)
+    if job.state == "failed":
+        unclaimed = job.error == job_queue.NOT_CLAIMED
+        if status_msg is not None:
+            raise RuntimeError("sin workers disponibles" if unclaimed else job.error or "worker failed")
+        error_msg = await message.answer("❌ No hay workers disponibles ahora, probá de nuevo en un rato."
+                                         if unclaimed else "❌ Error procesando el link, probá de nuevo.")
+        asyncio.create_task(delete_message_after_delay(error_msg, 15))
+
+
+async def _run_job(job: job_queue.Job):
+    """Worker side of ``_queue_job``: rebuild the message and run the job."""
+    message = types.Message.model_validate(job.payload["message"], context={"bot": bot})
+    # Expensive steps count against the user who sent the link or pressed the button
+    rate_limit.bind_user(job.payload.get("user"))
+    status_msg = None
+    if job.batch:
+        # Line of the front-end's batch message
+        status_msg = batch_jobs.RemoteItemStatus(lambda text: job_queue.report(job.id, text),
+                                                 lambda: job_queue.wait_turn(job))
+    with batch_jobs.bind(status_msg):
+        if job.kind == "url":
+            url, route = job.payload["url"], url_classifier.Route(**job.payload["route"])
+            async with _job_slot(route.platform, url=url, chat=message.chat.id):
+                await _run_in_workspace(route.platform, message,
+                                        lambda: process_url(message, url, route, status_msg=status_msg),
+                                        status_msg=status_msg)
+        elif job.kind == "download":
+            await _run_in_workspace("youtube", message,
+                                    lambda: download_and_send(message, job.payload["url"], job.payload["format_type"]))
+        elif job.kind == "convert_mp3":
+            await _run_in_workspace("mp3", message, lambda: _convert_to_audio(message, job.payload["data"]))
+        else:
+            raise ValueError(f"Unknown job kind: {job.kind}")
+
+
+async def _run_in_workspace(label: str, message: types.Message, job, status_msg=None):
+    """Run ``job()`` in its own download directory (see ``workspace``).
+
+    When the disk budget stays exhausted the job is not started and the
+    user is told to retry later.
+    """
+    webhook.detach()
+    try:
+        # Joins the trace of a link job; callback jobs start their own here
+        async with tracing.trace(label, chat=message.chat.id), workspace.job(label):
+            return await job()
+    except workspace.DiskFull:
+        text = "💾 Sin espacio en disco ahora mismo, probá de nuevo en unos minutos."
+        if status_msg is not None:
+            await status_msg.edit_text(text)
+        else:
+            error_msg = await message.answer(text)
+            asyncio.create_task(delete_message_after_delay(error_msg, 15))
+
+
+async def process_url(message: types.Message, url: str, route: url_classifier.Route, status_msg=None):
+    """Route a single canonical URL to its download pipeline.
+
+    ``status_msg`` is given for batch items (a line of the shared batch
+    message); otherwise each pipeline creates its own status message.
+    """
+    platform, kind = route.platform, route.kind
+    batch_item = batch_jobs.is_batch_item(status_msg)
+
+    if platform == url_classifier.YOUTUBE:
         import hashlib
         url_hash = hashlib.md5(url.encode()).hexdigest()[:8]
         pending_downloads[url_hash] = url
@@ -1186,36 +1330,44 @@ async def handle_url(message: types.Message):
                 InlineKeyboardButton(text="🎬 MP4 (Video)", callback_data=f"mp4:{url_hash}")
             ]
         ])
-        await message.answer(
-            "**YouTube detected!**\n\nChoose format:",
-            reply_markup=keyboard
-        )
-    elif is_facebook_video(url):
+        async with batch_jobs.result_slot():
+            await message.answer(
+                "**YouTube detected!**\n\nChoose format:",
+                reply_markup=keyboard
+            )
+        if batch_item:
+            await status_msg.edit_text("🎬 Elegí formato")
+    elif platform == url_classifier.FACEBOOK and kind == url_classifier.VIDEO:
         # Facebook videos (reels, watch, video posts) - download as video
         logger.info(f"Facebook video detected: {url}")
-        status_msg = await message.answer("📹 Facebook video detectado ⏳")
+        status_msg = status_msg or await message.answer("📹 Facebook video detectado ⏳")
         await download_and_send(message, url, 'video', status_msg=status_msg, platform_emoji="📹")
-    elif is_tiktok(url):
+    elif platform == url_classifier.TIKTOK:
         # TikTok videos
         logger.info(f"TikTok detected: {url}")
-        status_msg = await message.answer("🎵 TikTok detectado ⏳")
+        status_msg = status_msg or await message.answer("🎵 TikTok detectado ⏳")
         await download_and_send(message, url, 'video', status_msg=status_msg, platform_emoji="🎵")
-    elif is_reddit(url):
+    elif platform == url_classifier.REDDIT:
         # Reddit images and videos — try images first, fallback to video
         logger.info(f"Reddit detected (images/video): {url}")
-        await message.answer("🤖 Reddit detectado! Descargando...")
-        await download_and_send_images(message, url)
-    elif is_twitter(url):
+        if not batch_item:
+            await message.answer("🤖 Reddit detectado! Descargando...")
+        await download_and_send_images(message, url, status_msg=status_msg)
+    elif platform == url_classifier.TWITTER:
         # Twitter/X videos and images
         logger.info(f"Twitter/X detected: {url}")
-        status_msg = await message.answer("🐦 Twitter/X detectado ⏳")
+        status_msg = status_msg or await message.answer("🐦 Twitter/X detectado ⏳")
         await download_and_send(message, url, 'video', status_msg=status_msg, platform_emoji="🐦")
-    elif is_instagram_reel(url) or is_instagram_story(url):
+    elif platform == url_classifier.INSTAGRAM and kind in (url_classifier.VIDEO, url_classifier.STORY):
         # Instagram reels/stories — try video first via ultra-igdl, then yt-dlp/cobalt
         # If video fails, try image extraction as last resort (photo-reels)
         logger.info(f"Instagram video detected (reel/story): {url}")
-        status_msg = await message.answer("⏳ Downloading Instagram video...")
-        ig_file, ig_caption = await download_instagram_via_ultraigdl(url)
+        if batch_item:
+            await status_msg.edit_text("⏳ Downloading Instagram video...")
+        else:
+            status_msg = await message.answer("⏳ Downloading Instagram video...")
+        ig_file, ig_caption = await download_instagram_via_ultraigdl(
+            url, progress_cb=lambda pct: update_status(status_msg, "⬇️", "Descargando", pct))
         if ig_file:
             await status_msg.edit_text("📤 Sending...")
             await _send_video_file(message, ig_file, status_msg, original_url=url, caption=ig_caption)
@@ -1223,43 +1375,73 @@ async def handle_url(message: types.Message):
         # Schedule the retry message for auto-deletion
         retry_msg = await status_msg.edit_text("⏳ ultra-igdl failed, trying video fallback...")
         asyncio.create_task(delete_message_after_delay(retry_msg, 10))
-        video_ok = await download_and_send(message, url, 'video')
+        video_ok = await download_and_send(message, url, 'video', status_msg=_reuse_status(status_msg))
         if not video_ok:
             logger.info("Video download failed, trying image extraction as last resort...")
-            await download_and_send_images(message, url)
-    elif is_image_platform(url):
+            await download_and_send_images(message, url, status_msg=_reuse_status(status_msg))
+    elif kind == url_classifier.POST:
         # For Instagram posts and Facebook posts, try images first
         # If it fails or has no images, it will fall back to video
-        await download_and_send_images(message, url)
+        await download_and_send_images(message, url, status_msg=status_msg)
     else:
         # Generic video download for other platforms (1000+ sites)
         logger.info(f"Generic video download: {url}")
-        status_msg = await message.answer("⏳ Descargando...")
+        status_msg = status_msg or await message.answer("⏳ Descargando...")
         await download_and_send(message, url, 'video', status_msg=status_msg)
 
-async def download_and_send_images(message: types.Message, url: str):
+
+def _reuse_status(status_msg):
+    """Status to hand to a fallback pipeline: batch lines are kept, real
+    status messages are not (they are already scheduled for deletion)."""
+    return status_msg if batch_jobs.is_batch_item(status_msg) else None
+
+
+def _delete_original_keyboard(message: types.Message) -> InlineKeyboardMarkup:
+    """Keyboard with a button that deletes the user's original message."""
+    import hashlib
+    delete_hash = hashlib.md5(f"{message.chat.id}:{message.message_id}".encode()).hexdigest()[:8]
+    original_messages[delete_hash] = {
+        'chat_id': message.chat.id,
+        'message_id': message.message_id
+    }
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🗑️ Delete original message", callback_data=f"del_orig:{delete_hash}")]
+    ])
+
+async def download_and_send_images(message: types.Message, url: str, status_msg=None):
     """Download and send images from Instagram/Facebook posts"""
-    status_msg = await message.answer("⏳ Downloading images...")
+    if status_msg is None:
+        status_msg = await message.answer("⏳ Downloading images...")
+    else:
+        await status_msg.edit_text("⏳ Downloading images...")
 
     temp_dir = None
     try:
         # Create temporary directory
-        temp_dir = tempfile.mkdtemp(prefix="images_", dir="downloads")
+        temp_dir = tempfile.mkdtemp(prefix="images_", dir=workspace.current_dir())
 
         description = ""
         image_files = []
+        platform = classify(url).platform
+        is_fb_share_post = platform == url_classifier.FACEBOOK and '/share/p/' in url
 
         # For Facebook /share/p/ URLs (images), use Lightpanda directly
-        if 'facebook.com' in url and '/share/p/' in url:
+        if is_fb_share_post:
             logger.info("Facebook image detected, using Lightpanda...")
             await status_msg.edit_text("⏳ Scraping with Lightpanda...")
-            image_files, description = await scrape_facebook_images(url, temp_dir)
+            img_urls, description = await find_facebook_images(url)
+            # fbcdn links are public: let Telegram fetch them when they fit
+            if await delivery.send_photo_urls(message, img_urls, description, _delete_original_keyboard(message)):
+                await status_msg.delete()
+                return
+            image_files, description = await scrape_facebook_images(url, temp_dir, img_urls, description)
 
         # Other Facebook URLs (videos or legacy URLs)
-        elif 'facebook.com' in url:
+        elif platform == url_classifier.FACEBOOK:
             logger.info("Trying cobalt for Facebook...")
             await status_msg.edit_text("⏳ Downloading via cobalt...")
-            cobalt_file = await download_via_cobalt(url, temp_dir)
+            cobalt_file = await download_via_cobalt(
+                url, temp_dir, progress_cb=lambda pct: update_status(status_msg, "⬇️", "Descargando (cobalt)", pct))
 
             # Check if cobalt returned an image or video
             if cobalt_file and cobalt_file.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
@@ -1269,7 +1451,8 @@ async def download_and_send_images(message: types.Message, url: str):
                 # It's a video, download normally
                 await status_msg.edit_text("📹 Found video, downloading...")
                 await cleanup_directory(temp_dir)
-                await download_and_send(message, url, 'video', original_msg_id=message.message_id)
+                await download_and_send(message, url, 'video', original_msg_id=message.message_id,
+                                        status_msg=_reuse_status(status_msg))
                 return
             else:
                 # Try facebook-scraper library (uses m.facebook.com)
@@ -1283,20 +1466,8 @@ async def download_and_send_images(message: types.Message, url: str):
                         if hasattr(post, 'text') and post.text:
                             fb_description = post.text
                     if images_list:
-                        # Download images from URLs
-                        import aiohttp
-                        async with aiohttp.ClientSession() as session:
-                            for idx, img_url in enumerate(images_list[:10]):  # Max 10
-                                try:
-                                    img_path = os.path.join(temp_dir, f"fb_image_{idx}.jpg")
-                                    async with session.get(img_url, timeout=aiohttp.ClientTimeout(total=15)) as resp:
-                                        if resp.status == 200:
-                                            content = await resp.read()
-                                            async with aiofiles.open(img_path, 'wb') as f:
-                                                await f.write(content)
-                                            image_files.append(img_path)
-                                except Exception as e:
-                                    logger.warning(f"Failed to download image {idx}: {e}")
+                        # Download images from URLs (max 10, in parallel)
+                        image_files = await image_fetcher.fetch_images(images_list, temp_dir, "fb_image", limit=10)
                         description = fb_description
                 except Exception as e:
                     logger.error(f"facebook-scraper failed: {e}")
@@ -1307,13 +1478,13 @@ async def download_and_send_images(message: types.Message, url: str):
                     image_files, description = await scrape_facebook_images(url, temp_dir)
 
         # For Reddit, try Lightpanda first (og:image), fallback to video
-        elif 'reddit.com' in url or 'redd.it' in url:
+        elif platform == url_classifier.REDDIT:
             logger.info("Trying Lightpanda for Reddit...")
             await status_msg.edit_text("⏳ Scraping with Lightpanda...")
             image_files, description = await scrape_reddit_images(url, temp_dir)
 
         # For Instagram, try ultra-igdl first, then Lightpanda, then instaloader
-        elif 'instagram.com' in url:
+        elif platform == url_classifier.INSTAGRAM:
             logger.info("Trying ultra-igdl for Instagram...")
             await status_msg.edit_text("⏳ Downloading via ultra-igdl...")
             image_files, description = await scrape_instagram_images_ultraigdl(url, temp_dir)
@@ -1330,7 +1501,7 @@ async def download_and_send_images(message: types.Message, url: str):
                 await status_msg.edit_text("⏳ Downloading via gallery-dl...")
                 image_files = await download_images(url, temp_dir)
 
-        if 'facebook.com' in url and '/share/p/' in url and not image_files:
+        if is_fb_share_post and not image_files:
             # Facebook image posts should NOT fall back to video
             await status_msg.edit_text("❌ No se pudieron obtener las imágenes. La publicación podría requerir login o estar privada.")
             await cleanup_directory(temp_dir)
@@ -1343,13 +1514,14 @@ async def download_and_send_images(message: types.Message, url: str):
             # Auto-delete info message after 5 seconds
             asyncio.create_task(delete_message_after_delay(info_msg, 5))
             await cleanup_directory(temp_dir)
-            await download_and_send(message, url, 'video', original_msg_id=message.message_id)
+            await download_and_send(message, url, 'video', original_msg_id=message.message_id,
+                                    status_msg=_reuse_status(status_msg))
             return
 
         await status_msg.edit_text(f"📤 Sending {len(image_files)} image(s)...")
 
         # Filter only image files
-        valid_images = [f for f in image_files if f.lower().endswith(('.jpg', '.jpeg', '.png', '.webp'))]
+        valid_images = [f for f in image_files if f.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.gif'))]
 
         if not valid_images:
             # No valid images - might be a video post, try yt-dlp
@@ -1358,57 +1530,17 @@ async def download_and_send_images(message: types.Message, url: str):
             # Auto-delete info message after 5 seconds
             asyncio.create_task(delete_message_after_delay(info_msg, 5))
             await cleanup_directory(temp_dir)
-            await download_and_send(message, url, 'video', original_msg_id=message.message_id)
+            await download_and_send(message, url, 'video', original_msg_id=message.message_id,
+                                    status_msg=_reuse_status(status_msg))
             return
 
-        # Create delete button for original message
-        import hashlib
-        delete_hash = hashlib.md5(f"{message.chat.id}:{message.message_id}".encode()).hexdigest()[:8]
-        original_messages[delete_hash] = {
-            'chat_id': message.chat.id,
-            'message_id': message.message_id
-        }
-        delete_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🗑️ Delete original message", callback_data=f"del_orig:{delete_hash}")]
-        ])
-
-        # Send images
-        if len(valid_images) == 1:
-            # Single image
-            async with aiofiles.open(valid_images[0], 'rb') as f:
-                image_data = await f.read()
-                photo_input = BufferedInputFile(image_data, filename="image.jpg")
-                await message.answer_photo(
-                    photo_input,
-                    caption=description[:1024] if description else None,
-                    reply_markup=delete_keyboard
-                )
-        else:
-            # Multiple images - use media group (max 10 images per Telegram limitation)
-            media_group = []
-            for idx, img_path in enumerate(valid_images[:10]):  # Telegram max 10 media per group
-                async with aiofiles.open(img_path, 'rb') as f:
-                    image_data = await f.read()
-                    photo_input = BufferedInputFile(image_data, filename=f"image_{idx}.jpg")
-
-                    # Add caption only to first image
-                    if idx == 0 and description:
-                        media_group.append(InputMediaPhoto(media=photo_input, caption=description[:1024]))
-                    else:
-                        media_group.append(InputMediaPhoto(media=photo_input))
-
-            await message.answer_media_group(media_group)
-
-            # If more than 10 images, send the rest
-            if len(valid_images) > 10:
-                for idx, img_path in enumerate(valid_images[10:], start=10):
-                    async with aiofiles.open(img_path, 'rb') as f:
-                        image_data = await f.read()
-                        photo_input = BufferedInputFile(image_data, filename=f"image_{idx}.jpg")
-                        await message.answer_photo(photo_input)
-
-            # Send delete button as separate message for media groups
-            await message.answer("✅ Images downloaded", reply_markup=delete_keyboard)
+        # Send images (in message order when part of a multi-link batch)
+        await delivery.send_photos(
+            message,
+            [FSInputFile(path, filename=f"image_{idx}.jpg") for idx, path in enumerate(valid_images)],
+            description,
+            _delete_original_keyboard(message)
+        )
 
         await status_msg.delete()
 
@@ -1439,7 +1571,7 @@ async def _send_video_file(message: types.Message, filepath: str, status_msg: ty
             [InlineKeyboardButton(text="🗑️ Delete original message", callback_data=f"del_orig:{delete_hash}")]
         ])
 
-        if filesize > 50 * 1024 * 1024:
+        if filesize > UPLOAD_LIMIT:
             await update_status(status_msg, "🗜️", "Comprimiendo", 0)
             compressed = await compress_video(
                 filepath,
@@ -1451,10 +1583,7 @@ async def _send_video_file(message: types.Message, filepath: str, status_msg: ty
                 filepath = compressed
                 filesize = os.path.getsize(filepath)
 
-        async with aiofiles.open(filepath, 'rb') as f:
-            file_data = await f.read()
-
-        video_input = BufferedInputFile(file_data, filename=f"{title[:50]}.mp4")
+        video_input = FSInputFile(filepath, filename=f"{title[:50]}.mp4")
 
         if original_url:
             video_hash = hashlib.md5(f"{message.chat.id}:{filepath}".encode()).hexdigest()[:8]
@@ -1466,10 +1595,14 @@ async def _send_video_file(message: types.Message, filepath: str, status_msg: ty
 
         final_caption = caption[:1024] if caption else None
 
-        if filesize > 50 * 1024 * 1024:
-            await message.answer_document(video_input, caption=final_caption, reply_markup=keyboard)
-        else:
-            await message.answer_video(video_input, caption=final_caption, supports_streaming=True, reply_markup=keyboard)
+        async with batch_jobs.result_slot():
+            if filesize > 50 * 1024 * 1024:
+                await message.answer_document(video_input, caption=final_caption, reply_markup=keyboard)
+            else:
+                await message.answer_video(video_input, caption=final_caption, supports_streaming=True, reply_markup=keyboard)
+        if original_url:
+            # Keep the sent file around for "Convert to MP3"
+            await audio_derive.remember_video(video_hash, filepath)
 
         # Single status message: show a brief confirmation, then self-delete
         await update_status(status_msg, "✅", "Enviado")
@@ -1481,6 +1614,7 @@ async def _send_video_file(message: types.Message, filepath: str, status_msg: ty
     finally:
         await cleanup_file(filepath)
 
+@tracing.traced("ffprobe.has_audio")
 async def _file_has_audio(filepath: str) -> bool:
     """True if the file has an audio stream (ffprobe)."""
     try:
@@ -1494,25 +1628,32 @@ async def _file_has_audio(filepath: str) -> bool:
         return True  # if we can't probe, assume it has audio
 
 
-async def _best_h264_format_id(url: str) -> str | None:
-    """Extract format list and return the best h264 format_id that has a real
-    audio track (TikTok's h264 variants carry audio; bytevc1 -1 is video-only)."""
-    try:
-        opts = {'quiet': True, 'no_warnings': True, 'socket_timeout': 30}
-        with yt_dlp.YoutubeDL(opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-        formats = info.get('formats') or []
+def _h264_with_audio(formats: list[dict]) -> dict | None:
+    candidates = [f for f in formats
+                  if f.get('vcodec') == 'h264' and f.get('acodec') not in (None, 'none')]
+    if not candidates:
         candidates = [f for f in formats
-                      if f.get('vcodec') == 'h264' and f.get('acodec') not in (None, 'none')]
-        if not candidates:
-            candidates = [f for f in formats
-                          if (f.get('vcodec') or '').startswith('h264')
-                          and f.get('acodec') not in (None, 'none')]
-        if not candidates:
-            return None
-        # pick the highest resolution candidate
-        best = max(candidates, key=lambda f: (f.get('height') or 0, f.get('tbr') or 0))
-        return best.get('format_id')
+                      if (f.get('vcodec') or '').startswith('h264')
+                      and f.get('acodec') not in (None, 'none')]
+    if not candidates:
+        return None
+    # pick the highest resolution candidate
+    return max(candidates, key=lambda f: (f.get('height') or 0, f.get('tbr') or 0))
+
+
+async def _best_h264_format_id(url: str, opts: dict) -> str | None:
+    """Return the best h264 format_id that has a real audio track (TikTok's
+    h264 variants carry audio; bytevc1 -1 is video-only).
+
+    Works on the cached info dict; only if that listing has no candidate
+    (TikTok sometimes lists video-only formats) is the URL extracted again.
+    """
+    try:
+        best = _h264_with_audio((await ydl_info.get_info(url, opts)).get('formats') or [])
+        if not best:
+            ydl_info.invalidate(url, opts)
+            best = _h264_with_audio((await ydl_info.get_info(url, opts)).get('formats') or [])
+        return best.get('format_id') if best else None
     except Exception as e:
         logger.warning(f"_best_h264_format_id error: {e}")
         return None
@@ -1541,11 +1682,13 @@ async def download_and_send(message: types.Message, url: str, format_type: str,
     if status_msg is None:
         status_msg = await message.answer(f"{platform_emoji} Descargando...")
     downloaded_file = None
+    route = classify(url)
 
     try:
         ydl_opts = get_ydl_opts(
             url, format_type,
-            progress_cb=lambda pct: update_status(status_msg, "⬇️", "Descargando", pct))
+            progress_cb=lambda pct: update_status(status_msg, "⬇️", "Descargando", pct),
+            route=route)
 
         # TikTok's extractor is flaky (intermittent 'universal data for
         # rehydration' errors, and sometimes only video-only formats are
@@ -1559,13 +1702,39 @@ async def download_and_send(message: types.Message, url: str, format_type: str,
                 # (TikTok's h264 variants carry a real audio track).
                 opts = dict(ydl_opts)
                 if intento > 0:
-                    fmt = await _best_h264_format_id(url)
+                    fmt = await _best_h264_format_id(url, ydl_opts)
                     if fmt:
                         opts['format'] = fmt
                         logger.info(f"Retry {intento + 1} forcing h264+audio format: {fmt}")
-                with yt_dlp.YoutubeDL(opts) as ydl:
-                    info = ydl.extract_info(url, download=True)
+                # Extracted once per URL; retries only redo format selection
+                with tracing.span("ytdl.info"):
+                    info = await ydl_info.get_info(url, ydl_opts)
+                if intento == 0 and format_type == 'video':
+                    # Pick a rendition that fits before spending bandwidth on one that doesn't
+                    with tracing.span("size_plan"):
+                        plan = await asyncio.to_thread(size_plan.plan, info, opts.get('format') or 'best', UPLOAD_LIMIT)
+                    if plan and plan.format:
+                        opts['format'] = plan.format
+                    if plan and plan.action == size_plan.COMPRESS:
+                        # Out of compression budget: fail now, not after the download
+                        await rate_limit.prepay("compress")
+                        await update_status(status_msg, "⬇️", "Descargando (se comprimirá)")
+                with yt_dlp.YoutubeDL(opts) as ydl, tracing.span("yt-dlp", attempt=intento + 1):
+                    started = time.monotonic()
+                    try:
+                        # Off the loop, so job leases, webhooks and other chats keep going
+                        info = await asyncio.to_thread(ydl_info.download, ydl, info)
+                    except yt_dlp.utils.DownloadError:
+                        metrics.BACKEND_CALLS.inc(backend="yt-dlp", outcome="error")
+                        # Media URLs may have gone stale; extract afresh next time
+                        ydl_info.invalidate(url, ydl_opts)
+                        raise
+                    finally:
+                        metrics.BACKEND_SECONDS.observe(time.monotonic() - started, backend="yt-dlp")
                     filename = await _resolve_filename(ydl, info)
+                metrics.BACKEND_CALLS.inc(backend="yt-dlp", outcome="ok" if filename else "empty")
+                if filename:
+                    metrics.DOWNLOAD_BYTES.inc(os.path.getsize(filename), backend="yt-dlp")
                 if filename and await _file_has_audio(filename):
                     break
                 if filename:
@@ -1593,65 +1762,61 @@ async def download_and_send(message: types.Message, url: str, format_type: str,
         title = info.get('title', 'video')
         downloaded_file = filename
 
-        await update_status(status_msg, "📤", "Enviando")
-
-        async with aiofiles.open(filename, 'rb') as f:
-            file_data = await f.read()
-
-            # Create delete button for original message
-            import hashlib
-            delete_hash = hashlib.md5(f"{message.chat.id}:{original_msg_id or message.message_id}".encode()).hexdigest()[:8]
-            original_messages[delete_hash] = {
-                'chat_id': message.chat.id,
-                'message_id': original_msg_id or message.message_id
-            }
+        # Create delete button for original message
+        import hashlib
+        delete_hash = hashlib.md5(f"{message.chat.id}:{original_msg_id or message.message_id}".encode()).hexdigest()[:8]
+        original_messages[delete_hash] = {
+            'chat_id': message.chat.id,
+            'message_id': original_msg_id or message.message_id
+        }
 
-            delete_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="🗑️ Delete original message", callback_data=f"del_orig:{delete_hash}")]
-            ])
+        delete_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🗑️ Delete original message", callback_data=f"del_orig:{delete_hash}")]
+        ])
 
-            if format_type == 'audio':
-                audio_input = BufferedInputFile(file_data, filename=f"{title[:50]}.mp3")
+        if format_type == 'audio':
+            await update_status(status_msg, "📤", "Enviando")
+            audio_input = FSInputFile(filename, filename=f"{title[:50]}.mp3")
+            async with batch_jobs.result_slot():
                 await message.answer_audio(
                     audio_input,
                     caption=f"**{title[:100]}**",
                     title=title[:100],
                     reply_markup=delete_keyboard
                 )
-            else:
-                # Video - add MP3 convert button and schedule cleanup
-                import hashlib
-                video_hash = hashlib.md5(f"{message.chat.id}:{filename}".encode()).hexdigest()[:8]
-                pending_downloads[f"conv:{video_hash}"] = url
-
-                keyboard_with_mp3 = InlineKeyboardMarkup(inline_keyboard=[
-                    [
-                        InlineKeyboardButton(text="🎵 Convert to MP3", callback_data=f"convert_mp3:{video_hash}"),
-                        InlineKeyboardButton(text="🗑️ Delete original", callback_data=f"del_orig:{delete_hash}")
-                    ]
-                ])
+        else:
+            # Video - add MP3 convert button and schedule cleanup
+            video_hash = hashlib.md5(f"{message.chat.id}:{filename}".encode()).hexdigest()[:8]
+            pending_downloads[f"conv:{video_hash}"] = url
+
+            keyboard_with_mp3 = InlineKeyboardMarkup(inline_keyboard=[
+                [
+                    InlineKeyboardButton(text="🎵 Convert to MP3", callback_data=f"convert_mp3:{video_hash}"),
+                    InlineKeyboardButton(text="🗑️ Delete original", callback_data=f"del_orig:{delete_hash}")
+                ]
+            ])
 
-                video_input = BufferedInputFile(file_data, filename=f"{title[:50]}.mp4")
+            if filesize > UPLOAD_LIMIT:
+                # Compress video with ffmpeg (with live progress bar)
+                await update_status(status_msg, "🗜️", "Comprimiendo", 0)
+                compressed_file = await compress_video(
+                    filename,
+                    progress_cb=lambda pct, att=None: update_status(
+                        status_msg, "🗜️",
+                        f"Comprimiendo (paso {att}/4)" if att else "Comprimiendo", pct))
+                if compressed_file:
+                    filesize = os.path.getsize(compressed_file)
+                    await cleanup_file(filename)
+                    filename = compressed_file
+                    title = f"{title[:50]} (compressed)"
 
-                if filesize > 50 * 1024 * 1024:
-                    # Compress video with ffmpeg (with live progress bar)
-                    await update_status(status_msg, "🗜️", "Comprimiendo", 0)
-                    compressed_file = await compress_video(
-                        filename,
-                        progress_cb=lambda pct, att=None: update_status(
-                            status_msg, "🗜️",
-                            f"Comprimiendo (paso {att}/4)" if att else "Comprimiendo", pct))
-                    if compressed_file:
-                        async with aiofiles.open(compressed_file, 'rb') as f:
-                            file_data = await f.read()
-                        filesize = len(file_data)
-                        await cleanup_file(filename)
-                        filename = compressed_file
-                        title = f"{title[:50]} (compressed)"
-
-                    video_input = BufferedInputFile(file_data, filename=f"{title[:50]}.mp4")
+            await update_status(status_msg, "📤", "Enviando")
+            # Streamed from disk, never read into memory
+            video_input = FSInputFile(filename, filename=f"{title[:50]}.mp4")
 
+            async with batch_jobs.result_slot():
                 if filesize > 50 * 1024 * 1024:
+                    # Over 50 MB: only the local Bot API server accepts it
                     await message.answer_document(
                         video_input,
                         caption=f"**{title[:100]}**",
@@ -1664,7 +1829,10 @@ async def download_and_send(message: types.Message, url: str, format_type: str,
                         supports_streaming=True,
                         reply_markup=keyboard_with_mp3
                     )
+            # Keep the sent file around for "Convert to MP3"
+            await audio_derive.remember_video(video_hash, filename)
 
+        metrics.DELIVERIES.inc(platform=route.platform, via="yt-dlp")
         # Single status message: brief confirmation, then self-delete
         await update_status(status_msg, "✅", "Enviado")
         asyncio.create_task(delete_message_after_delay(status_msg, 5))
@@ -1675,16 +1843,37 @@ async def download_and_send(message: types.Message, url: str, format_type: str,
         logger.warning(f"yt-dlp failed ({e}), trying alternatives...")
         alt_file = None
         alt_label = ""
+        handed_off = None
 
-        # For TikTok, tikwm.com bypasses the JS challenge/rate limits first
-        if 'tiktok.com' in url:
+        # For TikTok, tikwm.com bypasses the JS challenge/rate limits first.
+        # Public CDN links are handed to Telegram as URLs; we only download
+        # ourselves when that is not possible or fails.
+        if route.platform == url_classifier.TIKTOK:
             await update_status(status_msg, "🔁", "Probando tikwm...")
-            alt_file = await download_via_tikwm(url)
             alt_label = "tikwm"
-        if not alt_file:
+            media = await resolve_tikwm(url)
+            if media:
+                handed_off = await delivery.send_video_url(message, media, caption=f"📥 vía {alt_label}")
+                if not handed_off:
+                    alt_file = await download_via_tikwm(
+                        url, media=media,
+                        progress_cb=lambda pct: update_status(status_msg, "⬇️", "Descargando (tikwm)", pct))
+        if not alt_file and not handed_off:
             await update_status(status_msg, "🔁", "Probando cobalt...")
-            alt_file = await download_via_cobalt(url)
             alt_label = "cobalt"
+            resolved = await resolve_cobalt(url)
+            if resolved:
+                handed_off = await delivery.send_video_url(message, resolved[0], caption=f"📥 vía {alt_label}")
+                if not handed_off:
+                    alt_file = await download_via_cobalt(
+                        url, resolved=resolved,
+                        progress_cb=lambda pct: update_status(status_msg, "⬇️", "Descargando (cobalt)", pct))
+
+        if handed_off:
+            metrics.DELIVERIES.inc(platform=route.platform, via=f"{alt_label}_url")
+            await update_status(status_msg, "✅", f"Enviado ({alt_label})")
+            asyncio.create_task(delete_message_after_delay(status_msg, 5))
+            return True
 
         if alt_file:
             filesize = os.path.getsize(alt_file)
@@ -1693,7 +1882,7 @@ async def download_and_send(message: types.Message, url: str, format_type: str,
             await update_status(status_msg, "📤", "Enviando")
 
             # Compress if needed (with live progress bar)
-            if filesize > 50 * 1024 * 1024:
+            if filesize > UPLOAD_LIMIT:
                 await update_status(status_msg, "🗜️", "Comprimiendo", 0)
                 compressed = await compress_video(
                     alt_file,
@@ -1707,20 +1896,23 @@ async def download_and_send(message: types.Message, url: str, format_type: str,
 
             video_input = FSInputFile(alt_file, filename=f"{title[:40]}.mp4")
 
-            if filesize > 50 * 1024 * 1024:
-                await message.answer_document(video_input, caption=f"📥 vía {alt_label}")
-            else:
-                await message.answer_video(
-                    video_input,
-                    caption=f"📥 vía {alt_label}",
-                    supports_streaming=True
-                )
+            async with batch_jobs.result_slot():
+                if filesize > 50 * 1024 * 1024:
+                    await message.answer_document(video_input, caption=f"📥 vía {alt_label}")
+                else:
+                    await message.answer_video(
+                        video_input,
+                        caption=f"📥 vía {alt_label}",
+                        supports_streaming=True
+                    )
 
+            metrics.DELIVERIES.inc(platform=route.platform, via=alt_label)
             await update_status(status_msg, "✅", f"Enviado ({alt_label})")
             asyncio.create_task(delete_message_after_delay(status_msg, 5))
             await cleanup_file(alt_file)
             return True
         else:
+            metrics.DELIVERIES.inc(platform=route.platform, via="failed")
             error_msg = await status_msg.edit_text(
                 "❌ Could not download the video.\n\n"
                 "It may be private or require login."
@@ -1730,6 +1922,7 @@ async def download_and_send(message: types.Message, url: str, format_type: str,
 
     except Exception as e:
         logger.error(f"Error: {e}", exc_info=True)
+        metrics.DELIVERIES.inc(platform=route.platform, via="error")
         error_msg = await status_msg.edit_text(f"❌ Error: {str(e)[:100]}")
         asyncio.create_task(delete_message_after_delay(error_msg, 5))
         return False
@@ -1742,7 +1935,7 @@ async def download_and_send(message: types.Message, url: str, format_type: str,
 async def handle_mp3(callback: types.CallbackQuery):
     await callback.answer()
     url_hash = callback.data.split(":", 1)[1]
-    url = pending_downloads.get(url_hash)
+    url = await pending_downloads.get(url_hash)
 
     if not url:
         await callback.message.edit_text("❌ Link expired. Please send the URL again.")
@@ -1750,16 +1943,19 @@ async def handle_mp3(callback: types.CallbackQuery):
 
     # Delete the selection message - download_and_send will create its own status
     await callback.message.delete()
-    await download_and_send(callback.message, url, 'audio')
+    if BOT_ROLE == "frontend":
+        await _queue_job("download", callback.message, url=url, format_type='audio')
+    else:
+        await _run_in_workspace("youtube", callback.message,
+                                lambda: download_and_send(callback.message, url, 'audio'))
 
-    if url_hash in pending_downloads:
-        del pending_downloads[url_hash]
+    await pending_downloads.pop(url_hash)
 
 @dp.callback_query(F.data.startswith("mp4:"))
 async def handle_mp4(callback: types.CallbackQuery):
     await callback.answer()
     url_hash = callback.data.split(":", 1)[1]
-    url = pending_downloads.get(url_hash)
+    url = await pending_downloads.get(url_hash)
 
     if not url:
         await callback.message.edit_text("❌ Link expired. Please send the URL again.")
@@ -1767,17 +1963,20 @@ async def handle_mp4(callback: types.CallbackQuery):
 
     # Delete the selection message - download_and_send will create its own status
     await callback.message.delete()
-    await download_and_send(callback.message, url, 'video')
+    if BOT_ROLE == "frontend":
+        await _queue_job("download", callback.message, url=url, format_type='video')
+    else:
+        await _run_in_workspace("youtube", callback.message,
+                                lambda: download_and_send(callback.message, url, 'video'))
 
-    if url_hash in pending_downloads:
-        del pending_downloads[url_hash]
+    await pending_downloads.pop(url_hash)
 
 @dp.callback_query(F.data.startswith("del_orig:"))
 async def handle_delete_original(callback: types.CallbackQuery):
     """Handle delete original message button"""
     await callback.answer()
     delete_hash = callback.data.split(":", 1)[1]
-    msg_info = original_messages.get(delete_hash)
+    msg_info = await original_messages.get(delete_hash)
 
     if not msg_info:
         await callback.answer("Message info expired", show_alert=True)
@@ -1794,85 +1993,92 @@ async def handle_delete_original(callback: types.CallbackQuery):
         await callback.answer("Could not delete message", show_alert=True)
 
     # Clean up
-    if delete_hash in original_messages:
-        del original_messages[delete_hash]
+    await original_messages.pop(delete_hash)
 
 @dp.callback_query(F.data.startswith("convert_mp3:"))
 async def handle_convert_mp3(callback: types.CallbackQuery):
-    """Convert downloaded video to MP3"""
     await callback.answer("🎵 Converting to MP3...")
-
     video_hash = callback.data.split(":", 1)[1]
-    url = pending_downloads.get(f"conv:{video_hash}")
-
-    if not url:
-        await callback.message.answer("❌ Link expired. Please download again.")
-        return
-
-    try:
-        temp_dir = tempfile.mkdtemp(prefix="mp3_conv_", dir="downloads")
+    if BOT_ROLE == "frontend":
+        await _queue_job("convert_mp3", callback.message, data=video_hash)
+    else:
+        await _run_in_workspace("mp3", callback.message, lambda: _convert_to_audio(callback.message, video_hash))
 
-        status_msg = await callback.message.answer("⏳ Downloading video for conversion...")
 
-        ydl_opts = get_ydl_opts(url, 'video')
-        ydl_opts['format'] = 'bestaudio/best'
+async def _convert_to_audio(message: types.Message, video_hash: str):
+    """Extract the audio of the video in ``message`` (sent by the bot).
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
+    Sources, cheapest first: the local copy kept after sending, the sent
+    video itself via the Bot API, and only then the original URL.
+    """
+    url = await pending_downloads.get(f"conv:{video_hash}")
+    # The button sits on the sent video, so its file is reachable by id
+    media = getattr(message, 'video', None) or getattr(message, 'document', None)
+    audio_key = media.file_unique_id if media else video_hash
+
+    cached = audio_derive.cached_audio(audio_key)
+    if cached:
+        file_id, title = cached
+        await message.answer_audio(file_id, caption=f"🎵 {title[:100]}")
+        return
 
-            if not os.path.exists(filename):
-                possible_exts = ['mp4', 'webm', 'mkv', 'avi', 'mov', 'm4a']
-                base_name = os.path.splitext(filename)[0]
-                for ext in possible_exts:
-                    test_file = f"{base_name}.{ext}"
-                    if os.path.exists(test_file):
-                        filename = test_file
-                        break
+    video_path = audio_derive.recent_video(video_hash)
+    if not video_path and not media and not url:
+        await message.answer("❌ Link expired. Please download again.")
+        return
 
-        # Convert to MP3 using ffmpeg
-        await status_msg.edit_text("🎵 Converting to MP3...")
+    status_msg = None
+    try:
+        temp_dir = workspace.current_dir()
+        title = os.path.splitext(getattr(media, 'file_name', None) or "")[0] or "audio"
 
-        title = info.get('title', 'audio')[:50]
-        mp3_file = os.path.join(temp_dir, f"{title}.mp3")
+        if not video_path and media and not LOCAL_API_SERVER and (media.file_size or 0) <= BOT_API_DOWNLOAD_LIMIT:
+            status_msg = await message.answer("⏳ Fetching sent video...")
+            video_path = os.path.join(temp_dir, "video")
+            await bot.download(media, destination=video_path)
 
-        proc = await asyncio.create_subprocess_exec(
-            'ffmpeg', '-i', filename, '-vn', '-acodec', 'libmp3lame',
-            '-ab', '192k', '-y', mp3_file,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        await proc.communicate()
+        if not video_path:
+            if not url:
+                await message.answer("❌ Link expired. Please download again.")
+                return
+            status_msg = await message.answer("⏳ Downloading video for conversion...")
+            ydl_opts = get_ydl_opts(url, 'video')
+            ydl_opts['outtmpl'] = os.path.join(temp_dir, '%(id)s.%(ext)s')
+            # Usually still cached from the video download moments ago
+            info = await ydl_info.get_info(url, ydl_opts)
+            ydl_opts['format'] = 'bestaudio/best'
+
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = await asyncio.to_thread(ydl_info.download, ydl, info)
+                video_path = await _resolve_filename(ydl, info)
+            title = info.get('title') or title
+            if not video_path:
+                raise yt_dlp.utils.DownloadError("No downloaded file found")
+
+        if status_msg:
+            await status_msg.edit_text("🎵 Converting to MP3...")
+        else:
+            status_msg = await message.answer("🎵 Converting to MP3...")
 
-        if not os.path.exists(mp3_file):
+        audio_file = await audio_derive.extract_audio(video_path, temp_dir, title[:50])
+        if not audio_file:
             await status_msg.edit_text("❌ Failed to convert. Video may not have audio.")
-            await cleanup_directory(temp_dir)
             return
 
-        # Send MP3
-        async with aiofiles.open(mp3_file, 'rb') as f:
-            mp3_data = await f.read()
-
-        audio_input = BufferedInputFile(mp3_data, filename=f"{title}.mp3")
-
-        await callback.message.answer_audio(
-            audio_input,
-            caption=f"🎵 {info.get('title', 'audio')[:100]}"
+        sent = await message.answer_audio(
+            FSInputFile(audio_file),
+            caption=f"🎵 {title[:100]}"
         )
+        if sent.audio:
+            audio_derive.remember_audio(audio_key, sent.audio.file_id, title)
 
         await status_msg.edit_text("✅ Converted to MP3!")
 
-        await cleanup_file(filename)
-        await cleanup_directory(temp_dir)
-
     except Exception as e:
         logger.error(f"MP3 conversion error: {e}")
-        if 'status_msg' in locals():
+        if status_msg:
             await status_msg.edit_text(f"❌ Error: {str(e)[:100]}")
 
-    if f"conv:{video_hash}" in pending_downloads:
-        del pending_downloads[f"conv:{video_hash}"]
-
 async def markov_auto_sender():
     """Background task that sends a Markov-generated message every N minutes."""
     if not MARKOV_ENABLED:
@@ -1925,7 +2131,7 @@ async def markov_retrain_job():
 
     while True:
         try:
-            success = await markov_service.retrain_model(model_path=MARKOV_MODEL_PATH)
+            success = await markov_service.retrain_model(output_path=MARKOV_MODEL_PATH)
             if success:
                 logger.info("Markov model retrained and hot-reloaded")
             else:
@@ -1936,9 +2142,37 @@ async def markov_retrain_job():
         await asyncio.sleep(interval_seconds)
 
 
+async def _collect_disk_metrics():
+    u = await workspace.usage()
+    metrics.DISK.set(u["used_bytes"], kind="used")
+    metrics.DISK.set(u["free_bytes"], kind="free")
+    metrics.DISK.set(u["quota_bytes"], kind="quota")
+    metrics.WORKSPACE_JOBS.set(u["active_jobs"], state="active")
+    metrics.WORKSPACE_JOBS.set(u["waiting_jobs"], state="waiting")
+
 async def main():
+    metrics_runner = None
     try:
-        logger.info("Bot starting...")
+        logger.info(f"Bot starting (role: {BOT_ROLE})...")
+
+        # Drop leftovers of a previous run, then keep sweeping orphans
+        await workspace.startup()
+        asyncio.create_task(workspace.sweeper())
+
+        metrics.on_scrape(_collect_disk_metrics)
+        if BOT_ROLE == "frontend":
+            metrics.on_scrape(job_queue.collect_metrics)
+            asyncio.create_task(job_queue.maintenance())
+        metrics_runner = await metrics.serve()
+
+        # Loop lag / blocking callback logging, and SIGUSR2 -> profile
+        asyncio.create_task(profiling.monitor())
+        profiling.install_signal_handler()
+
+        if BOT_ROLE == "worker":
+            # Only queued jobs: no polling, no Markov
+            await job_queue.serve(_run_job, MAX_CONCURRENT_JOBS)
+            return
 
         # Load Markov model once at startup
         if MARKOV_ENABLED:
@@ -1954,8 +2188,18 @@ async def main():
         if MARKOV_ENABLED and MARKOV_LEARN_ENABLED and markov_service.is_model_available():
             asyncio.create_task(markov_retrain_job())
 
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if webhook.WEBHOOK_URL:
+            await webhook.serve(dp, bot)
+        else:
+            # getUpdates is refused while a webhook from a previous deployment is set
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
+        await image_fetcher.close()
+        await igdl_pool.pool.close()
+        extractor_pool.shutdown()
+        if metrics_runner:
+            await metrics_runner.cleanup()
         await bot.session.close()
 
 if __name__ == '__main__':
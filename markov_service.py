@@ -5,6 +5,7 @@ and periodic retraining.
 """
 
 import asyncio
+import hashlib
 import logging
 import os
 import re
@@ -16,16 +17,37 @@ logger = logging.getLogger(__name__)
 # Global model instance (loaded once at startup, refreshed on retrain)
 _markov_model = None
 _model_loaded = False
+# Lines a retrained model was built from; it keeps no original text, so
+# this is what generated sentences are checked against for novelty
+_seen_lines = None
 
 # Default paths (can be overridden via env vars or args)
 DEFAULT_MODEL_PATH = "./model.json"
 DEFAULT_BASE_CORPUS_PATH = "./messages_clean.txt"
 DEFAULT_LEARNED_PATH = "./messages_learned.txt"
 
+# How many times the same cleaned line may feed the chain on retrain
+MAX_LINE_REPEATS = int(os.getenv("MARKOV_MAX_LINE_REPEATS", "1"))
+# Size of the fixed dedup table used on retrain (independent of corpus size)
+DEDUP_TABLE_BYTES = int(os.getenv("MARKOV_DEDUP_MB", "16")) * 1024 * 1024
 
-def load_markov_model(model_path: str = DEFAULT_MODEL_PATH) -> bool:
-    """Load the Markov model from JSON. Returns True on success."""
-    global _markov_model, _model_loaded
+
+def _lines_path(model_path: str) -> str:
+    return model_path + ".lines"
+
+
+def load_markov_model(
+    model_path: str = DEFAULT_MODEL_PATH,
+    corpus_paths=(DEFAULT_BASE_CORPUS_PATH, DEFAULT_LEARNED_PATH),
+) -> bool:
+    """
+    Load the Markov model from JSON. Returns True on success.
+
+    A model saved without its original text (see ``retrain_model``) gets
+    its novelty filter from ``<model_path>.lines``, rebuilt from
+    ``corpus_paths`` if that file is missing.
+    """
+    global _markov_model, _model_loaded, _seen_lines
 
     logger.info("Loading Markov model...")
 
@@ -38,6 +60,7 @@ def load_markov_model(model_path: str = DEFAULT_MODEL_PATH) -> bool:
         with open(model_path, "r", encoding="utf-8") as f:
             json_str = f.read()
         _markov_model = markovify.NewlineText.from_json(json_str)
+        _seen_lines = None if hasattr(_markov_model, "rejoined_text") else _load_seen_lines(model_path, corpus_paths)
         _model_loaded = True
         logger.info("Markov model loaded successfully")
         return True
@@ -48,6 +71,27 @@ def load_markov_model(model_path: str = DEFAULT_MODEL_PATH) -> bool:
         return False
 
 
+def _load_seen_lines(model_path: str, corpus_paths) -> "_LineCounter":
+    try:
+        return _LineCounter.load(_lines_path(model_path))
+    except OSError:
+        pass
+    logger.info("Markov novelty filter not found, rebuilding it from the corpus")
+    counter = _LineCounter(DEDUP_TABLE_BYTES)
+    for _line in iter_corpus_lines(corpus_paths, counter=counter):
+        pass
+    try:
+        counter.save(_lines_path(model_path))
+    except OSError as e:
+        logger.warning(f"Could not save the Markov novelty filter: {e}")
+    return counter
+
+
+def _is_novel(sentence: str) -> bool:
+    """False if ``sentence`` repeats a training line verbatim."""
+    return _seen_lines is None or not _seen_lines.seen(sentence)
+
+
 def is_model_available() -> bool:
     """Check whether the model was loaded successfully."""
     return _model_loaded and _markov_model is not None
@@ -76,7 +120,7 @@ def generate_markov_sentence(seed: str | None = None, max_retries: int = 5) -> s
         for attempt in range(1, max_retries + 1):
             try:
                 sentence = _markov_model.make_sentence_with_start(seed, strict=False)
-                if sentence:
+                if sentence and _is_novel(sentence):
                     logger.debug(f"Markov seed generation succeeded on attempt {attempt}")
                     return sentence
             except (KeyError, markovify.text.ParamError):
@@ -89,7 +133,7 @@ def generate_markov_sentence(seed: str | None = None, max_retries: int = 5) -> s
     for attempt in range(1, max_retries + 1):
         try:
             sentence = _markov_model.make_sentence()
-            if sentence:
+            if sentence and _is_novel(sentence):
                 logger.debug(f"Markov random generation succeeded on attempt {attempt}")
                 return sentence
         except Exception as e:
@@ -147,73 +191,185 @@ async def learn_message(text: str, learned_path: str = DEFAULT_LEARNED_PATH):
         logger.error(f"Failed to learn message: {e}")
 
 
+class _StreamingNewlineText(markovify.NewlineText):
+    """NewlineText that also accepts an iterable of lines and consumes it lazily."""
+
+    def generate_corpus(self, text):
+        if isinstance(text, str):
+            return super().generate_corpus(text)
+        passing = filter(self.test_sentence_input, text)
+        return map(self.word_split, passing)
+
+
+class _LineCounter:
+    """
+    Count-min sketch over cleaned lines.
+
+    Fixed-size table of saturating byte counters, so dedup memory does not
+    grow with the corpus. Collisions can only over-count, i.e. a rare unique
+    line may be dropped, never a spam line let through.
+    """
+
+    def __init__(self, size_bytes: int, rows: int = 4):
+        self.rows = rows
+        self.width = max(1024, size_bytes // rows)
+        self.table = bytearray(self.width * rows)
+
+    def _slots(self, line: str) -> list[int]:
+        digest = hashlib.blake2b(line.encode("utf-8"), digest_size=4 * self.rows).digest()
+        return [
+            row * self.width + int.from_bytes(digest[4 * row:4 * row + 4], "little") % self.width
+            for row in range(self.rows)
+        ]
+
+    def add(self, line: str, limit: int) -> bool:
+        """Count ``line`` and return True if it was seen fewer than ``limit`` times."""
+        slots = self._slots(line)
+        count = min(self.table[s] for s in slots)
+        if count >= limit:
+            return False
+        # Conservative update: only bump the counters holding the minimum
+        for s in slots:
+            if self.table[s] == count and count < 255:
+                self.table[s] = count + 1
+        return True
+
+    def seen(self, line: str) -> bool:
+        """True if ``line`` was counted (or collides with lines that were)."""
+        return min(self.table[s] for s in self._slots(line)) > 0
+
+    def save(self, path: str):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(self.table)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, rows: int = 4) -> "_LineCounter":
+        with open(path, "rb") as f:
+            table = bytearray(f.read())
+        counter = cls(0, rows)
+        counter.width = len(table) // rows
+        counter.table = table
+        return counter
+
+
+def iter_corpus_lines(
+    paths,
+    max_line_repeats: int = 1,
+    stats: dict | None = None,
+    dedup_bytes: int = DEDUP_TABLE_BYTES,
+    counter: _LineCounter | None = None,
+):
+    """
+    Stream cleaned, deduplicated lines from one or more corpus files.
+
+    Each file is read line by line, ``_clean_message`` runs once per line,
+    and a line is yielded at most ``max_line_repeats`` times across all
+    files (counted in a fixed-size ``_LineCounter``), so repeated spam
+    can't skew the chain and the full corpus is never held in memory.
+
+    If ``stats`` is given it is filled with ``read``/``kept``/``skipped``/
+    ``duplicates`` counters. A ``counter`` passed in is used instead of a
+    fresh ``dedup_bytes`` table and afterwards holds every kept line.
+    """
+    if counter is None:
+        counter = _LineCounter(dedup_bytes)
+    limit = max(1, min(255, max_line_repeats))
+    counters = {"read": 0, "kept": 0, "skipped": 0, "duplicates": 0}
+
+    for path in paths:
+        if not path or not os.path.exists(path):
+            continue
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                for raw in f:
+                    counters["read"] += 1
+                    cleaned = _clean_message(raw)
+                    if not cleaned:
+                        counters["skipped"] += 1
+                        continue
+                    if not counter.add(cleaned, limit):
+                        counters["duplicates"] += 1
+                        continue
+                    counters["kept"] += 1
+                    yield cleaned
+        except Exception as e:
+            logger.error(f"Error reading corpus {path}: {e}")
+
+    if stats is not None:
+        stats.update(counters)
+
+
 async def retrain_model(
     output_path: str = DEFAULT_MODEL_PATH,
     base_corpus_path: str = DEFAULT_BASE_CORPUS_PATH,
     learned_path: str = DEFAULT_LEARNED_PATH,
     state_size: int = 2,
+    max_line_repeats: int = MAX_LINE_REPEATS,
 ) -> bool:
     """
     Retrain the Markov model from the base corpus + learned messages,
     save it to disk, and hot-reload the in-memory model.
 
+    Both corpora are streamed line by line through ``iter_corpus_lines``
+    straight into the chain builder, so memory stays proportional to the
+    chain, not to the corpus. The original sentences are not retained in
+    the model (``retain_original=False``), which also keeps ``model.json``
+    small. markovify then has no text to test its output against, so the
+    dedup table is kept as a novelty filter instead (saved next to the
+    model as ``<output_path>.lines``): ``generate_markov_sentence`` rejects
+    sentences that repeat a corpus line verbatim.
+
     Returns True on success.
     """
     logger.info("Retraining Markov model...")
 
-    corpus_parts = []
-
-    # Read base corpus
-    if os.path.exists(base_corpus_path):
-        try:
-
-            def _read_base():
-                with open(base_corpus_path, "r", encoding="utf-8") as f:
-                    return f.read()
-
-            base_text = await asyncio.to_thread(_read_base)
-            if base_text.strip():
-                corpus_parts.append(base_text.strip())
-        except Exception as e:
-            logger.error(f"Error reading base corpus: {e}")
-
-    # Read learned messages
-    if os.path.exists(learned_path):
-        try:
-
-            def _read_learned():
-                with open(learned_path, "r", encoding="utf-8") as f:
-                    return f.read()
-
-            learned_text = await asyncio.to_thread(_read_learned)
-            if learned_text.strip():
-                corpus_parts.append(learned_text.strip())
-        except Exception as e:
-            logger.error(f"Error reading learned corpus: {e}")
-
-    if not corpus_parts:
+    if not any(os.path.exists(p) for p in (base_corpus_path, learned_path)):
         logger.warning("No corpus available for retraining")
         return False
 
-    full_corpus = "\n".join(corpus_parts)
-
     try:
 
         def _train_and_save():
-            model = markovify.NewlineText(full_corpus, state_size=state_size)
+            stats = {}
+            counter = _LineCounter(DEDUP_TABLE_BYTES)
+            lines = iter_corpus_lines(
+                [base_corpus_path, learned_path],
+                max_line_repeats=max_line_repeats,
+                stats=stats,
+                counter=counter,
+            )
+            try:
+                model = _StreamingNewlineText(lines, state_size=state_size, retain_original=False)
+            except KeyError:
+                # Chain has no begin state: every line was filtered out
+                if not stats.get("kept"):
+                    return None, None, stats
+                raise
             json_str = model.to_json()
+            counter.save(_lines_path(output_path))
             with open(output_path, "w", encoding="utf-8") as f:
                 f.write(json_str)
-            return model
+            return model, counter, stats
+
+        new_model, seen_lines, stats = await asyncio.to_thread(_train_and_save)
 
-        new_model = await asyncio.to_thread(_train_and_save)
+        if new_model is None:
+            logger.warning("No corpus available for retraining")
+            return False
 
         # Hot-reload the in-memory model
-        global _markov_model, _model_loaded
+        global _markov_model, _model_loaded, _seen_lines
         _markov_model = new_model
+        _seen_lines = seen_lines
         _model_loaded = True
 
-        logger.info("Markov model retrained and hot-reloaded successfully")
+        logger.info(
+            f"Markov model retrained and hot-reloaded successfully "
+            f"(lines read={stats.get('read', 0)}, kept={stats.get('kept', 0)}, "
+            f"duplicates={stats.get('duplicates', 0)}, skipped={stats.get('skipped', 0)})"
+        )
         return True
     except Exception as e:
         logger.error(f"Failed to retrain Markov model: {e}", exc_info=True)
@@ -0,0 +1,277 @@
+"""
+Prometheus metrics for the download pipeline.
+
+A small in-process registry of counters, gauges and histograms, rendered
+in the Prometheus text exposition format and served on
+``METRICS_HOST:METRICS_PORT/metrics`` (disabled when the port is 0).
+Updates are plain dict operations on the event loop, and histograms use a
+short fixed bucket list, so instrumenting hot paths costs next to nothing.
+
+- ``track(backend)`` decorates a backend coroutine (``download_via_*``,
+  ``scrape_*``...): calls by outcome, latency, bytes downloaded, and a
+  span in the job's trace (see ``tracing``).
+- ``TelegramRequestMetrics`` is an aiogram request middleware: latency,
+  errors and uploaded bytes of every Bot API call (the send path).
+- ``on_scrape(fn)`` registers a coroutine that refreshes gauges owned by
+  other modules (disk usage, pools) right before each scrape.
+"""
+
+import bisect
+import functools
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import FSInputFile
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Seconds: network backends and whole jobs (sub-second to minutes)
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATIO_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.9, 1.0)
+
+_registry: list["_Metric"] = []
+_collectors = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value) -> str:
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, object] = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield self.name, _labels(self.labelnames, key), value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # Per-bucket counts (+Inf last), sum, count
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def _samples(self):
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, n in zip((*self.buckets, "+Inf"), counts):
+                cumulative += n
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                yield f"{self.name}_bucket", _labels(self.labelnames, key, f'le="{le}"'), cumulative
+            yield f"{self.name}_sum", _labels(self.labelnames, key), total
+            yield f"{self.name}_count", _labels(self.labelnames, key), count
+
+
+# ── Pipeline metrics ─────────────────────────────────────────────────────
+
+LINKS = Counter("bot_links_total", "Links received, by platform", ("platform",))
+JOBS_QUEUED = Gauge("bot_jobs_queued", "Jobs waiting for a free job slot")
+JOBS_RUNNING = Gauge("bot_jobs_running", "Jobs holding a job slot, by platform", ("platform",))
+JOB_SECONDS = Histogram("bot_job_seconds", "Time from job start to results sent", ("platform",))
+DELIVERIES = Counter("bot_deliveries_total", "Finished video jobs, by the path that delivered them",
+                     ("platform", "via"))
+
+BACKEND_CALLS = Counter("bot_backend_calls_total", "Backend calls by outcome (ok, empty, error)",
+                        ("backend", "outcome"))
+BACKEND_SECONDS = Histogram("bot_backend_seconds", "Backend call latency", ("backend",))
+DOWNLOAD_BYTES = Counter("bot_download_bytes_total", "Bytes written to disk by backends", ("backend",))
+
+TELEGRAM_SECONDS = Histogram("bot_telegram_request_seconds", "Bot API call latency", ("method",))
+TELEGRAM_ERRORS = Counter("bot_telegram_errors_total", "Failed Bot API calls", ("method", "error"))
+UPLOAD_BYTES = Counter("bot_upload_bytes_total", "Bytes uploaded to Telegram", ("method",))
+URL_HANDOFFS = Counter("bot_url_handoffs_total", "Media sent by URL (sent, refused, bad_result)",
+                       ("source", "outcome"))
+
+COMPRESS_ATTEMPTS = Counter("bot_compress_attempts_total", "ffmpeg encode attempts (ok, too_big, failed)",
+                            ("encoder", "outcome"))
+ENCODE_SECONDS = Histogram("bot_encode_seconds", "ffmpeg time per encode attempt", ("encoder",))
+COMPRESSION_RATIO = Histogram("bot_compression_ratio", "Output size / input size of compressed videos",
+                              buckets=RATIO_BUCKETS)
+
+DISK = Gauge("bot_disk_bytes", "downloads/ usage (used, free, quota)", ("kind",))
+WORKSPACE_JOBS = Gauge("bot_workspace_jobs", "Jobs holding or waiting for disk budget", ("state",))
+
+
+def _result_bytes(result) -> int:
+    """Size of the file(s) a backend returned: a path, a list of paths, or
+    a tuple whose first item is one of those."""
+    if isinstance(result, tuple):
+        result = result[0] if result else None
+    paths = result if isinstance(result, list) else [result]
+    total = 0
+    for path in paths:
+        if isinstance(path, str) and os.path.isfile(path):
+            total += os.path.getsize(path)
+    return total
+
+
+def _is_ok(result) -> bool:
+    if isinstance(result, tuple):
+        return bool(result and result[0])
+    return bool(result)
+
+
+def track(backend: str):
+    """Decorator: count, time and size the results of a backend coroutine
+    (also recorded as a span of the current trace)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with tracing.span(backend) as attrs:
+                start = time.monotonic()
+                try:
+                    result = await fn(*args, **kwargs)
+                except Exception:
+                    BACKEND_CALLS.inc(backend=backend, outcome="error")
+                    raise
+                finally:
+                    BACKEND_SECONDS.observe(time.monotonic() - start, backend=backend)
+                outcome = "ok" if _is_ok(result) else "empty"
+                BACKEND_CALLS.inc(backend=backend, outcome=outcome)
+                size = _result_bytes(result)
+                if size:
+                    DOWNLOAD_BYTES.inc(size, backend=backend)
+                attrs.update(outcome=outcome, bytes=size)
+                return result
+        return wrapper
+    return decorator
+
+
+class TelegramRequestMetrics(BaseRequestMiddleware):
+    """Time every Bot API request and count uploaded bytes and errors."""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        start = time.monotonic()
+        try:
+            response = await make_request(bot, method)
+        except Exception as e:
+            TELEGRAM_ERRORS.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(time.monotonic() - start, method=name)
+        uploaded = 0
+        for value in vars(method).values():
+            if isinstance(value, FSInputFile):
+                try:
+                    uploaded += os.path.getsize(value.path)
+                except OSError:
+                    pass
+        if uploaded:
+            UPLOAD_BYTES.inc(uploaded, method=name)
+        return response
+
+
+def on_scrape(fn):
+    """Register ``fn()`` (a coroutine function) to run before each scrape."""
+    _collectors.append(fn)
+    return fn
+
+
+async def render() -> str:
+    for collect in _collectors:
+        try:
+            await collect()
+        except Exception as e:
+            logger.warning(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def serve():
+    """Start the ``/metrics`` endpoint; returns the aiohttp runner (or None)."""
+    if not METRICS_PORT:
+        return None
+    from aiohttp import web
+
+    async def handle(_request):
+        return web.Response(body=(await render()).encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    logger.info(f"Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
@@ -0,0 +1,200 @@
+"""
+Runtime profiling hooks for the running bot.
+
+- ``profile(seconds)``: a sampling profiler over every thread (the event
+  loop, yt-dlp/gallery-dl workers...). A background thread snapshots
+  ``sys._current_frames()`` every ``PROFILE_INTERVAL_MS`` and the result
+  is written to ``logs/profiles/`` as a collapsed-stack file (for
+  flamegraph.pl / speedscope) and a speedscope JSON. Started by the
+  ``/profile`` admin command or ``kill -USR2 <pid>``.
+- ``monitor()``: event-loop health. A periodic tick measures how late it
+  runs (loop lag, logged and exported to ``metrics``), and a watchdog
+  thread logs the loop thread's stack when a callback blocks it for more
+  than ``LOOP_BLOCK_MS``.
+
+Everything here is stdlib; sampling costs one frame walk per thread per
+interval and only while a profile is running.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import NamedTuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.path.join("logs", "profiles")
+PROFILE_INTERVAL_MS = int(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = 300
+# Window profiled on SIGUSR2
+SIGNAL_PROFILE_SECONDS = int(os.getenv("SIGNAL_PROFILE_SECONDS", "30"))
+LOOP_LAG_INTERVAL = 0.5
+# A callback holding the loop longer than this is logged with its stack (0 = off)
+LOOP_BLOCK_MS = int(os.getenv("LOOP_BLOCK_MS", "250"))
+
+LOOP_LAG = metrics.Histogram("bot_loop_lag_seconds", "How late the event loop runs a periodic tick",
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+LOOP_BLOCKS = metrics.Counter("bot_loop_blocks_total", "Callbacks that blocked the event loop over LOOP_BLOCK_MS")
+
+_profile_lock = asyncio.Lock()
+_heartbeat = time.monotonic()
+
+
+class Profile(NamedTuple):
+    collapsed_path: str
+    speedscope_path: str
+    samples: int
+    top: list[tuple[str, int]]   # (frame, self samples), hottest first
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _stack(frame) -> list[str]:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, interval: float):
+        super().__init__(name="profiler", daemon=True)
+        self.interval = interval
+        self.stacks: Counter[tuple[str, ...]] = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                thread = names.get(ident, str(ident))
+                self.stacks[(f"thread:{thread}", *_stack(frame))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _write(sampler: _Sampler, seconds: float) -> Profile:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, time.strftime("profile_%Y%m%d_%H%M%S"))
+
+    with open(f"{base}.collapsed", "w", encoding="utf-8") as f:
+        for stack, count in sampler.stacks.most_common():
+            f.write(f"{';'.join(stack)} {count}\n")
+
+    frames: dict[str, int] = {}
+    samples, weights = [], []
+    for stack, count in sampler.stacks.items():
+        samples.append([frames.setdefault(name, len(frames)) for name in stack])
+        weights.append(count * sampler.interval)
+    with open(f"{base}.speedscope.json", "w", encoding="utf-8") as f:
+        json.dump({
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": [{"name": name} for name in frames]},
+            "profiles": [{
+                "type": "sampled",
+                "name": os.path.basename(base),
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": seconds,
+                "samples": samples,
+                "weights": weights,
+            }],
+        }, f)
+
+    self_time: Counter[str] = Counter()
+    for stack, count in sampler.stacks.items():
+        self_time[f"{stack[0]} {stack[-1]}"] += count
+    return Profile(f"{base}.collapsed", f"{base}.speedscope.json", sampler.samples,
+                   self_time.most_common(10))
+
+
+def is_running() -> bool:
+    return _profile_lock.locked()
+
+
+async def profile(seconds: float) -> Profile:
+    """Sample all threads for ``seconds`` and write the profile files."""
+    seconds = max(1.0, min(float(seconds), PROFILE_MAX_SECONDS))
+    async with _profile_lock:
+        logger.info(f"Profiling for {seconds:.0f}s every {PROFILE_INTERVAL_MS}ms")
+        sampler = _Sampler(PROFILE_INTERVAL_MS / 1000)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.to_thread(sampler.stop)
+        result = await asyncio.to_thread(_write, sampler, seconds)
+    logger.info(f"Profile written: {result.collapsed_path} ({result.samples} samples)")
+    return result
+
+
+def install_signal_handler():
+    """``kill -USR2 <pid>`` profiles the bot for ``SIGNAL_PROFILE_SECONDS``."""
+    if not hasattr(signal, "SIGUSR2"):
+        return
+    loop = asyncio.get_running_loop()
+
+    def _on_signal():
+        if is_running():
+            logger.info("SIGUSR2: a profile is already running")
+            return
+        loop.create_task(profile(SIGNAL_PROFILE_SECONDS))
+
+    loop.add_signal_handler(signal.SIGUSR2, _on_signal)
+
+
+def _watchdog(loop_thread: int):
+    """Log the loop thread's stack once per episode of blocking."""
+    threshold = LOOP_LAG_INTERVAL + LOOP_BLOCK_MS / 1000
+    reported = None
+    while True:
+        time.sleep(LOOP_BLOCK_MS / 2000)
+        beat = _heartbeat
+        stalled = time.monotonic() - beat
+        if stalled < threshold or reported == beat:
+            continue
+        reported = beat
+        frame = sys._current_frames().get(loop_thread)
+        if frame is None:
+            return
+        LOOP_BLOCKS.inc()
+        stack = "".join(traceback.format_stack(frame)[-12:])
+        logger.warning(f"Event loop blocked for {(stalled - LOOP_LAG_INTERVAL) * 1000:.0f}+ ms in:\n{stack}")
+
+
+async def monitor():
+    """Background task: measure loop lag and start the blocking watchdog."""
+    global _heartbeat
+    loop = asyncio.get_running_loop()
+    if LOOP_BLOCK_MS > 0:
+        threading.Thread(target=_watchdog, args=(threading.get_ident(),),
+                         name="loop-watchdog", daemon=True).start()
+    while True:
+        start = loop.time()
+        _heartbeat = time.monotonic()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = loop.time() - start - LOOP_LAG_INTERVAL
+        LOOP_LAG.observe(lag)
+        if LOOP_BLOCK_MS and lag * 1000 > LOOP_BLOCK_MS:
+            logger.warning(f"Event loop lag: {lag * 1000:.0f} ms")
@@ -0,0 +1,284 @@
+"""
+Token-bucket rate limiting, so one chat pasting links in a loop cannot
+starve everyone else.
+
+- ``RateLimitMiddleware`` (aiogram) charges one token per link, from each
+  of the sender's user bucket, the chat bucket and the bucket of the link's
+  platform. Each callback query (a format button, "Convert to MP3"...)
+  costs one token from the user and chat buckets. Messages without links
+  pass for free.
+- ``expensive(op)`` charges the current user's budget for costly steps
+  (ffmpeg compression, Lightpanda pages, instaloader) and is awaited right
+  before them; ``prepay(op)`` charges it ahead, before the download that
+  leads to the step. A job waiting for budget gives up its job slot
+  meanwhile (``bind_slot``). With several workers the budget lives in the
+  job queue database (``share_budget``), so it is per user, not per worker.
+
+When a bucket is empty a link waits for its tokens and the user is told
+once, if the wait is at most ``RATE_LIMIT_MAX_WAIT`` and
+``RATE_LIMIT_MODE=queue``; otherwise it is rejected with a notice. Buckets
+refill continuously, so a user within the limits never waits. Admins
+(``ADMIN_IDS``) are exempt.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from contextvars import ContextVar
+
+from aiogram import BaseMiddleware, types
+
+import metrics
+import url_classifier
+import webhook
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("true", "1", "yes", "on")
+# "queue": over-limit links wait for their turn (up to RATE_LIMIT_MAX_WAIT); "reject": dropped
+RATE_LIMIT_MODE = os.getenv("RATE_LIMIT_MODE", "queue").strip().lower()
+RATE_LIMIT_MAX_WAIT = int(os.getenv("RATE_LIMIT_MAX_WAIT", "60"))
+RATE_USER_PER_MIN = int(os.getenv("RATE_USER_PER_MIN", "6"))
+RATE_USER_BURST = int(os.getenv("RATE_USER_BURST", "10"))
+RATE_CHAT_PER_MIN = int(os.getenv("RATE_CHAT_PER_MIN", "20"))
+RATE_CHAT_BURST = int(os.getenv("RATE_CHAT_BURST", "30"))
+RATE_PLATFORM_PER_MIN = int(os.getenv("RATE_PLATFORM_PER_MIN", "60"))
+RATE_PLATFORM_BURST = int(os.getenv("RATE_PLATFORM_BURST", "60"))
+RATE_EXPENSIVE_PER_HOUR = int(os.getenv("RATE_EXPENSIVE_PER_HOUR", "30"))
+RATE_EXPENSIVE_BURST = int(os.getenv("RATE_EXPENSIVE_BURST", "10"))
+
+# Seconds between two "slow down" notices to the same user
+NOTICE_INTERVAL = 30
+# Idle (full) buckets are dropped once there are this many
+MAX_BUCKETS = 4096
+
+LIMITED = metrics.Counter("bot_rate_limited_total", "Requests held back by rate limits, by bucket and action",
+                          ("scope", "action"))
+
+_user: ContextVar[int | None] = ContextVar("rate_limit_user", default=None)
+# Releases the caller's job slot while ``expensive()`` waits (see ``bind_slot``)
+_slot: ContextVar = ContextVar("rate_limit_slot", default=None)
+# Operations already charged by ``prepay()`` in this context
+_prepaid: ContextVar[frozenset] = ContextVar("rate_limit_prepaid", default=frozenset())
+# ``job_queue.take_budget`` when the expensive budget is shared between processes
+_shared_take = None
+
+
+class RateLimited(Exception):
+    """An expensive operation ran out of budget (its message is user-facing)."""
+
+
+class TokenBucket:
+    """``capacity`` tokens, refilled at ``rate`` per second.
+
+    Taking more than is available leaves the bucket in debt, which later
+    takers wait out; that is how queued requests keep their order.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self, cost: float, now: float) -> float:
+        """Seconds until ``cost`` tokens are available."""
+        self._refill(now)
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+    def take(self, cost: float, now: float):
+        self._refill(now)
+        self.tokens -= cost
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+_LIMITS = {
+    "user": (RATE_USER_PER_MIN / 60, RATE_USER_BURST),
+    "chat": (RATE_CHAT_PER_MIN / 60, RATE_CHAT_BURST),
+    "platform": (RATE_PLATFORM_PER_MIN / 60, RATE_PLATFORM_BURST),
+    "expensive": (RATE_EXPENSIVE_PER_HOUR / 3600, RATE_EXPENSIVE_BURST),
+}
+_buckets: dict[tuple[str, object], TokenBucket] = {}
+
+
+def _bucket(scope: str, key) -> TokenBucket:
+    bucket = _buckets.get((scope, key))
+    if bucket is None:
+        if len(_buckets) >= MAX_BUCKETS:
+            now = time.monotonic()
+            for k in [k for k, b in _buckets.items() if b.idle(now)]:
+                del _buckets[k]
+        bucket = _buckets[(scope, key)] = TokenBucket(*_LIMITS[scope])
+    return bucket
+
+
+def reserve(charges: list[tuple[str, object, float]], max_wait: float) -> tuple[float, str | None]:
+    """Charge ``(scope, key, cost)`` to every bucket if the longest wait is
+    at most ``max_wait``. Returns ``(wait, limiting scope)``; nothing is
+    charged when the wait is over ``max_wait``.
+    """
+    now = time.monotonic()
+    wait, scope = 0.0, None
+    for s, key, cost in charges:
+        d = _bucket(s, key).delay(cost, now)
+        if d > wait:
+            wait, scope = d, s
+    if wait <= max_wait:
+        for s, key, cost in charges:
+            _bucket(s, key).take(cost, now)
+    return wait, scope
+
+
+def bind_user(user_id: int | None):
+    """Charge later ``expensive()`` calls in this context to ``user_id``."""
+    _user.set(user_id)
+
+
+def current_user() -> int | None:
+    return _user.get()
+
+
+def bind_slot(release):
+    """While ``expensive()`` waits in this context, hold ``release()`` (an
+    async context manager that gives up the job slot and takes it back).
+    Returns the token to reset the binding with ``unbind_slot``."""
+    return _slot.set(release)
+
+
+def unbind_slot(token):
+    _slot.reset(token)
+
+
+def share_budget(take):
+    """Charge the expensive budget through ``take`` (``job_queue.take_budget``)
+    instead of this process's buckets, so N workers don't grant N budgets."""
+    global _shared_take
+    _shared_take = take
+
+
+async def expensive(op: str):
+    """Take one token of the current user's budget for ``op``, waiting for
+    it if allowed; raises ``RateLimited`` otherwise. No-op outside a user's
+    request (or with rate limiting disabled), and when ``prepay(op)``
+    already paid for it."""
+    prepaid = _prepaid.get()
+    if op in prepaid:
+        _prepaid.set(prepaid - {op})
+        return
+    user_id = _user.get()
+    if not RATE_LIMIT_ENABLED or user_id is None:
+        return
+    max_wait = RATE_LIMIT_MAX_WAIT if RATE_LIMIT_MODE == "queue" else 0
+    if _shared_take is not None:
+        wait = await _shared_take(f"expensive:{user_id}", *_LIMITS["expensive"], 1, max_wait)
+    else:
+        wait, _scope = reserve([("expensive", user_id, 1)], max_wait)
+    if wait > max_wait:
+        LIMITED.inc(scope="expensive", action="rejected")
+        logger.info(f"Rate limit: {op} rejected for user {user_id} (budget back in {wait:.0f}s)")
+        raise RateLimited(f"Límite de procesamiento alcanzado, probá de nuevo en {math.ceil(wait)}s")
+    if wait > 0:
+        LIMITED.inc(scope="expensive", action="queued")
+        logger.info(f"Rate limit: {op} for user {user_id} waits {wait:.1f}s")
+        release = _slot.get()
+        if release is None:
+            await asyncio.sleep(wait)
+        else:
+            # Other jobs can use the slot meanwhile
+            async with release():
+                await asyncio.sleep(wait)
+
+
+async def prepay(op: str):
+    """``expensive(op)`` now, for a step that comes later in this context
+    (e.g. compression once the download is done), so running out of budget
+    fails the job before any work is spent on it."""
+    await expensive(op)
+    _prepaid.set(_prepaid.get() | {op})
+
+
+async def _delete_later(message: types.Message, delay: float):
+    await asyncio.sleep(delay)
+    try:
+        await message.delete()
+    except Exception:
+        pass
+
+
+class RateLimitMiddleware(BaseMiddleware):
+    """Inner middleware for ``dp.message`` and ``dp.callback_query``."""
+
+    def __init__(self, exempt: set[int] = frozenset(), max_links: int = 5):
+        self.exempt = exempt
+        self.max_links = max_links
+        self._notified: dict[int, float] = {}
+
+    def _should_notify(self, user_id: int) -> bool:
+        now = time.monotonic()
+        if now - self._notified.get(user_id, 0) < NOTICE_INTERVAL:
+            return False
+        if len(self._notified) >= MAX_BUCKETS:
+            self._notified.clear()
+        self._notified[user_id] = now
+        return True
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        bind_user(user.id if user else None)
+        if not RATE_LIMIT_ENABLED or user is None or user.id in self.exempt:
+            return await handler(event, data)
+
+        chat_id = chat.id if chat else user.id
+        if isinstance(event, types.Message):
+            urls = url_classifier.extract_urls(event.text or "")[:self.max_links]
+            if not urls:
+                return await handler(event, data)
+            charges = [("user", user.id, len(urls)), ("chat", chat_id, len(urls))]
+            for url in urls:
+                charges.append(("platform", url_classifier.classify(url).platform, 1))
+            # Queueing a button press would outlive the callback query
+            max_wait = RATE_LIMIT_MAX_WAIT if RATE_LIMIT_MODE == "queue" else 0
+        else:
+            charges = [("user", user.id, 1), ("chat", chat_id, 1)]
+            max_wait = 0
+
+        wait, scope = reserve(charges, max_wait)
+        if wait == 0:
+            return await handler(event, data)
+
+        seconds = math.ceil(wait)
+        if wait > max_wait:
+            LIMITED.inc(scope=scope, action="rejected")
+            logger.info(f"Rate limit: rejected update from user {user.id} in chat {chat_id} ({scope}, {seconds}s)")
+            if isinstance(event, types.CallbackQuery):
+                await event.answer(f"🚫 Demasiadas solicitudes, probá en {seconds}s", show_alert=True)
+            elif self._should_notify(user.id):
+                notice = await event.reply(f"🚫 Demasiados links seguidos, probá de nuevo en {seconds}s")
+                asyncio.create_task(_delete_later(notice, 15))
+            return None
+
+        LIMITED.inc(scope=scope, action="queued")
+        logger.info(f"Rate limit: update from user {user.id} in chat {chat_id} waits {wait:.1f}s ({scope})")
+        notice = None
+        if self._should_notify(user.id):
+            notice = await event.reply(f"🕓 Muchos links seguidos, arranco en {seconds}s")
+        # Waiting out the limit does not hold a webhook handler
+        webhook.detach()
+        await asyncio.sleep(wait)
+        if notice:
+            asyncio.create_task(_delete_later(notice, 0))
+        return await handler(event, data)
@@ -0,0 +1,197 @@
+"""
+Flood-control-aware outbound path for every Bot API request.
+
+``SendQueue`` is an aiogram request middleware, so it sees every call
+(``answer_video``, ``edit_text``, ``delete_message``...) whatever handler
+makes it:
+
+- A ``429 Too Many Requests`` (``TelegramRetryAfter``) blocks the chat for
+  ``retry_after`` seconds and the request is retried once the block lifts,
+  for up to ``SEND_RETRY_MAX_WAIT`` seconds of waiting in total, instead of
+  failing the whole job after the download is done.
+- While a chat is blocked, its requests queue up. When the block lifts
+  they are released in priority order (uploads, then other messages and
+  deletes, then status edits), first come first served within a priority.
+- A queued edit of a message is replaced by a newer edit of the same
+  message. Only the latest text is sent, and every caller gets its result.
+
+Requests that go to no chat (``answerCallbackQuery``, ``getMe``...) are
+only retried.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (EditMessageCaption, EditMessageReplyMarkup, EditMessageText, SendAnimation,
+                             SendAudio, SendDocument, SendMediaGroup, SendPhoto, SendVideo, SendVoice)
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Longest total flood wait a request sits out before its error is raised
+SEND_RETRY_MAX_WAIT = int(os.getenv("SEND_RETRY_MAX_WAIT", "600"))
+# After a block, the next queued request is released once the previous one
+# got its answer (a new 429 blocks the chat again) or after this many seconds
+RELEASE_GAP = 1.0
+
+UPLOAD, SEND, EDIT = 0, 1, 2
+_UPLOADS = (SendVideo, SendDocument, SendAudio, SendPhoto, SendMediaGroup, SendAnimation, SendVoice)
+_EDITS = (EditMessageText, EditMessageCaption, EditMessageReplyMarkup)
+
+RETRIES = metrics.Counter("bot_telegram_retries_total", "Bot API requests retried after a flood wait",
+                          ("method",))
+SUPERSEDED = metrics.Counter("bot_telegram_superseded_edits_total",
+                             "Queued message edits replaced by a newer edit before being sent")
+
+_seq = itertools.count()
+
+
+def _priority(method) -> int:
+    if isinstance(method, _UPLOADS):
+        return UPLOAD
+    if isinstance(method, _EDITS):
+        return EDIT
+    return SEND
+
+
+class _Chat:
+    """Flood state and waiting requests of one chat."""
+
+    def __init__(self):
+        self.blocked_until = 0.0
+        self.waiting: list[tuple[int, int, asyncio.Future]] = []
+        # (method class, message_id) -> latest queued edit
+        self.edits: dict[tuple, list] = {}
+        self.active = 0
+        self._releaser: asyncio.Task | None = None
+
+    def blocked(self) -> bool:
+        return time.monotonic() < self.blocked_until or bool(self.waiting)
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        if self._releaser is None or self._releaser.done():
+            self._releaser = asyncio.create_task(self._release())
+
+    async def turn(self, priority: int, seq: int) -> asyncio.Event | None:
+        """Return when this request may be sent. A queued request gets an
+        event to set once Telegram has answered it."""
+        if not self.blocked():
+            return None
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (priority, seq, future))
+        if self._releaser is None or self._releaser.done():
+            self._releaser = asyncio.create_task(self._release())
+        return await future
+
+    async def _release(self):
+        while self.waiting or time.monotonic() < self.blocked_until:
+            wait = self.blocked_until - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _priority, _seq, future = heapq.heappop(self.waiting)
+            if future.done():
+                continue
+            answered = asyncio.Event()
+            future.set_result(answered)
+            try:
+                await asyncio.wait_for(answered.wait(), RELEASE_GAP)
+            except asyncio.TimeoutError:
+                pass
+
+    def idle(self) -> bool:
+        return not self.active and not self.waiting and not self.edits and time.monotonic() >= self.blocked_until
+
+
+class SendQueue(BaseRequestMiddleware):
+    """Per-chat flood handling for Bot API requests (see module docstring)."""
+
+    def __init__(self):
+        self._chats: dict[str, _Chat] = {}
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await self._send(make_request, bot, method, None, SEND, next(_seq))
+
+        key = str(chat_id)
+        chat = self._chats.get(key)
+        if chat is None:
+            chat = self._chats[key] = _Chat()
+        chat.active += 1
+        try:
+            priority = _priority(method)
+            message_id = getattr(method, "message_id", None)
+            if priority == EDIT and message_id is not None and chat.blocked():
+                return await self._edit_later(make_request, bot, method, chat, (type(method), message_id))
+            return await self._send(make_request, bot, method, chat, priority, next(_seq))
+        finally:
+            chat.active -= 1
+            if chat.idle():
+                self._chats.pop(key, None)
+
+    async def _edit_later(self, make_request, bot, method, chat: _Chat, edit_key: tuple):
+        """Queue an edit while the chat is blocked; a newer edit of the same
+        message replaces it and both callers get the newer edit's result."""
+        pending = chat.edits.get(edit_key)
+        if pending is not None:
+            SUPERSEDED.inc()
+            pending[0] = method
+            return await asyncio.shield(pending[1])
+
+        pending = chat.edits[edit_key] = [method, asyncio.get_running_loop().create_future()]
+        future = pending[1]
+        seq = next(_seq)
+        try:
+            try:
+                answered = await chat.turn(EDIT, seq)
+            finally:
+                # Newer edits from here on are sent on their own
+                chat.edits.pop(edit_key, None)
+            result = await self._send(make_request, bot, pending[0], chat, EDIT, seq, queued=answered)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # retrieved, even when no newer edit waits on it
+            raise
+        future.set_result(result)
+        return result
+
+    async def _send(self, make_request, bot, method, chat: _Chat | None, priority: int, seq: int,
+                    queued: asyncio.Event | None = None):
+        """Send, sitting out flood waits; ``queued`` is the event of a turn
+        already taken."""
+        waited = 0.0
+        while True:
+            answered = queued
+            if chat is not None and answered is None:
+                answered = await chat.turn(priority, seq)
+            queued = None
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                name = type(method).__name__
+                if waited + e.retry_after > SEND_RETRY_MAX_WAIT:
+                    logger.error(f"{name}: flood wait of {e.retry_after}s exceeds the retry budget, giving up")
+                    raise
+                waited += e.retry_after
+                RETRIES.inc(method=name)
+                logger.warning(f"{name} to chat {getattr(method, 'chat_id', '-')}: flood control, "
+                               f"retrying in {e.retry_after}s")
+                if chat is not None:
+                    chat.block(e.retry_after)
+                else:
+                    await asyncio.sleep(e.retry_after)
+            finally:
+                if answered is not None:
+                    answered.set()
@@ -0,0 +1,126 @@
+"""
+Pre-download size planning for yt-dlp videos.
+
+Before downloading, estimate how big the selected format will be (from
+``filesize``/``filesize_approx``/``tbr`` × duration) and decide:
+
+- ``SEND``: it fits the upload limit, or another rendition does (e.g. a
+  lower-resolution h264 file instead of re-encoding the 1080p one);
+- ``COMPRESS``: nothing fits; download a source no larger than what
+  ``compress_video`` outputs anyway (720p) and compress right after.
+
+Plans work on the cached info dict (``ydl_info``) and are synchronous;
+run them via ``asyncio.to_thread``.
+"""
+
+import logging
+from typing import NamedTuple
+
+import yt_dlp
+from yt_dlp.utils import filesize_from_tbr
+
+logger = logging.getLogger(__name__)
+
+SEND = "send"
+COMPRESS = "compress"
+
+# Bitrate-based estimates are approximate: only trust a fit with headroom
+ESTIMATE_MARGIN = 0.9
+# compress_video never outputs more than 720p; a bigger source is wasted
+COMPRESS_SOURCE_MAX_HEIGHT = 720
+
+
+class SizePlan(NamedTuple):
+    action: str
+    format: str | None      # format spec to download instead, None = keep
+    estimate: int | None    # bytes
+
+
+def estimate_size(fmt: dict, duration: float | None) -> int | None:
+    """Estimated bytes of ``fmt`` (sum of parts for merged formats)."""
+    parts = fmt.get('requested_formats')
+    if parts:
+        sizes = [estimate_size(part, duration) for part in parts]
+        return None if None in sizes else sum(sizes)
+    return (fmt.get('filesize') or fmt.get('filesize_approx')
+            or filesize_from_tbr(fmt.get('tbr'), duration))
+
+
+def _select(formats: list[dict], spec: str) -> dict | None:
+    """The format yt-dlp would download for ``spec``."""
+    with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
+        selector = ydl.build_format_selector(spec)
+        chosen = list(selector({
+            'formats': formats,
+            'has_merged_format': any('none' not in (f.get('acodec'), f.get('vcodec')) for f in formats),
+            'incomplete_formats': (all(f.get('vcodec') == 'none' for f in formats)
+                                   or all(f.get('acodec') == 'none' for f in formats)),
+        }))
+    return chosen[-1] if chosen else None
+
+
+def _is_h264(fmt: dict) -> bool:
+    return (fmt.get('vcodec') or '').startswith(('avc1', 'h264'))
+
+
+def _renditions(formats: list[dict], duration: float | None, allow_merge: bool):
+    """``(spec, video_format, estimated_bytes)`` for every playable rendition."""
+    muxed = [f for f in formats if f.get('vcodec') != 'none' and f.get('acodec') != 'none']
+    for f in muxed:
+        yield f['format_id'], f, estimate_size(f, duration)
+
+    if not allow_merge:
+        return
+    audios = [f for f in formats if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')]
+    if not audios:
+        return
+    audio = max(audios, key=lambda f: f.get('abr') or f.get('tbr') or 0)
+    audio_size = estimate_size(audio, duration)
+    for f in formats:
+        if f.get('acodec') == 'none' and f.get('vcodec') not in (None, 'none'):
+            size = estimate_size(f, duration)
+            total = None if size is None or audio_size is None else size + audio_size
+            yield f"{f['format_id']}+{audio['format_id']}", f, total
+
+
+def _best(candidates):
+    # Prefer h264 (plays everywhere, no re-encode later), then resolution
+    return max(candidates, key=lambda c: (_is_h264(c[1]), c[1].get('height') or 0, c[2] or 0), default=None)
+
+
+def plan(info: dict, spec: str, limit: int) -> SizePlan | None:
+    """
+    Plan the download of ``info`` with format ``spec`` under ``limit`` bytes.
+    Returns None when nothing can be estimated (decide after downloading).
+    """
+    formats = info.get('formats') or []
+    duration = info.get('duration')
+    if not formats:
+        return None
+    try:
+        chosen = _select(formats, spec)
+    except Exception as e:
+        logger.info(f"size plan: could not evaluate format {spec!r}: {e}")
+        return None
+    if not chosen:
+        return None
+
+    estimate = estimate_size(chosen, duration)
+    if estimate is None:
+        return None
+    if estimate <= limit * ESTIMATE_MARGIN:
+        return SizePlan(SEND, None, estimate)
+
+    renditions = [r for r in _renditions(formats, duration, allow_merge='+' in spec) if r[2]]
+    fitting = _best(r for r in renditions if r[2] <= limit * ESTIMATE_MARGIN)
+    if fitting:
+        logger.info(f"size plan: {chosen.get('format_id')} ~{estimate // 1048576} MB exceeds limit, "
+                    f"using {fitting[0]} ({fitting[1].get('height')}p) ~{fitting[2] // 1048576} MB")
+        return SizePlan(SEND, fitting[0], fitting[2])
+
+    source = _best(r for r in renditions if (r[1].get('height') or 0) <= COMPRESS_SOURCE_MAX_HEIGHT)
+    if source and source[2] < estimate:
+        logger.info(f"size plan: nothing fits, compressing {source[0]} ~{source[2] // 1048576} MB "
+                    f"instead of {chosen.get('format_id')} ~{estimate // 1048576} MB")
+        return SizePlan(COMPRESS, source[0], source[2])
+    return SizePlan(COMPRESS, None, estimate)
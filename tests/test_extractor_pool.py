@@ -0,0 +1,45 @@
+from gallery_dl.extractor.common import Extractor
+from gallery_dl.extractor.message import Message
+
+import extractor_pool
+
+
+class _ChildExtractor(Extractor):
+    category = "pooltestchild"
+    subcategory = "file"
+    pattern = r"pooltestchild:(\w+)"
+
+    def items(self):
+        name = self.groups[0]
+        data = {"filename": name, "extension": "txt"}
+        yield Message.Directory, "", data
+        yield Message.Url, f"text:{name}", data
+
+
+class _ParentExtractor(Extractor):
+    category = "pooltestparent"
+    subcategory = "post"
+    pattern = r"pooltestparent:(\w+)"
+
+    def items(self):
+        data = {"_extractor": _ChildExtractor}
+        yield Message.Queue, f"pooltestchild:{self.groups[0]}", data
+
+
+def _run(url, target_dir):
+    job = extractor_pool._IsolatedDownloadJob(
+        _ParentExtractor.from_url(url) if url.startswith("pooltestparent:") else _ChildExtractor.from_url(url),
+        overrides={"base-directory": str(target_dir), "directory": ["."]})
+    return job.run()
+
+
+def test_direct_job_writes_to_target_dir(tmp_path):
+    assert _run("pooltestchild:direct", tmp_path) == 0
+    assert (tmp_path / "direct.txt").read_text() == "direct"
+
+
+def test_child_job_of_other_category_keeps_overrides(tmp_path):
+    # A reddit -> imgur style hand-off: the child job must still write
+    # into the parent job's directory
+    assert _run("pooltestparent:child", tmp_path) == 0
+    assert (tmp_path / "child.txt").read_text() == "child"
@@ -0,0 +1,126 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import http_download
+
+BODY = bytes(range(256)) * 400
+
+
+@pytest.fixture(autouse=True)
+def _fast_retries(monkeypatch):
+    async def no_backoff(attempt):
+        pass
+    monkeypatch.setattr(http_download, "_backoff", no_backoff)
+
+
+def _fetch(handler, path):
+    """Run ``http_download.fetch`` against ``handler`` on a local server."""
+    async def run():
+        app = web.Application()
+        app.router.add_get("/media", handler)
+        server = TestServer(app)
+        await server.start_server()
+        try:
+            return await http_download.fetch(str(server.make_url("/media")), str(path))
+        finally:
+            await server.close()
+    return asyncio.run(run())
+
+
+def _range(request) -> tuple[int, int | None] | None:
+    value = request.headers.get("Range")
+    if not value:
+        return None
+    start, _, end = value.removeprefix("bytes=").partition("-")
+    return int(start), int(end) if end else None
+
+
+async def _partial(request, data: bytes, start: int, end: int | None, total: int | None = None):
+    end = len(data) - 1 if end is None else end
+    return web.Response(status=206, body=data[start:end + 1], headers={
+        "Content-Range": f"bytes {start}-{end}/{total or len(data)}"})
+
+
+async def _drop_after(request, data: bytes, sent: int, headers: dict | None = None):
+    """Announce all of ``data`` but close the connection after ``sent`` bytes."""
+    resp = web.StreamResponse(headers={"Content-Length": str(len(data)), **(headers or {})})
+    await resp.prepare(request)
+    await resp.write(data[:sent])
+    request.transport.close()
+    return resp
+
+
+def test_dropped_body_resumes_with_range(tmp_path):
+    requests = []
+
+    async def handler(request):
+        requests.append(request.headers.get("Range"))
+        rng = _range(request)
+        if rng is None:
+            return await _drop_after(request, BODY, 40_000)
+        return await _partial(request, BODY, *rng)
+
+    path = tmp_path / "out.bin"
+    assert _fetch(handler, path) == len(BODY)
+    assert path.read_bytes() == BODY
+    assert requests[0] is None
+    assert requests[1] == "bytes=40000-"
+
+
+def test_ignored_ranges_fall_back_to_one_stream(tmp_path, monkeypatch):
+    monkeypatch.setattr(http_download, "DOWNLOAD_PARALLEL_MIN_MB", 0)
+    monkeypatch.setattr(http_download, "DOWNLOAD_SEGMENTS", 4)
+    requests = []
+
+    async def handler(request):
+        requests.append(request.headers.get("Range"))
+        # Advertises ranges, then sends the whole file to every request
+        return web.Response(body=BODY, headers={"Accept-Ranges": "bytes"})
+
+    path = tmp_path / "out.bin"
+    assert _fetch(handler, path) == len(BODY)
+    assert path.read_bytes() == BODY
+    assert any(r and r.startswith("bytes=") for r in requests)
+    assert requests[-1] is None
+
+
+def test_failing_segment_aborts_the_others(tmp_path, monkeypatch):
+    monkeypatch.setattr(http_download, "DOWNLOAD_PARALLEL_MIN_MB", 0)
+    monkeypatch.setattr(http_download, "DOWNLOAD_SEGMENTS", 4)
+
+    async def handler(request):
+        rng = _range(request)
+        if rng is None:
+            return web.Response(body=BODY, headers={"Accept-Ranges": "bytes"})
+        if rng[0] == 0:
+            return web.Response(status=500)
+        # The other ranges would take far longer than the test
+        await asyncio.sleep(30)
+        return await _partial(request, BODY, *rng)
+
+    path = tmp_path / "out.bin"
+    started = time.monotonic()
+    with pytest.raises(http_download.DownloadError, match="HTTP 500"):
+        _fetch(handler, path)
+    assert time.monotonic() - started < 10
+    assert not path.exists()
+
+
+def test_size_mismatch_raises(tmp_path):
+    # The file changed between requests: the resume carries more than announced
+    grown = BODY + b"extra"
+
+    async def handler(request):
+        rng = _range(request)
+        if rng is None:
+            return await _drop_after(request, BODY, 40_000)
+        return await _partial(request, grown, *rng)
+
+    path = tmp_path / "out.bin"
+    with pytest.raises(http_download.DownloadError, match="size mismatch"):
+        _fetch(handler, path)
+    assert not path.exists()
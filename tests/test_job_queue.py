@@ -0,0 +1,84 @@
+import pytest
+
+import job_queue
+
+
+@pytest.fixture(autouse=True)
+def _queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "QUEUE_PATH", str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(job_queue, "_conn", None)
+    monkeypatch.setattr(job_queue, "MAX_ATTEMPTS", 2)
+    yield
+    if job_queue._conn is not None:
+        job_queue._conn.close()
+
+
+def _submit(kind="url", payload=None) -> int:
+    return job_queue._run(job_queue._submit, kind, payload or {}, None, None)
+
+
+def _claim(worker):
+    return job_queue._run(job_queue._claim, worker)
+
+
+def _row(job_id):
+    return job_queue._run(lambda conn: conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+
+def _expire_lease(job_id):
+    job_queue._run(lambda conn: conn.execute("UPDATE jobs SET lease_until = 0 WHERE id = ?", (job_id,)))
+
+
+def test_jobs_are_claimed_once_in_order():
+    first, second = _submit(payload={"n": 1}), _submit(payload={"n": 2})
+    a, b = _claim("w1"), _claim("w2")
+    assert (a.id, a.payload, a.state, a.attempts) == (first, {"n": 1}, "running", 1)
+    assert b.id == second
+    assert _claim("w3") is None
+
+
+def test_renewed_lease_keeps_the_job():
+    job_id = _submit()
+    _claim("w1")
+    _expire_lease(job_id)
+    job_queue._run(job_queue._renew, job_id, "w1")
+    assert _claim("w2") is None
+    assert _row(job_id)["worker"] == "w1"
+
+
+def test_expired_lease_goes_back_to_the_queue():
+    job_id = _submit()
+    _claim("w1")
+    _expire_lease(job_id)
+    job = _claim("w2")
+    assert (job.id, job.attempts) == (job_id, 2)
+    # The lost worker finishing late doesn't override the new run
+    job_queue._run(job_queue._finish, job_id, "w1", None, None)
+    assert _row(job_id)["state"] == "running"
+    job_queue._run(job_queue._finish, job_id, "w2", None, None)
+    assert _row(job_id)["state"] == "done"
+
+
+def test_expired_lease_after_max_attempts_fails():
+    job_id = _submit()
+    for worker in ("w1", "w2"):
+        assert _claim(worker).id == job_id
+        _expire_lease(job_id)
+    assert _claim("w3") is None
+    row = _row(job_id)
+    assert (row["state"], row["error"]) == ("failed", "worker lost")
+
+
+def test_unclaimed_job_fails_only_when_nothing_runs(monkeypatch):
+    monkeypatch.setattr(job_queue, "MAX_QUEUED_SECONDS", 60)
+    running, waiting = _submit(), _submit()
+    _claim("w1")
+    job_queue._run(lambda conn: conn.execute("UPDATE jobs SET created = 0"))
+    # A busy worker: the queued job is a backlog, not lost
+    job_queue._run(job_queue._states, [waiting])
+    assert _row(waiting)["state"] == "queued"
+
+    job_queue._run(job_queue._finish, running, "w1", None, None)
+    job_queue._run(job_queue._states, [waiting])
+    row = _row(waiting)
+    assert (row["state"], row["error"]) == ("failed", job_queue.NOT_CLAIMED)
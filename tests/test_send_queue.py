@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText, SendMessage, SendVideo
+
+import send_queue
+
+CHAT = 42
+
+
+@pytest.fixture(autouse=True)
+def _short_gap(monkeypatch):
+    monkeypatch.setattr(send_queue, "RELEASE_GAP", 0.05)
+
+
+class _Telegram:
+    """``make_request`` stand-in: answers 429 to the first ``flood`` calls
+    and records every request it sends."""
+
+    def __init__(self, flood: int = 1):
+        self.flood = flood
+        self.sent = []
+
+    async def __call__(self, bot, method):
+        if self.flood:
+            self.flood -= 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=1)
+        self.sent.append(method)
+        return f"ok:{getattr(method, 'text', None) or type(method).__name__}"
+
+
+def _label(method) -> str:
+    return getattr(method, "text", None) or type(method).__name__
+
+
+async def _flooded(queue, telegram, first, later):
+    """Send ``first`` into a flood wait, then ``later`` in order while the
+    chat is blocked; returns every result."""
+    tasks = [asyncio.create_task(queue(telegram, None, first))]
+    await asyncio.sleep(0.01)
+    for method in later:
+        tasks.append(asyncio.create_task(queue(telegram, None, method)))
+        await asyncio.sleep(0.01)
+    return await asyncio.gather(*tasks)
+
+
+def test_blocked_chat_releases_by_priority():
+    queue, telegram = send_queue.SendQueue(), _Telegram()
+    later = [
+        EditMessageText(chat_id=CHAT, message_id=5, text="edit"),
+        SendMessage(chat_id=CHAT, text="second"),
+        SendVideo(chat_id=CHAT, video="file-id"),
+    ]
+    results = asyncio.run(_flooded(queue, telegram, SendMessage(chat_id=CHAT, text="first"), later))
+
+    # Uploads first, then messages in arrival order (the flooded one kept
+    # its place), then status edits
+    assert [_label(m) for m in telegram.sent] == ["SendVideo", "first", "second", "edit"]
+    assert results == ["ok:first", "ok:edit", "ok:second", "ok:SendVideo"]
+    assert not queue._chats
+
+
+def test_queued_edit_is_superseded_by_newer_one():
+    queue, telegram = send_queue.SendQueue(), _Telegram()
+    later = [
+        EditMessageText(chat_id=CHAT, message_id=5, text="10%"),
+        EditMessageText(chat_id=CHAT, message_id=6, text="other"),
+        EditMessageText(chat_id=CHAT, message_id=5, text="50%"),
+        EditMessageText(chat_id=CHAT, message_id=5, text="90%"),
+    ]
+    results = asyncio.run(_flooded(queue, telegram, SendMessage(chat_id=CHAT, text="first"), later))
+
+    assert [_label(m) for m in telegram.sent] == ["first", "90%", "other"]
+    # Every caller of message 5 gets the result of the edit that was sent
+    assert results == ["ok:first", "ok:90%", "ok:other", "ok:90%", "ok:90%"]
+
+
+def test_requests_without_chat_are_retried():
+    queue, telegram = send_queue.SendQueue(), _Telegram(flood=1)
+
+    class _NoChat:
+        text = "me"
+
+    assert asyncio.run(queue(telegram, None, _NoChat())) == "ok:me"
+    assert len(telegram.sent) == 1
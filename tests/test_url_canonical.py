@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+import url_canonical
+
+
+@pytest.mark.parametrize("url, expected", [
+    # Video URLs collapse to watch?v=<id>
+    ("https://youtu.be/dQw4w9WgXcQ?si=abc", "https://www.youtube.com/watch?v=dQw4w9WgXcQ"),
+    ("https://m.youtube.com/watch?v=dQw4w9WgXcQ&list=PL1&t=3", "https://www.youtube.com/watch?v=dQw4w9WgXcQ"),
+    # Playlists and other pages without a video id keep their query
+    ("https://www.youtube.com/playlist?list=PL123&si=abc", "https://www.youtube.com/playlist?list=PL123"),
+    ("https://youtube.com/playlist?list=PL123", "https://www.youtube.com/playlist?list=PL123"),
+    ("https://m.youtube.com/results?search_query=cats", "https://www.youtube.com/results?search_query=cats"),
+    ("https://www.youtube.com/@someone/videos", "https://www.youtube.com/@someone/videos"),
+    # Unknown sites: scheme, port and credentials are part of the address
+    ("http://example.com/v.mp4?utm_source=x&b=1", "http://example.com/v.mp4?b=1"),
+    ("https://example.com:8443/v.mp4", "https://example.com:8443/v.mp4"),
+    ("https://example.com:443/v.mp4", "https://example.com/v.mp4"),
+    ("https://user:pw@example.com/v.mp4#t=1", "https://user:pw@example.com/v.mp4"),
+    ("http://[::1]:8080/v.mp4", "http://[::1]:8080/v.mp4"),
+    # Known platforms
+    ("https://instagram.com/p/C1aBcDeFgHi/?igsh=xyz", "https://www.instagram.com/p/C1aBcDeFgHi"),
+    ("https://redd.it/abc123", "https://www.reddit.com/comments/abc123"),
+])
+def test_normalize(url, expected):
+    assert url_canonical.normalize(url) == expected
+
+
+def test_playlists_get_distinct_keys():
+    first = asyncio.run(url_canonical.canonicalize("https://www.youtube.com/playlist?list=PL1", resolve=False))
+    second = asyncio.run(url_canonical.canonicalize("https://www.youtube.com/playlist?list=PL2", resolve=False))
+    assert first.key != second.key
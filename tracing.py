@@ -0,0 +1,279 @@
+"""
+Per-job tracing: where did the 90 seconds go?
+
+Every job (a link from ``handle_url`` or a callback button) runs inside
+``trace()``, which binds a trace to the current task through a
+ContextVar. ``span()``/``traced()`` record timed stages into it: backend
+attempts, ffprobe calls, each ``compress_video`` attempt and ffmpeg
+variant, and every Bot API request (``TelegramRequestTracing``). Spans
+opened outside a trace cost a ContextVar lookup and record nothing.
+
+Finished traces are appended to a rotating JSONL file
+(``logs/traces.jsonl``), kept in memory for ``/trace``, and exported to an
+OTLP/HTTP collector (JSON encoding) when ``OTLP_ENDPOINT`` is set.
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+import aiohttp
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE = os.path.join("logs", "traces.jsonl")
+TRACE_FILE_MB = int(os.getenv("TRACE_FILE_MB", "10"))
+TRACE_FILE_BACKUPS = 3
+# Finished traces kept in memory for /trace
+TRACE_KEEP = 200
+# e.g. http://otel-collector:4318 (spans are POSTed to /v1/traces)
+OTLP_ENDPOINT = os.getenv("OTLP_ENDPOINT", "").rstrip("/")
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "chinabici-bot")
+
+_trace: ContextVar["Trace | None"] = ContextVar("trace", default=None)
+_parent: ContextVar[str | None] = ContextVar("trace_parent", default=None)
+_recent: OrderedDict[str, dict] = OrderedDict()
+_file_logger: logging.Logger | None = None
+_export_tasks: set[asyncio.Task] = set()
+
+
+class Trace:
+    def __init__(self, name: str, attrs: dict):
+        self.trace_id = os.urandom(16).hex()
+        self.root_id = os.urandom(8).hex()
+        self.name = name
+        self.attrs = attrs
+        self.start_ns = time.time_ns()
+        self.spans: list[dict] = []
+        self.finished = False
+
+    def add(self, name: str, start_ns: int, end_ns: int, parent: str | None, attrs: dict,
+            error: str | None = None, span_id: str | None = None):
+        if self.finished:
+            # Late work of a task spawned by the job (e.g. delayed deletes)
+            return
+        self.spans.append({
+            "span_id": span_id or os.urandom(8).hex(),
+            "parent_id": parent or self.root_id,
+            "name": name,
+            "start_ns": start_ns,
+            "duration_ms": round((end_ns - start_ns) / 1e6, 1),
+            "attrs": attrs,
+            "error": error,
+        })
+
+
+def current_id() -> str | None:
+    """Short id of the running trace (what ``/trace`` accepts)."""
+    t = _trace.get()
+    return t.trace_id[:8] if t else None
+
+
+@asynccontextmanager
+async def trace(name: str, **attrs):
+    """Run the block as one traced job. Nested calls join the outer trace."""
+    if _trace.get() is not None:
+        yield _trace.get()
+        return
+    t = Trace(name, attrs)
+    token = _trace.set(t)
+    error = None
+    try:
+        yield t
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _trace.reset(token)
+        _finish(t, error)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time the block as a stage of the current trace (no-op outside one).
+
+    Yields the attribute dict, so results can be attached while it runs.
+    """
+    t = _trace.get()
+    if t is None:
+        yield attrs
+        return
+    span_id = os.urandom(8).hex()
+    parent = _parent.get()
+    token = _parent.set(span_id)
+    start = time.time_ns()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _parent.reset(token)
+        t.add(name, start, time.time_ns(), parent, attrs, error, span_id)
+
+
+def record(name: str, start_ns: int, end_ns: int, **attrs):
+    """Add an already-measured stage to the current trace."""
+    t = _trace.get()
+    if t is not None:
+        t.add(name, start_ns, end_ns, _parent.get(), attrs)
+
+
+def traced(name: str):
+    """Decorator: run a coroutine function inside ``span(name)``."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TelegramRequestTracing(BaseRequestMiddleware):
+    """One span per Bot API request made inside a trace."""
+
+    async def __call__(self, make_request, bot, method):
+        with span(f"tg.{type(method).__name__}"):
+            return await make_request(bot, method)
+
+
+def _summary(t: Trace, error: str | None) -> dict:
+    return {
+        "trace_id": t.trace_id,
+        "root_id": t.root_id,
+        "name": t.name,
+        "attrs": t.attrs,
+        "start_ns": t.start_ns,
+        "duration_ms": round((time.time_ns() - t.start_ns) / 1e6, 1),
+        "error": error,
+        "spans": t.spans,
+    }
+
+
+def _writer() -> logging.Logger:
+    global _file_logger
+    if _file_logger is None:
+        os.makedirs(os.path.dirname(TRACE_FILE), exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            TRACE_FILE, maxBytes=TRACE_FILE_MB * 1024 * 1024, backupCount=TRACE_FILE_BACKUPS)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _file_logger = logging.getLogger("tracing.file")
+        _file_logger.propagate = False
+        _file_logger.setLevel(logging.INFO)
+        _file_logger.addHandler(handler)
+    return _file_logger
+
+
+def _finish(t: Trace, error: str | None):
+    t.finished = True
+    done = _summary(t, error)
+    _recent[done["trace_id"]] = done
+    while len(_recent) > TRACE_KEEP:
+        _recent.popitem(last=False)
+    logger.info(f"Trace {t.trace_id[:8]} {t.name}: {done['duration_ms'] / 1000:.1f}s, "
+                f"{len(t.spans)} spans{f' ({error})' if error else ''}")
+    try:
+        _writer().info(json.dumps(done, ensure_ascii=False, default=str))
+    except OSError as e:
+        logger.warning(f"Could not write trace: {e}")
+    if OTLP_ENDPOINT:
+        task = asyncio.get_running_loop().create_task(_export(done))
+        _export_tasks.add(task)
+        task.add_done_callback(_export_tasks.discard)
+
+
+# ── OTLP/HTTP (JSON) export ──────────────────────────────────────────────
+
+def _otlp_attrs(attrs: dict) -> list[dict]:
+    out = []
+    for key, value in attrs.items():
+        if isinstance(value, bool):
+            v = {"boolValue": value}
+        elif isinstance(value, int):
+            v = {"intValue": str(value)}
+        elif isinstance(value, float):
+            v = {"doubleValue": value}
+        else:
+            v = {"stringValue": str(value)}
+        out.append({"key": key, "value": v})
+    return out
+
+
+def _otlp_span(trace_id, span_id, parent_id, name, start_ns, duration_ms, attrs, error) -> dict:
+    s = {
+        "traceId": trace_id,
+        "spanId": span_id,
+        "name": name,
+        "kind": 1,
+        "startTimeUnixNano": str(start_ns),
+        "endTimeUnixNano": str(start_ns + int(duration_ms * 1e6)),
+        "attributes": _otlp_attrs(attrs),
+        "status": {"code": 2, "message": error} if error else {"code": 1},
+    }
+    if parent_id:
+        s["parentSpanId"] = parent_id
+    return s
+
+
+async def _export(done: dict):
+    spans = [_otlp_span(done["trace_id"], done["root_id"], None, done["name"],
+                        done["start_ns"], done["duration_ms"], done["attrs"], done["error"])]
+    for s in done["spans"]:
+        spans.append(_otlp_span(done["trace_id"], s["span_id"], s["parent_id"], s["name"],
+                                s["start_ns"], s["duration_ms"], s["attrs"], s["error"]))
+    payload = {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attrs({"service.name": SERVICE_NAME})},
+        "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+    }]}
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{OTLP_ENDPOINT}/v1/traces", json=payload,
+                                    timeout=aiohttp.ClientTimeout(total=10)) as resp:
+                if resp.status >= 300:
+                    logger.warning(f"OTLP export HTTP {resp.status}")
+    except Exception as e:
+        logger.warning(f"OTLP export failed: {e}")
+
+
+# ── Lookup for /trace ────────────────────────────────────────────────────
+
+def recent(limit: int = 10) -> list[dict]:
+    """Most recent finished traces, newest first."""
+    return list(reversed(_recent.values()))[:limit]
+
+
+def _scan_files(prefix: str) -> dict | None:
+    paths = [TRACE_FILE] + [f"{TRACE_FILE}.{i}" for i in range(1, TRACE_FILE_BACKUPS + 1)]
+    for path in paths:
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if f'"trace_id": "{prefix}' in line:
+                        return json.loads(line)
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+async def find(prefix: str) -> dict | None:
+    """Finished trace whose id starts with ``prefix`` (memory, then the JSONL files)."""
+    prefix = prefix.lower()
+    for trace_id, done in reversed(_recent.items()):
+        if trace_id.startswith(prefix):
+            return done
+    return await asyncio.to_thread(_scan_files, prefix)
+
+
+def slowest(done: dict, limit: int = 10) -> list[dict]:
+    """The ``limit`` longest spans of a finished trace."""
+    return sorted(done["spans"], key=lambda s: s["duration_ms"], reverse=True)[:limit]
@@ -0,0 +1,198 @@
+"""
+URL canonicalization and short-link resolution.
+
+Turns the many spellings of the same media (share links, mobile hosts,
+tracking query parameters) into one canonical URL and a stable media key
+(``platform:media_id``) that caches and deduplication can rely on.
+Short links are resolved with a single HEAD request and the result is kept
+in a TTL cache, so each redirect is followed once, not once per backend.
+"""
+
+import logging
+import os
+from typing import NamedTuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import aiohttp
+
+import url_classifier
+from ttl_cache import TTLCache
+from url_classifier import Route, classify
+
+logger = logging.getLogger(__name__)
+
+RESOLVE_TTL = int(os.getenv("URL_RESOLVE_TTL_SECONDS", "21600"))
+RESOLVE_TIMEOUT = 8
+
+# Tracking parameters dropped from URLs of unknown sites (known platforms
+# use the allow-list below instead)
+TRACKING_PARAMS = frozenset({
+    "fbclid", "gclid", "igsh", "igshid", "mibextid", "si",
+    "ref_src", "ref_url", "_t", "_r", "share_id",
+})
+TRACKING_PREFIXES = ("utm_", "__cft__", "__tn__")
+
+# Query parameters that DO identify the media, per platform (everything
+# else is dropped for these platforms). YouTube video URLs are rebuilt from
+# their id above; the rest (playlists, channels, search) only lose their
+# tracking parameters.
+_KEEP_PARAMS = {
+    url_classifier.FACEBOOK: {"v", "story_fbid", "fbid", "id", "set"},
+    url_classifier.TIKTOK: set(),
+    url_classifier.INSTAGRAM: set(),
+    url_classifier.TWITTER: set(),
+    url_classifier.REDDIT: set(),
+}
+
+# Host aliases -> canonical host
+_HOST_ALIASES = {
+    "youtube.com": "www.youtube.com",
+    "m.youtube.com": "www.youtube.com",
+    "music.youtube.com": "www.youtube.com",
+    "facebook.com": "www.facebook.com",
+    "m.facebook.com": "www.facebook.com",
+    "web.facebook.com": "www.facebook.com",
+    "mbasic.facebook.com": "www.facebook.com",
+    "fb.com": "www.facebook.com",
+    "tiktok.com": "www.tiktok.com",
+    "m.tiktok.com": "www.tiktok.com",
+    "mobile.twitter.com": "twitter.com",
+    "mobile.x.com": "x.com",
+    "reddit.com": "www.reddit.com",
+    "old.reddit.com": "www.reddit.com",
+    "new.reddit.com": "www.reddit.com",
+    "np.reddit.com": "www.reddit.com",
+    "m.reddit.com": "www.reddit.com",
+    "instagram.com": "www.instagram.com",
+    "instagr.am": "www.instagram.com",
+}
+
+# Paths on redirecting hosts that lead to a login wall instead of the media
+_LOGIN_MARKERS = ("/login", "/checkpoint", "/accounts/login", "/signup")
+
+
+class CanonicalURL(NamedTuple):
+    """Canonical form of a user-supplied URL."""
+    url: str
+    route: Route
+    original: str
+
+    @property
+    def key(self) -> str:
+        """Stable media key: ``platform:media_id``, or ``url:<canonical url>``."""
+        if self.route.media_id:
+            return f"{self.route.platform}:{self.route.media_id}"
+        return f"url:{self.url}"
+
+
+_resolved = TTLCache(ttl=RESOLVE_TTL, maxsize=4096)
+
+
+def _needs_redirect(route: Route, path: str) -> bool:
+    """Short/share links whose media id is only known after a redirect."""
+    host = route.host
+    if host in ("vm.tiktok.com", "vt.tiktok.com", "fb.watch", "t.co"):
+        return True
+    if route.platform == url_classifier.TIKTOK and path.startswith("/t/"):
+        return True
+    # Video share links; image share links (/share/p/) are kept as-is since
+    # the image scraper works on the share URL itself.
+    if route.platform == url_classifier.FACEBOOK and path.startswith(("/share/r/", "/share/v/")):
+        return True
+    if route.platform == url_classifier.REDDIT and "/s/" in path:
+        return True
+    return False
+
+
+def normalize(url: str) -> str:
+    """Offline normalization: canonical host, no fragment, no tracking params."""
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url
+    route = classify(url)
+    host = (parts.hostname or "").lower()
+    host = _HOST_ALIASES.get(host.removeprefix("www."), host)
+
+    # youtu.be/<id> and /shorts/<id> -> watch?v=<id>
+    if route.platform == url_classifier.YOUTUBE and route.media_id:
+        return f"https://www.youtube.com/watch?v={route.media_id}"
+    # redd.it/<id> -> /comments/<id>
+    if route.platform == url_classifier.REDDIT and route.host == "redd.it" and route.media_id:
+        return f"https://www.reddit.com/comments/{route.media_id}"
+
+    keep = _KEEP_PARAMS.get(route.platform)
+    query = []
+    for k, v in parse_qsl(parts.query, keep_blank_values=True):
+        if keep is not None:
+            if k in keep:
+                query.append((k, v))
+        elif k not in TRACKING_PARAMS and not k.startswith(TRACKING_PREFIXES):
+            query.append((k, v))
+
+    path = parts.path or "/"
+    scheme = "https"
+    if route.platform != url_classifier.OTHER:
+        path = path.rstrip("/") or "/"
+    elif parts.scheme == "http":
+        # Unknown sites may not serve TLS at all
+        scheme = "http"
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if ":" in host:
+        host = f"[{host}]"
+    if port and port != {"http": 80, "https": 443}[scheme]:
+        host = f"{host}:{port}"
+    if route.platform == url_classifier.OTHER and "@" in parts.netloc:
+        # Credentials of unknown sites are part of the address
+        host = f"{parts.netloc.rpartition('@')[0]}@{host}"
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+
+async def _resolve_redirect(url: str) -> str | None:
+    """Follow redirects with HEAD only; returns the final URL or None."""
+    try:
+        async with aiohttp.ClientSession(headers={"User-Agent": "Mozilla/5.0"}) as session:
+            async with session.head(
+                url, allow_redirects=True,
+                timeout=aiohttp.ClientTimeout(total=RESOLVE_TIMEOUT)
+            ) as resp:
+                final = str(resp.url)
+        if final == url:
+            return None
+        logger.info(f"Resolved short link {url} -> {final[:120]}")
+        return final
+    except Exception as e:
+        logger.warning(f"Short link resolution failed for {url}: {e}")
+        return None
+
+
+async def canonicalize(url: str, resolve: bool = True) -> CanonicalURL:
+    """
+    Canonicalize ``url``: normalize it offline and, for short/share links,
+    follow the redirect once (cached for ``URL_RESOLVE_TTL_SECONDS``).
+
+    Falls back to the normalized original when resolution fails, lands on a
+    login wall, or leaves the platform (except for ``t.co``, which wraps
+    arbitrary links).
+    """
+    route = classify(url)
+    canonical = normalize(url)
+
+    if resolve:
+        try:
+            path = urlsplit(url).path or "/"
+        except ValueError:
+            path = "/"
+        if _needs_redirect(route, path):
+            final = await _resolved.get_or_load(canonical, lambda: _resolve_redirect(canonical))
+            if final:
+                final_route = classify(final)
+                same_platform = route.host == "t.co" or final_route.platform == route.platform
+                login_wall = any(m in final for m in _LOGIN_MARKERS)
+                if same_platform and not login_wall:
+                    canonical = normalize(final)
+
+    return CanonicalURL(url=canonical, route=classify(canonical), original=url)
@@ -0,0 +1,156 @@
+"""
+Single-pass URL classifier.
+
+Parses the host once, resolves the platform through a precompiled
+host-suffix table (label-boundary matches only, so ``t.co`` never matches
+``reddit.com`` and ``x.com`` never matches ``netflix.com``), then applies
+the platform's path rules to get a typed route.
+"""
+
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+# Platforms
+YOUTUBE = "youtube"
+FACEBOOK = "facebook"
+TIKTOK = "tiktok"
+REDDIT = "reddit"
+TWITTER = "twitter"
+INSTAGRAM = "instagram"
+OTHER = "other"
+
+# Media kinds
+VIDEO = "video"    # single video (reel, short, clip)
+POST = "post"      # image post / carousel, may fall back to video
+STORY = "story"    # Instagram story
+
+# Host suffix -> platform. Matched on whole labels from the right.
+_HOST_TABLE = {
+    "youtube.com": YOUTUBE,
+    "youtu.be": YOUTUBE,
+    "youtube-nocookie.com": YOUTUBE,
+    "facebook.com": FACEBOOK,
+    "fb.com": FACEBOOK,
+    "fb.watch": FACEBOOK,
+    "tiktok.com": TIKTOK,
+    "reddit.com": REDDIT,
+    "redd.it": REDDIT,
+    "twitter.com": TWITTER,
+    "x.com": TWITTER,
+    "t.co": TWITTER,
+    "instagram.com": INSTAGRAM,
+    "instagr.am": INSTAGRAM,
+}
+
+_FB_VIDEO_PATTERNS = ('/reel/', '/watch', '/videos/', '/video.php', 'story_fbid=', '/share/r/', '/share/v/')
+
+# Canonical id extractors per platform (first match wins)
+_ID_RULES = {
+    YOUTUBE: [
+        re.compile(r'[?&]v=([A-Za-z0-9_-]{6,})'),
+        re.compile(r'/(?:shorts|embed|live|v)/([A-Za-z0-9_-]{6,})'),
+    ],
+    FACEBOOK: [
+        re.compile(r'/(?:reel|videos)/(\d+)'),
+        re.compile(r'[?&](?:story_fbid|fbid|v)=(\d+)'),
+        re.compile(r'/posts/([A-Za-z0-9]+)'),
+        re.compile(r'/share/(?:[prv]/)?([A-Za-z0-9]+)'),
+    ],
+    TIKTOK: [re.compile(r'/(?:video|photo)/(\d+)')],
+    REDDIT: [re.compile(r'/comments/([a-z0-9]+)')],
+    TWITTER: [re.compile(r'/status(?:es)?/(\d+)')],
+    INSTAGRAM: [
+        re.compile(r'/(?:p|reel|reels|tv)/([A-Za-z0-9_-]+)'),
+        re.compile(r'/stories/[^/]+/(\d+)'),
+    ],
+}
+
+URL_PATTERN = re.compile(r'https?://[^\s]+')
+# scheme://[userinfo@]host[:port] path ?query  (fragment dropped)
+_SPLIT_PATTERN = re.compile(r'^[A-Za-z][A-Za-z0-9+.-]*://(?:[^/?#@]*@)?([^/?#:]*)(?::\d*)?([^?#]*)(?:\?([^#]*))?')
+
+
+class Route(NamedTuple):
+    """Result of classifying a URL."""
+    url: str
+    host: str
+    platform: str
+    kind: str
+    media_id: str | None = None
+
+
+def _platform_for_host(host: str) -> str:
+    # Walk suffixes on label boundaries: a.b.c.com -> b.c.com -> c.com -> com
+    while host:
+        platform = _HOST_TABLE.get(host)
+        if platform:
+            return platform
+        dot = host.find('.')
+        if dot < 0:
+            break
+        host = host[dot + 1:]
+    return OTHER
+
+
+def _kind_for(platform: str, host: str, path: str, query: str) -> str:
+    if platform == FACEBOOK:
+        if host == "fb.watch":
+            return VIDEO
+        target = f"{path}?{query}" if query else path
+        if any(p in target for p in _FB_VIDEO_PATTERNS):
+            return VIDEO
+        return POST
+    if platform == INSTAGRAM:
+        if '/stories/' in path or '/story/' in path:
+            return STORY
+        if '/reel/' in path or '/reels/' in path:
+            return VIDEO
+        return POST
+    if platform == REDDIT:
+        return POST
+    return VIDEO
+
+
+def _media_id_for(platform: str, host: str, path: str, query: str) -> str | None:
+    if platform == YOUTUBE and host == "youtu.be":
+        vid = path.strip('/').split('/', 1)[0]
+        return vid or None
+    if platform == REDDIT and host == "redd.it":
+        rid = path.strip('/').split('/', 1)[0]
+        return rid or None
+    target = f"{path}?{query}" if query else path
+    for rule in _ID_RULES.get(platform, ()):
+        m = rule.search(target)
+        if m:
+            return m.group(1)
+    return None
+
+
+@lru_cache(maxsize=4096)
+def classify(url: str) -> Route:
+    """Classify ``url`` in one pass: host lookup, then platform path rules."""
+    m = _SPLIT_PATTERN.match(url)
+    if not m:
+        return Route(url=url, host='', platform=OTHER, kind=VIDEO)
+    host = m.group(1).lower()
+    if host.startswith('www.'):
+        host = host[4:]
+
+    platform = _platform_for_host(host)
+    if platform == OTHER:
+        return Route(url=url, host=host, platform=OTHER, kind=VIDEO)
+
+    path, query = m.group(2) or '/', m.group(3) or ''
+    return Route(
+        url=url,
+        host=host,
+        platform=platform,
+        kind=_kind_for(platform, host, path, query),
+        media_id=_media_id_for(platform, host, path, query),
+    )
+
+
+def extract_urls(text: str) -> list[str]:
+    """All http(s) links in a message, in order."""
+    return URL_PATTERN.findall(text)
@@ -0,0 +1,141 @@
+"""
+Webhook intake: Telegram pushes updates to an aiohttp server instead of the
+bot long-polling ``getUpdates``.
+
+Enabled by ``WEBHOOK_URL`` (the public base URL the reverse proxy forwards
+to ``WEBHOOK_HOST:WEBHOOK_PORT``). Each update is acknowledged as soon as
+its body is read and handled in a background task, at most
+``WEBHOOK_MAX_HANDLERS`` at a time; the rest wait for a free handler
+without holding Telegram's connection. The limit is on intake: a handler
+that turns into a long-running job (a download, a wait for a worker, a
+rate-limit delay) calls ``detach()`` and frees its slot, so button
+presses and commands are not stuck behind pending links. Requests
+without the ``WEBHOOK_SECRET`` header are rejected.
+
+Replicas behind a load balancer all register the same URL and secret, and
+none removes the webhook on shutdown, so a rolling restart never drops
+intake. Button state must then be shared (``BOT_ROLE=frontend``, see
+``job_queue``). ``GET /healthz`` answers for load-balancer checks.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+from contextvars import ContextVar
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = "/" + os.getenv("WEBHOOK_PATH", "/webhook").strip("/")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Telegram only sends [A-Za-z0-9_-]{1,256}
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Updates handled concurrently by this process
+WEBHOOK_MAX_HANDLERS = int(os.getenv("WEBHOOK_MAX_HANDLERS", "32"))
+# Parallel connections Telegram opens to the webhook (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Seconds a stopping process waits for updates still being handled
+SHUTDOWN_GRACE = 30
+
+UPDATES = metrics.Gauge("bot_webhook_updates", "Acknowledged updates, by state (waiting, running)", ("state",))
+
+# Frees the handler slot of the update being handled (webhook mode only)
+_release_slot: ContextVar = ContextVar("webhook_release_slot", default=None)
+
+
+def detach():
+    """Give back the current update's handler slot: what follows is a
+    long-running job, limited elsewhere (``MAX_CONCURRENT_JOBS``...), not
+    intake. No-op outside webhook mode or when already detached."""
+    release = _release_slot.get()
+    if release is not None:
+        release()
+
+
+class _BoundedRequestHandler(SimpleRequestHandler):
+    """Acks at once; runs at most ``limit`` updates concurrently (until they ``detach``)."""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, limit: int, **kwargs):
+        super().__init__(dispatcher, bot, handle_in_background=True, **kwargs)
+        self._slots = asyncio.Semaphore(max(1, limit))
+
+    async def _background_feed_update(self, bot: Bot, update: dict):
+        UPDATES.inc(state="waiting")
+        try:
+            await self._slots.acquire()
+        finally:
+            UPDATES.dec(state="waiting")
+        UPDATES.inc(state="running")
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                UPDATES.dec(state="running")
+                self._slots.release()
+
+        _release_slot.set(release)
+        try:
+            await super()._background_feed_update(bot, update)
+        finally:
+            release()
+
+    async def close(self):
+        # The bot session is closed by main() once the process is done
+        pending = list(self._background_feed_update_tasks)
+        if pending:
+            logger.info(f"Webhook: waiting for {len(pending)} update(s) in progress")
+            await asyncio.wait(pending, timeout=SHUTDOWN_GRACE)
+
+
+async def _healthz(_request):
+    return web.Response(text="ok")
+
+
+async def serve(dp: Dispatcher, bot: Bot, **kwargs):
+    """Register the webhook and serve updates until SIGTERM/SIGINT."""
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET is not set: anyone who finds the webhook URL can post updates")
+
+    app = web.Application()
+    _BoundedRequestHandler(dp, bot, WEBHOOK_MAX_HANDLERS,
+                           secret_token=WEBHOOK_SECRET or None, **kwargs).register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/healthz", _healthz)
+    # Runs the dispatcher's startup/shutdown hooks like start_polling does
+    setup_application(app, dp, bot=bot, **kwargs)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+
+    await bot.set_webhook(
+        f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+    logger.info(f"Webhook {WEBHOOK_URL}{WEBHOOK_PATH} -> {WEBHOOK_HOST}:{WEBHOOK_PORT} "
+                f"({WEBHOOK_MAX_HANDLERS} concurrent handlers)")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    try:
+        await stop.wait()
+        logger.info("Webhook: stopping")
+    finally:
+        # Stop accepting, then let the updates in progress finish
+        await runner.cleanup()
@@ -0,0 +1,257 @@
+"""
+Per-job working directories under ``downloads/`` with a disk quota.
+
+Every download job runs inside ``job()``, which gives it a private
+``downloads/jobs/<label>_<random>`` directory (bound to the current task
+through a ContextVar, read with ``current_dir()``) and removes it when the
+job ends. Fixed file names from different jobs can no longer collide, and
+whatever a job leaves behind goes away with its directory.
+
+Admission control: a job is only started if the tree under ``downloads/``
+plus a per-job reservation stays under ``DISK_QUOTA_MB`` and the
+filesystem keeps ``DISK_MIN_FREE_MB`` free. Otherwise the job waits for
+space for up to ``DISK_ADMISSION_TIMEOUT_SECONDS`` and then ``DiskFull`` is
+raised.
+
+Leftovers of crashed runs are removed at startup; a background sweeper
+removes orphans on a timer and logs disk usage.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+ROOT = "downloads"
+JOBS_DIR = os.path.join(ROOT, "jobs")
+# Owned by audio_derive (recently sent videos); bounded by its own budget
+RECENT_DIR_NAME = "recent"
+
+DISK_QUOTA_MB = int(os.getenv("DISK_QUOTA_MB", "4096"))
+DISK_MIN_FREE_MB = int(os.getenv("DISK_MIN_FREE_MB", "1024"))
+# Space set aside for each running job when admitting a new one
+JOB_RESERVE_MB = int(os.getenv("JOB_RESERVE_MB", "200"))
+ADMISSION_TIMEOUT = int(os.getenv("DISK_ADMISSION_TIMEOUT_SECONDS", "120"))
+SWEEP_INTERVAL = int(os.getenv("DISK_SWEEP_INTERVAL_SECONDS", "600"))
+# Loose files in downloads/ older than this are considered orphans
+ORPHAN_MAX_AGE = 3600
+# A job dir this young may belong to a job that is still registering it
+JOB_DIR_GRACE = 60
+
+_MB = 1024 * 1024
+
+_current: ContextVar[str | None] = ContextVar("workspace", default=None)
+_active: dict[str, float] = {}
+_space_changed = asyncio.Condition()
+_waiting = 0
+stats = {
+    "admitted": 0,
+    "rejected": 0,
+    "waited": 0,
+    "swept_entries": 0,
+    "swept_bytes": 0,
+}
+
+
+class DiskFull(Exception):
+    """No disk budget for a new job within ``ADMISSION_TIMEOUT``."""
+
+
+def current_dir() -> str:
+    """Working directory of the running job (``downloads/`` outside jobs)."""
+    return _current.get() or ROOT
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _entry_size(path: str) -> int:
+    if os.path.isdir(path) and not os.path.islink(path):
+        return _tree_size(path)
+    try:
+        return os.lstat(path).st_size
+    except OSError:
+        return 0
+
+
+def _disk_state() -> tuple[int, int]:
+    """``(bytes used under downloads/, bytes free on its filesystem)``."""
+    return _tree_size(ROOT), shutil.disk_usage(ROOT).free
+
+
+def _fits(used: int, free: int) -> bool:
+    reserved = (len(_active) + 1) * JOB_RESERVE_MB * _MB
+    return used + reserved <= DISK_QUOTA_MB * _MB and free - reserved >= DISK_MIN_FREE_MB * _MB
+
+
+async def _admit(label: str):
+    global _waiting
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + ADMISSION_TIMEOUT
+    waited = False
+    async with _space_changed:
+        while True:
+            used, free = await asyncio.to_thread(_disk_state)
+            if _fits(used, free):
+                stats["admitted"] += 1
+                return
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                stats["rejected"] += 1
+                logger.error(f"Disk full, rejecting {label} job "
+                             f"(used {used // _MB} MB, free {free // _MB} MB, {len(_active)} active)")
+                raise DiskFull(f"used {used // _MB} MB of {DISK_QUOTA_MB} MB")
+            if not waited:
+                waited = True
+                stats["waited"] += 1
+                logger.warning(f"Disk budget exhausted, {label} job waiting for space "
+                               f"(used {used // _MB} MB, free {free // _MB} MB)")
+            _waiting += 1
+            try:
+                # Re-check periodically too: space can be freed outside jobs
+                await asyncio.wait_for(_space_changed.wait(), min(remaining, 10))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                _waiting -= 1
+
+
+async def _notify_space():
+    async with _space_changed:
+        _space_changed.notify_all()
+
+
+@asynccontextmanager
+async def job(label: str = "job"):
+    """
+    Run a download job in its own directory; yields the directory path.
+
+    Nested calls reuse the outer job's directory. Raises ``DiskFull`` when
+    no space frees up in time.
+    """
+    if _current.get() is not None:
+        yield _current.get()
+        return
+
+    await _admit(label)
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    path = tempfile.mkdtemp(prefix=f"{label}_", dir=JOBS_DIR)
+    _active[path] = time.monotonic()
+    token = _current.set(path)
+    try:
+        yield path
+    finally:
+        _current.reset(token)
+        _active.pop(path, None)
+        await asyncio.to_thread(shutil.rmtree, path, True)
+        await _notify_space()
+
+
+def _remove(path: str) -> int:
+    size = _entry_size(path)
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except OSError:
+            return 0
+    return size
+
+
+def _sweep(max_age: float | None) -> tuple[int, int]:
+    """
+    Remove orphans: job dirs without a running job, and loose entries in
+    ``downloads/`` older than ``max_age`` (all of them when None). Job dirs
+    younger than ``JOB_DIR_GRACE`` are left alone unless ``max_age`` is None
+    (startup, when no job runs): this thread may list a new job's dir before
+    ``job()`` has marked it active.
+    """
+    removed = freed = 0
+    now = time.time()
+    if not os.path.isdir(ROOT):
+        return removed, freed
+    for entry in os.scandir(ROOT):
+        if entry.name == "jobs" and entry.is_dir():
+            for job_entry in os.scandir(entry.path):
+                if job_entry.path in _active:
+                    continue
+                if max_age is not None:
+                    try:
+                        if now - job_entry.stat(follow_symlinks=False).st_mtime < JOB_DIR_GRACE:
+                            continue
+                    except OSError:
+                        continue
+                freed += _remove(job_entry.path)
+                removed += 1
+            continue
+        if entry.name == RECENT_DIR_NAME and max_age is not None:
+            continue
+        try:
+            age = now - entry.stat(follow_symlinks=False).st_mtime
+        except OSError:
+            continue
+        if max_age is None or age > max_age:
+            freed += _remove(entry.path)
+            removed += 1
+    return removed, freed
+
+
+async def sweep(max_age: float | None = ORPHAN_MAX_AGE) -> tuple[int, int]:
+    """Sweep orphans off the loop; returns ``(entries removed, bytes freed)``."""
+    removed, freed = await asyncio.to_thread(_sweep, max_age)
+    stats["swept_entries"] += removed
+    stats["swept_bytes"] += freed
+    if removed:
+        logger.info(f"Disk sweep: removed {removed} orphan(s), freed {freed // _MB} MB")
+        await _notify_space()
+    return removed, freed
+
+
+async def usage() -> dict:
+    """Disk usage metrics for logs and monitoring."""
+    used, free = await asyncio.to_thread(_disk_state)
+    return {
+        "used_bytes": used,
+        "free_bytes": free,
+        "quota_bytes": DISK_QUOTA_MB * _MB,
+        "active_jobs": len(_active),
+        "waiting_jobs": _waiting,
+        **stats,
+    }
+
+
+async def startup():
+    """Clear everything a previous run left in ``downloads/``."""
+    os.makedirs(ROOT, exist_ok=True)
+    await sweep(max_age=None)
+    os.makedirs(JOBS_DIR, exist_ok=True)
+
+
+async def sweeper():
+    """Background task: sweep orphans and log disk usage every ``SWEEP_INTERVAL``."""
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        try:
+            await sweep()
+            u = await usage()
+            logger.info(
+                f"Disk: {u['used_bytes'] // _MB}/{DISK_QUOTA_MB} MB used, {u['free_bytes'] // _MB} MB free, "
+                f"{u['active_jobs']} active / {u['waiting_jobs']} waiting jobs, "
+                f"{u['rejected']} rejected, {u['swept_bytes'] // _MB} MB swept total")
+        except Exception as e:
+            logger.error(f"Disk sweeper error: {e}")
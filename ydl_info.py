@@ -0,0 +1,66 @@
+"""
+Short-lived cache of yt-dlp info dicts, keyed by canonical URL.
+
+Extraction (the round trips to TikTok/YouTube/...) is done once with
+``extract_info(download=False)``; downloads then re-run format selection
+on a copy of the cached dict with ``process_ie_result``, the same path
+``--load-info-json`` uses. Processed formats carry their own headers and
+cookies, so a different ``YoutubeDL`` instance can download them.
+
+Retries with another format and the MP3 conversion of a video sent
+moments earlier therefore skip extraction entirely.
+"""
+
+import asyncio
+import copy
+import json
+import logging
+import os
+
+import yt_dlp
+
+import url_canonical
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Signed media URLs outlive this comfortably (TikTok/YouTube: hours)
+INFO_TTL = int(os.getenv("YDL_INFO_TTL_SECONDS", "600"))
+
+# Options that change what the extractor returns; the rest (format,
+# outtmpl, hooks, postprocessors) only matter when downloading.
+_EXTRACTOR_OPTS = ('cookiefile', 'extractor_args')
+_DOWNLOAD_ONLY_OPTS = ('format', 'outtmpl', 'progress_hooks', 'postprocessors', 'merge_output_format')
+
+_infos = TTLCache(ttl=INFO_TTL, maxsize=128)
+
+
+def _key(url: str, opts: dict) -> str:
+    extractor_opts = {k: opts[k] for k in _EXTRACTOR_OPTS if k in opts}
+    return f"{url_canonical.normalize(url)}|{json.dumps(extractor_opts, sort_keys=True)}"
+
+
+def _extract(url: str, opts: dict) -> dict:
+    opts = {k: v for k, v in opts.items() if k not in _DOWNLOAD_ONLY_OPTS}
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        return ydl.extract_info(url, download=False)
+
+
+async def get_info(url: str, opts: dict) -> dict:
+    """
+    Return a private copy of the info dict for ``url`` as extracted with
+    ``opts``. Extraction runs off the loop and at most once per TTL;
+    extractor errors propagate as ``yt_dlp.utils.DownloadError``.
+    """
+    info = await _infos.get_or_load(_key(url, opts), lambda: asyncio.to_thread(_extract, url, opts))
+    return copy.deepcopy(info)
+
+
+def invalidate(url: str, opts: dict):
+    """Drop the cached info for ``url`` (e.g. after its media URLs failed)."""
+    _infos.pop(_key(url, opts))
+
+
+def download(ydl: yt_dlp.YoutubeDL, info: dict) -> dict:
+    """Select formats with ``ydl``'s options and download them from ``info``."""
+    return ydl.process_ie_result(info, download=True)